@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""
+Compare the networkx and sparse numpy/scipy PageRank backends of the repo map.
+
+    python benchmark/repomap_rank.py
+    python benchmark/repomap_rank.py --files 50000 --skip-sample
+"""
+
+import argparse
+import itertools
+import random
+import time
+from pathlib import Path
+
+from opta.dump import dump  # noqa
+from opta.repomap import RepoMap, SymbolGraph, Tag, find_src_files
+
+SAMPLE_CODE_BASE = Path(__file__).parent.parent / "tests" / "fixtures" / "sample-code-base"
+
+
+def get_sample_tags():
+    from opta.io import InputOutput
+
+    root = SAMPLE_CODE_BASE
+    repo_map = RepoMap(root=str(root), io=InputOutput(), map_workers=1)
+    repo_map.TAGS_CACHE = dict()
+
+    files = dict()
+    for fname in find_src_files(str(root)):
+        rel_fname = repo_map.get_rel_fname(fname)
+        files[rel_fname] = list(repo_map.get_tags(fname, rel_fname))
+    return files
+
+
+def get_synthetic_tags(num_files, defs_per_file=10, refs_per_file=10, seed=0):
+    """
+    Each file defines a few idents and references others, with a zipf-ish
+    skew so that a handful of idents are used everywhere.
+    """
+    rng = random.Random(seed)
+
+    num_idents = num_files * defs_per_file
+    idents = [f"ident_{i}" for i in range(num_idents)]
+    cum_weights = list(itertools.accumulate(1.0 / (i + 1) for i in range(num_idents)))
+
+    files = dict()
+    for i in range(num_files):
+        rel_fname = f"pkg{i % 100}/module_{i}.py"
+        tags = [
+            Tag(rel_fname, rel_fname, line, idents[i * defs_per_file + line], "def")
+            for line in range(defs_per_file)
+        ]
+        for name in rng.choices(idents, cum_weights=cum_weights, k=refs_per_file):
+            tags.append(Tag(rel_fname, rel_fname, -1, name, "ref"))
+        files[rel_fname] = tags
+
+    return files
+
+
+def time_backend(files, backend, personalization):
+    graph = SymbolGraph(backend=backend)
+
+    start = time.time()
+    for rel_fname, tags in files.items():
+        graph.update_file(rel_fname, 0, tags)
+    graph.set_context(set(), set())
+    graph.refresh_edges()
+    build_time = time.time() - start
+
+    start = time.time()
+    ranked, ranked_definitions = graph.rank(personalization)
+    cold_rank_time = time.time() - start
+
+    # A second ranking with the graph unchanged, as on most repo map refreshes
+    start = time.time()
+    graph.rank(personalization)
+    warm_rank_time = time.time() - start
+
+    num_edges = sum(len(edges) for edges in graph.ident_edges.values())
+    return dict(
+        backend=backend,
+        files=len(files),
+        edges=num_edges,
+        build=build_time,
+        rank=cold_rank_time,
+        warm_rank=warm_rank_time,
+        ranked=ranked,
+    )
+
+
+def compare(name, files):
+    personalization = {rel_fname: 1.0 for rel_fname in list(files)[:3]}
+
+    print(f"## {name}")
+    results = []
+    for backend in ("networkx", "sparse"):
+        res = time_backend(files, backend, personalization)
+        results.append(res)
+        print(
+            f"{backend:>8}: {res['files']} files, {res['edges']} edges,"
+            f" build {res['build']:.3f}s, rank {res['rank']:.3f}s,"
+            f" warm rank {res['warm_rank']:.3f}s"
+        )
+
+    nx_ranked = results[0]["ranked"]
+    sp_ranked = results[1]["ranked"]
+    max_diff = max((abs(rank - sp_ranked[node]) for node, rank in nx_ranked.items()), default=0)
+    print(f"max rank difference: {max_diff:.2e}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=50000, help="Files in the synthetic repo")
+    parser.add_argument("--skip-sample", action="store_true", help="Skip the sample code base")
+    args = parser.parse_args()
+
+    if not args.skip_sample:
+        compare("tests/fixtures/sample-code-base", get_sample_tags())
+
+    compare(f"synthetic {args.files} file repo", get_synthetic_tags(args.files))
+
+
+if __name__ == "__main__":
+    main()
@@ -265,6 +265,15 @@ def get_parser(default_config_files, git_root):
         default=2,
         help="Multiplier for map tokens when no files are specified (default: 2)",
     )
+    group.add_argument(
+        "--map-workers",
+        type=int,
+        default=None,
+        help=(
+            "Number of worker processes for the initial repo map scan, use 1 to disable"
+            " (default: number of CPUs)"
+        ),
+    )
 
     ##########
     group = parser.add_argument_group("History Files")
@@ -470,6 +479,15 @@ def get_parser(default_config_files, git_root):
         default=True,
         help="Enable/disable commits when repo is found dirty (default: True)",
     )
+    group.add_argument(
+        "--background-commits",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=(
+            "Enable/disable making auto commits in the background, so the next prompt is"
+            " available while the commit message is generated (default: False)"
+        ),
+    )
     group.add_argument(
         "--attribute-author",
         action=argparse.BooleanOptionalAction,
@@ -584,6 +602,24 @@ def get_parser(default_config_files, git_root):
         help="Run tests, fix problems found and then exit",
         default=False,
     )
+    group.add_argument(
+        "--stop-on-failed-edit",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=(
+            "Enable/disable stopping a streaming response at the first edit that fails to"
+            " match, to ask for a fix right away (default: False)"
+        ),
+    )
+    group.add_argument(
+        "--cmd-output-tokens",
+        type=int,
+        default=8192,
+        help=(
+            "Condense /run and /test output added to the chat to about this many tokens,"
+            " keeping failures, the first and the last lines (default: 8192, 0 to keep it all)"
+        ),
+    )
 
     ##########
     group = parser.add_argument_group("Analytics")
@@ -0,0 +1,95 @@
+"""
+A single asyncio event loop, running on a daemon thread, which multiplexes
+background LLM requests like cache warming pings and weak model calls, and
+lets one process drive many sessions without a thread per request.
+
+    from opta.async_loop import get_async_loop
+
+    future = get_async_loop().submit(model.send_completion_async(...))
+    hash_object, completion = future.result()
+"""
+
+import asyncio
+import threading
+from typing import Optional
+
+from opta.dump import dump  # noqa: F401
+
+
+class AsyncLoop:
+    """An asyncio event loop on its own daemon thread, started on first use."""
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self.loop is None or self.loop.is_closed():
+                self.loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                self.thread = threading.Thread(
+                    target=self._run, args=(self.loop, ready), name="opta-async-loop", daemon=True
+                )
+                self.thread.start()
+                ready.wait()
+            return self.loop
+
+    def _run(self, loop, ready):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop, returning a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """
+        Run a coroutine on the loop and block until it's done. If the wait
+        times out or is interrupted, the coroutine is cancelled so its request
+        doesn't keep running on the loop.
+        """
+        if self.thread is not None and threading.current_thread() is self.thread:
+            coro.close()
+            raise RuntimeError(
+                "AsyncLoop.run() can't be called from the loop's own thread, await the"
+                " coroutine or use submit() instead"
+            )
+
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stop(self):
+        with self._lock:
+            loop, thread = self.loop, self.thread
+            self.loop = None
+            self.thread = None
+
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+
+# Global event loop instance
+_async_loop: Optional[AsyncLoop] = None
+_async_loop_lock = threading.Lock()
+
+
+def get_async_loop() -> AsyncLoop:
+    """Get or create the global event loop."""
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            _async_loop = AsyncLoop()
+        return _async_loop
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import asyncio
 import base64
 import hashlib
 import json
@@ -14,6 +15,7 @@ import threading
 import time
 import traceback
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Optional dependency: used to convert locale codes (eg ``en_US``)
@@ -30,6 +32,7 @@ from rich.console import Console
 
 from opta import __version__, models, prompts, urls, utils
 from opta.analytics import Analytics
+from opta.async_loop import get_async_loop
 from opta.commands import Commands
 from opta.exceptions import LiteLLMExceptions
 from opta.history import ChatSummary
@@ -84,6 +87,9 @@ all_fences = [
     wrap_fence("sourcecode"),
 ]
 
+# Rough size of a token, for budgeting text before it is tokenized
+CHARS_PER_TOKEN = 4
+
 
 class Coder:
     abs_fnames = None
@@ -104,15 +110,18 @@ class Coder:
     temperature = None
     auto_lint = True
     auto_test = False
+    stop_on_failed_edit = False
+    background_commits = False
     test_cmd = None
     lint_outcome = None
     test_outcome = None
     multi_response_content = ""
     partial_response_content = ""
+    mdstream = None
     commit_before_message = []
     message_cost = 0.0
     add_cache_headers = False
-    cache_warming_thread = None
+    cache_warming_task = None
     num_cache_warming_pings = 0
     suggest_shell_commands = True
     detect_urls = True
@@ -307,6 +316,7 @@ class Coder:
         show_diffs=False,
         auto_commits=True,
         dirty_commits=True,
+        background_commits=False,
         dry_run=False,
         map_tokens=1024,
         verbose=False,
@@ -317,10 +327,12 @@ class Coder:
         restore_chat_history=False,
         auto_lint=True,
         auto_test=False,
+        stop_on_failed_edit=False,
         lint_cmds=None,
         test_cmd=None,
         opta_commit_hashes=None,
         map_mul_no_files=8,
+        map_workers=None,
         commands=None,
         summarizer=None,
         total_cost=0.0,
@@ -405,12 +417,14 @@ class Coder:
         self.io = io
 
         self.shell_commands = []
+        self.reset_streamed_edits()
 
         if not auto_commits:
             dirty_commits = False
 
         self.auto_commits = auto_commits
         self.dirty_commits = dirty_commits
+        self.background_commits = background_commits
 
         self.dry_run = dry_run
         self.pretty = self.io.pretty
@@ -505,6 +519,7 @@ class Coder:
                 max_inp_tokens,
                 map_mul_no_files=map_mul_no_files,
                 refresh=map_refresh,
+                map_workers=map_workers,
             )
 
         self.summarizer = summarizer or ChatSummary(
@@ -516,10 +531,17 @@ class Coder:
         self.summarized_done_messages = []
         self.summarizing_messages = None
 
+        self.repo_map_thread = None
+        self.repo_map_lock = threading.Lock()
+        self.repo_map_next_request = None
+        self.repo_map_building_key = None
+        self.precomputed_repo_map = None
+
         if not self.done_messages and restore_chat_history:
-            history_md = self.io.read_text(self.io.chat_history_file)
-            if history_md:
-                self.done_messages = utils.split_chat_history_markdown(history_md)
+            # Only read as much history as the main model could ever be sent
+            max_input_tokens = self.main_model.info.get("max_input_tokens") or 4096
+            self.done_messages = self.io.read_chat_history(max_input_tokens * CHARS_PER_TOKEN)
+            if self.done_messages:
                 self.summarize_start()
 
         # Linting and testing
@@ -528,6 +550,7 @@ class Coder:
         self.setup_lint_cmds(lint_cmds)
         self.lint_cmds = lint_cmds
         self.auto_test = auto_test
+        self.stop_on_failed_edit = stop_on_failed_edit
         self.test_cmd = test_cmd
 
         # validate the functions jsonschema
@@ -710,7 +733,17 @@ class Coder:
         if not self.repo_map:
             return
 
-        cur_msg_text = self.get_cur_message_text()
+        request = self.get_repo_map_request(self.get_cur_message_text())
+
+        if not force_refresh:
+            precomputed = self.repo_map_precompute_end(self.get_repo_map_key(request))
+            if precomputed:
+                _key, repo_content = precomputed
+                return repo_content
+
+        return self.build_repo_map(request, force_refresh=force_refresh)
+
+    def get_repo_map_request(self, cur_msg_text):
         mentioned_fnames = self.get_file_mentions(cur_msg_text)
         mentioned_idents = self.get_ident_mentions(cur_msg_text)
 
@@ -721,12 +754,24 @@ class Coder:
         chat_files = set(self.abs_fnames) | repo_abs_read_only_fnames
         other_files = all_abs_files - chat_files
 
+        return chat_files, other_files, mentioned_fnames, mentioned_idents
+
+    def get_repo_map_key(self, request):
+        # The snapshot key covers the files, their mtimes and the mentions
+        snapshot_key = self.repo_map.get_map_snapshot_key(*request)
+        return snapshot_key, self.repo_map.max_map_tokens, self.repo_map.refresh
+
+    def build_repo_map(self, request, force_refresh=False, quiet=False):
+        chat_files, other_files, mentioned_fnames, mentioned_idents = request
+        all_abs_files = chat_files | other_files
+
         repo_content = self.repo_map.get_repo_map(
             chat_files,
             other_files,
             mentioned_fnames=mentioned_fnames,
             mentioned_idents=mentioned_idents,
             force_refresh=force_refresh,
+            quiet=quiet,
         )
 
         # fall back to global repo map if files in chat are disjoint from rest of repo
@@ -736,6 +781,7 @@ class Coder:
                 all_abs_files,
                 mentioned_fnames=mentioned_fnames,
                 mentioned_idents=mentioned_idents,
+                quiet=quiet,
             )
 
         # fall back to completely unhinted repo
@@ -743,10 +789,80 @@ class Coder:
             repo_content = self.repo_map.get_repo_map(
                 set(),
                 all_abs_files,
+                quiet=quiet,
             )
 
         return repo_content
 
+    def repo_map_precompute_start(self, text=""):
+        """
+        Speculatively build the repo map for the input typed so far, in a
+        background thread, so it's ready when the message is sent.
+
+        This runs on the input loop, so everything but queueing the text is
+        left to the worker.
+        """
+        if not self.repo_map:
+            return
+
+        with self.repo_map_lock:
+            # A running worker picks up the latest text when it finishes
+            self.repo_map_next_request = text
+            if self.repo_map_thread:
+                return
+
+            self.repo_map_thread = threading.Thread(target=self.repo_map_worker, daemon=True)
+            self.repo_map_thread.start()
+
+    def repo_map_worker(self):
+        while True:
+            with self.repo_map_lock:
+                text = self.repo_map_next_request
+                self.repo_map_next_request = None
+                if text is None:
+                    self.repo_map_thread = None
+                    return
+
+            try:
+                # get_cur_message_text() will end the message with a newline
+                request = self.get_repo_map_request(text + "\n")
+                key = self.get_repo_map_key(request)
+
+                with self.repo_map_lock:
+                    if self.precomputed_repo_map and self.precomputed_repo_map[0] == key:
+                        continue
+                    self.repo_map_building_key = key
+
+                repo_content = self.build_repo_map(request, quiet=True)
+                precomputed = (key, repo_content)
+            except Exception as err:
+                # Leave it to the foreground build to report any problems
+                if self.verbose:
+                    self.io.tool_warning(f"Background repo map failed: {err}")
+                precomputed = None
+
+            with self.repo_map_lock:
+                self.precomputed_repo_map = precomputed
+                self.repo_map_building_key = None
+
+    def repo_map_precompute_end(self, key):
+        """
+        Return the precomputed (key, repo_content) if it was built for key,
+        waiting for the worker if it's building it right now.
+        """
+        with self.repo_map_lock:
+            # The real request is here, any queued speculation is moot
+            self.repo_map_next_request = None
+            thread = self.repo_map_thread
+            building = self.repo_map_building_key == key
+
+        if thread and building:
+            thread.join()
+
+        with self.repo_map_lock:
+            if self.precomputed_repo_map and self.precomputed_repo_map[0] == key:
+                return self.precomputed_repo_map
+
     def get_repo_messages(self):
         repo_messages = []
         repo_content = self.get_repo_map()
@@ -871,6 +987,8 @@ class Coder:
         self.message_cost = 0
 
         if self.repo:
+            # Edits and /diff need any commits still being made in the background
+            self.finish_background_commits()
             self.commit_before_message.append(self.repo.get_head_commit_sha())
 
     def run(self, with_message=None, preproc=True):
@@ -896,6 +1014,10 @@ class Coder:
             self.commands.cmd_copy_context()
 
     def get_input(self):
+        # Report the commits finished in the background since the last prompt
+        self.finish_background_commits(wait=False)
+        self.repo_map_precompute_start()
+
         inchat_files = self.get_inchat_relative_files()
         read_only_files = [self.get_rel_fname(fname) for fname in self.abs_read_only_fnames]
         all_files = sorted(set(inchat_files + read_only_files))
@@ -907,6 +1029,7 @@ class Coder:
             self.commands,
             self.abs_read_only_fnames,
             edit_format=edit_format,
+            on_input_pause=self.repo_map_precompute_start,
         )
 
     def preproc_user_input(self, inp):
@@ -1005,14 +1128,22 @@ class Coder:
 
         self.summarize_end()
 
+        # Only one summary at a time, newer messages get folded in by the next one
+        if self.summarizer_thread is not None:
+            return
+
+        # A summary that just landed may have made room already
+        if not self.summarizer.too_big(self.done_messages):
+            return
+
         if self.verbose:
             self.io.tool_output("Starting to summarize chat history.")
 
+        self.summarizing_messages = list(self.done_messages)
         self.summarizer_thread = threading.Thread(target=self.summarize_worker)
         self.summarizer_thread.start()
 
     def summarize_worker(self):
-        self.summarizing_messages = list(self.done_messages)
         try:
             self.summarized_done_messages = self.summarizer.summarize(self.summarizing_messages)
         except ValueError as err:
@@ -1022,29 +1153,57 @@ class Coder:
             self.io.tool_output("Finished summarizing chat history.")
 
     def summarize_end(self):
+        """Swap in a finished summary, without waiting for one that is still running."""
         if self.summarizer_thread is None:
             return
 
+        # Keep using the unsummarized history until the summary is ready
+        if self.summarizer_thread.is_alive():
+            return
+
         self.summarizer_thread.join()
         self.summarizer_thread = None
 
-        if self.summarizing_messages == self.done_messages:
-            self.done_messages = self.summarized_done_messages
+        # Messages completed while summarizing are kept after the summary
+        num = len(self.summarizing_messages)
+        if self.summarized_done_messages and self.done_messages[:num] == self.summarizing_messages:
+            self.done_messages = self.summarized_done_messages + self.done_messages[num:]
         self.summarizing_messages = None
         self.summarized_done_messages = []
 
+    def get_done_messages(self):
+        """
+        The chat history to send. While a summary is running, the history is
+        sent as is unless it has grown far past the summarizer's budget, like a
+        freshly restored history. Then only its latest messages are sent.
+        """
+        self.summarize_end()
+        if self.summarizer_thread is None:
+            return self.done_messages
+
+        max_tokens = self.summarizer.max_tokens * 2
+        if not self.summarizer.too_big(self.done_messages, max_tokens):
+            return self.done_messages
+
+        return self.summarizer.recent(self.done_messages)
+
     def move_back_cur_messages(self, message):
+        done = list(self.cur_messages)
         self.done_messages += self.cur_messages
         self.summarize_start()
 
         # TODO check for impact on image messages
         if message:
-            self.done_messages += [
+            added = [
                 dict(role="user", content=message),
                 dict(role="assistant", content="Ok."),
             ]
+            self.done_messages += added
+            done += added
         self.cur_messages = []
 
+        self.io.log_chat_messages(done)
+
     def normalize_language(self, lang_code):
         """
         Convert a locale code such as ``en_US`` or ``fr`` into a readable
@@ -1275,8 +1434,7 @@ class Coder:
 
         chunks.examples = example_messages
 
-        self.summarize_end()
-        chunks.done = self.done_messages
+        chunks.done = self.get_done_messages()
 
         chunks.repo = self.get_repo_messages()
         chunks.readonly_files = self.get_readonly_files_messages()
@@ -1351,12 +1509,12 @@ class Coder:
         self.warming_pings_left = self.num_cache_warming_pings
         self.cache_warming_chunks = chunks
 
-        if self.cache_warming_thread:
+        if self.cache_warming_task:
             return
 
-        def warm_cache_worker():
+        async def warm_cache_worker():
             while self.ok_to_warm_cache:
-                time.sleep(1)
+                await asyncio.sleep(1)
                 if self.warming_pings_left <= 0:
                     continue
                 now = time.time()
@@ -1370,7 +1528,7 @@ class Coder:
                 kwargs["max_tokens"] = 1
 
                 try:
-                    completion = litellm.completion(
+                    completion = await litellm.acompletion(
                         model=self.main_model.name,
                         messages=self.cache_warming_chunks.cacheable_messages(),
                         stream=False,
@@ -1387,9 +1545,8 @@ class Coder:
                 if self.verbose:
                     self.io.tool_output(f"Warmed {format_tokens(cache_hit_tokens)} cached tokens.")
 
-        self.cache_warming_thread = threading.Timer(0, warm_cache_worker)
-        self.cache_warming_thread.daemon = True
-        self.cache_warming_thread.start()
+        # Pings share one event loop with the other background requests
+        self.cache_warming_task = get_async_loop().submit(warm_cache_worker())
 
         return chunks
 
@@ -1584,9 +1741,20 @@ class Coder:
 
         edited = self.apply_updates()
 
+        lint_results = None
         if edited:
             self.opta_edited_files.update(edited)
-            saved_message = self.auto_commit(edited)
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                # The built in linters only read the files, so they can check
+                # the edits while the commit message is being generated
+                if (
+                    self.auto_lint
+                    and not self.reflected_message
+                    and not self.linter.has_lint_cmds()
+                ):
+                    lint_results = executor.submit(self.lint_files, edited)
+                saved_message = self.auto_commit(edited)
 
             if not saved_message and hasattr(self.gpt_prompts, "files_content_gpt_edits_no_repo"):
                 saved_message = self.gpt_prompts.files_content_gpt_edits_no_repo
@@ -1597,7 +1765,10 @@ class Coder:
             return
 
         if edited and self.auto_lint:
-            lint_errors = self.lint_edited(edited)
+            # Lint commands may rewrite the files a background commit is still committing
+            if self.linter.has_lint_cmds():
+                self.finish_background_commits()
+            lint_errors = self.lint_edited(edited, lint_results)
             self.auto_commit(edited, context="Ran the linter")
             self.lint_outcome = not lint_errors
             if lint_errors:
@@ -1678,13 +1849,22 @@ class Coder:
         self.io.tool_error(res)
         self.io.offer_url(urls.token_limits)
 
-    def lint_edited(self, fnames):
-        res = ""
-        for fname in fnames:
-            if not fname:
-                continue
-            errors = self.linter.lint(self.abs_root_path(fname))
+    def lint_files(self, fnames):
+        fnames = [self.abs_root_path(fname) for fname in fnames if fname]
+        return self.linter.lint_files(fnames)
+
+    def lint_edited(self, fnames, results=None):
+        """
+        Lint the edited files and show any errors. results can be a future of
+        lint_files(), if the files were linted in the background.
+        """
+        if results is None:
+            results = self.lint_files(fnames)
+        else:
+            results = results.result()
 
+        res = ""
+        for errors in results:
             if errors:
                 res += "\n"
                 res += errors
@@ -1789,6 +1969,7 @@ class Coder:
 
         self.partial_response_content = ""
         self.partial_response_function_call = dict()
+        self.reset_streamed_edits()
 
         self.io.log_llm_history("TO LLM", format_messages(messages))
 
@@ -1955,6 +2136,12 @@ class Coder:
                 self._stop_waiting_spinner()
             self.partial_response_content += text
 
+            if text and not self.streamed_edit_errors:
+                self.check_streamed_edits()
+                if self.streamed_edit_errors and self.stop_on_failed_edit:
+                    self.stop_streamed_response(completion)
+                    break
+
             if self.show_pretty():
                 self.live_incremental_response(False)
             elif text:
@@ -1974,6 +2161,56 @@ class Coder:
         if not received_content:
             self.io.tool_warning("Empty response received from LLM. Check your provider account?")
 
+    def reset_streamed_edits(self):
+        self.streamed_edits = []
+        self.streamed_edits_scanned = 0
+        # The end of the last edit checked, the failed one if any
+        self.streamed_edits_end = 0
+        self.streamed_edit_errors = []
+        # full_path -> content after the streamed edits checked so far
+        self.streamed_contents = dict()
+
+    def check_streamed_edits(self):
+        """
+        Dry run each edit as soon as the streaming response completes it, so
+        edits which won't apply are reported without waiting for the rest of
+        the response. Edit formats which can spot completed edits override this.
+        """
+        pass
+
+    def stop_streamed_response(self, completion):
+        """
+        Give up on the rest of a response once an edit in it has failed, so
+        the failure can be reflected back to the LLM right away.
+        """
+        # Drop anything after the failed edit, the edits up to it are still applied
+        if self.streamed_edits_end:
+            self.partial_response_content = self.partial_response_content[: self.streamed_edits_end]
+
+        # Hang up on the provider, rather than paying for tokens nobody will read
+        for stream in (completion, getattr(completion, "completion_stream", None)):
+            close = getattr(stream, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception:
+                    pass
+
+        # Finish showing the response before saying why it stopped
+        if self.mdstream:
+            self.live_incremental_response(True)
+            self.mdstream = None
+
+        self.io.tool_warning("Stopped the response early, to ask for a fix to the failed edit.")
+
+    def streamed_edit_error(self, message):
+        self.streamed_edit_errors.append(message)
+
+        # Show it right away, the streamed response carries on below it
+        if self.mdstream:
+            self.mdstream.pause()
+        self.io.tool_warning(message)
+
     def live_incremental_response(self, final):
         show_resp = self.render_incremental_response(final)
         # Apply any reasoning tag formatting
@@ -2379,6 +2616,13 @@ class Coder:
         if not context:
             context = self.get_context_from_history(self.cur_messages)
 
+        if self.background_commits:
+            # The commit is reported once it's made, by finish_background_commits()
+            self.repo.get_commit_queue().submit(
+                fnames=edited, context=context, opta_edits=True, coder=self
+            )
+            return self.gpt_prompts.files_content_gpt_edits_no_repo
+
         try:
             res = self.repo.commit(fnames=edited, context=context, opta_edits=True, coder=self)
             if res:
@@ -2394,6 +2638,17 @@ class Coder:
             self.io.tool_error(f"Unable to commit: {str(err)}")
             return
 
+    def finish_background_commits(self, wait=True):
+        """Report the commits made in the background, waiting for any still pending."""
+        if not self.repo or not self.repo.commit_queue:
+            return
+
+        for res in self.repo.commit_queue.finished(wait):
+            if res:
+                commit_hash, commit_message = res
+                self.io.tool_output(f"Commit {commit_hash} {commit_message}", bold=True)
+                self.show_auto_commit_outcome(res)
+
     def show_auto_commit_outcome(self, res):
         commit_hash, commit_message = res
         self.last_opta_commit_hash = commit_hash
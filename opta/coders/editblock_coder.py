@@ -1,7 +1,10 @@
+import bisect
 import difflib
 import math
 import re
 import sys
+import time
+from collections import Counter, OrderedDict, defaultdict
 from difflib import SequenceMatcher
 from pathlib import Path
 
@@ -38,6 +41,102 @@ class EditBlockCoder(Coder):
     def apply_edits_dry_run(self, edits):
         return self.apply_edits(edits, dry_run=True)
 
+    def check_streamed_edits(self):
+        content = self.partial_response_content
+
+        # Only look for a newly completed block in the lines that arrived since the last check
+        scan_from = self.streamed_edits_scanned
+        self.streamed_edits_scanned = content.rfind("\n") + 1
+
+        end = None
+        for match in block_end_re.finditer(content, scan_from):
+            end = match.end()
+        if end is None:
+            return
+        self.streamed_edits_end = end
+
+        try:
+            edits = list(
+                find_original_update_blocks(
+                    content[:end],
+                    self.fence,
+                    self.get_inchat_relative_files(),
+                )
+            )
+        except ValueError as err:
+            self.streamed_edit_error(err.args[0])
+            return
+
+        edits = [edit for edit in edits if edit[0] is not None]
+
+        # Where each edit ends, so a response stopped at a failed edit drops the ones after it
+        edit_ends = [match.end() for match in block_end_re.finditer(content, 0, end)]
+
+        for i in range(len(self.streamed_edits), len(edits)):
+            self.streamed_edits.append(edits[i])
+            if i < len(edit_ends):
+                self.streamed_edits_end = edit_ends[i]
+            self.check_streamed_edit(edits[i])
+            if self.streamed_edit_errors:
+                return
+
+    def check_streamed_edit(self, edit):
+        """Dry run one completed edit, on top of the ones before it in the response."""
+        path, original, updated = edit
+
+        if not original.strip():
+            # Creating or appending to a file always works
+            full_path = self.abs_root_path(path)
+            content = ""
+            if Path(full_path).exists() or full_path in self.streamed_contents:
+                content = self.read_edit_text(full_path, self.streamed_contents) or ""
+            updated = strip_quoted_wrapping(updated, full_path, self.fence)
+            self.streamed_contents[full_path] = content + updated
+            return
+
+        path, full_path, new_content = self.apply_edit(edit, self.streamed_contents)
+        if new_content:
+            self.streamed_contents[full_path] = new_content
+            return
+
+        self.streamed_edit_error(
+            f"The SEARCH/REPLACE block for {path} doesn't match the file, it will fail to apply"
+        )
+
+    def read_edit_text(self, full_path, contents=None):
+        if contents and full_path in contents:
+            return contents[full_path]
+        return self.io.read_text(full_path)
+
+    def apply_edit(self, edit, contents=None):
+        """
+        Work out which file an edit applies to and what its content becomes.
+        Returns (path, full_path, new_content), new_content is None if it failed.
+
+        contents overrides what's on disk for files earlier edits have changed.
+        """
+        path, original, updated = edit
+        full_path = self.abs_root_path(path)
+        new_content = None
+
+        if Path(full_path).exists() or (contents and full_path in contents):
+            content = self.read_edit_text(full_path, contents)
+            new_content = do_replace(full_path, content, original, updated, self.fence)
+
+        # If the edit failed, and
+        # this is not a "create a new file" with an empty original...
+        # https://github.com/Aider-AI/aider/issues/2258
+        if not new_content and original.strip():
+            # try patching any of the other files in the chat
+            for full_path in self.abs_fnames:
+                content = self.read_edit_text(full_path, contents)
+                new_content = do_replace(full_path, content, original, updated, self.fence)
+                if new_content:
+                    path = self.get_rel_fname(full_path)
+                    break
+
+        return path, full_path, new_content
+
     def apply_edits(self, edits, dry_run=False):
         failed = []
         passed = []
@@ -45,24 +144,7 @@ class EditBlockCoder(Coder):
 
         for edit in edits:
             path, original, updated = edit
-            full_path = self.abs_root_path(path)
-            new_content = None
-
-            if Path(full_path).exists():
-                content = self.io.read_text(full_path)
-                new_content = do_replace(full_path, content, original, updated, self.fence)
-
-            # If the edit failed, and
-            # this is not a "create a new file" with an empty original...
-            # https://github.com/Aider-AI/aider/issues/2258
-            if not new_content and original.strip():
-                # try patching any of the other files in the chat
-                for full_path in self.abs_fnames:
-                    content = self.io.read_text(full_path)
-                    new_content = do_replace(full_path, content, original, updated, self.fence)
-                    if new_content:
-                        path = self.get_rel_fname(full_path)
-                        break
+            path, full_path, new_content = self.apply_edit(edit)
 
             updated_edits.append((path, original, updated))
 
@@ -131,27 +213,233 @@ def prep(content):
     return content, lines
 
 
-def perfect_or_whitespace(whole_lines, part_lines, replace_lines):
+class LineIndex:
+    """
+    Where each line of a file occurs, both as is and without its leading
+    whitespace, so a SEARCH block can be located by looking up one of its
+    lines instead of comparing it against every window of the file.
+
+    The positions are hashed once, for the file as it was first read. Each
+    applied edit makes a new index which shares them, and just records which
+    runs of the original lines survive and where lines were inserted.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.stripped_lines = [line.lstrip() for line in lines]
+
+        # line -> positions in the original lines
+        self.exact = defaultdict(list)
+        self.stripped = defaultdict(list)
+        for i, (line, stripped) in enumerate(zip(self.lines, self.stripped_lines)):
+            self.exact[line].append(i)
+            self.stripped[stripped].append(i)
+
+        # (start, orig_start, length) of each surviving run of original lines
+        self.runs = [(0, 0, len(lines))]
+        # (start, end) of each run of lines inserted by edits
+        self.inserted = []
+
+        self.token_lines = None
+
+    def replace(self, start, num, new_lines, lines):
+        """Index lines, made by putting new_lines in place of self.lines[start : start + num]."""
+        end = start + num
+        delta = len(new_lines) - num
+
+        runs = []
+        for run_start, orig_start, length in self.runs:
+            run_end = run_start + length
+            if run_start < start:
+                runs.append((run_start, orig_start, min(run_end, start) - run_start))
+            if run_end > end:
+                skip = max(end - run_start, 0)
+                runs.append((run_start + skip + delta, orig_start + skip, length - skip))
+
+        inserted = []
+        for ins_start, ins_end in self.inserted:
+            if ins_start < start:
+                inserted.append((ins_start, min(ins_end, start)))
+            if ins_end > end:
+                inserted.append((max(ins_start, end) + delta, ins_end + delta))
+        if new_lines:
+            inserted.append((start, start + len(new_lines)))
+
+        index = object.__new__(type(self))
+        index.lines = lines
+        index.stripped_lines = (
+            self.stripped_lines[:start]
+            + [line.lstrip() for line in new_lines]
+            + self.stripped_lines[end:]
+        )
+        index.exact = self.exact
+        index.stripped = self.stripped
+        index.runs = [run for run in runs if run[2] > 0]
+        index.inserted = sorted(span for span in inserted if span[1] > span[0])
+        index.token_lines = None
+        return index
+
+    def positions(self, key, stripped=False):
+        """The current positions of the lines which equal key, in file order."""
+        positions = []
+
+        orig_positions = (self.stripped if stripped else self.exact).get(key, ())
+        if len(self.runs) == 1:
+            run_start, orig_start, length = self.runs[0]
+            positions = [
+                run_start + pos - orig_start
+                for pos in orig_positions
+                if orig_start <= pos < orig_start + length
+            ]
+        else:
+            orig_starts = [orig_start for _start, orig_start, _length in self.runs]
+            for pos in orig_positions:
+                run = bisect.bisect_right(orig_starts, pos) - 1
+                if run < 0:
+                    continue
+                run_start, orig_start, length = self.runs[run]
+                if pos < orig_start + length:
+                    positions.append(run_start + pos - orig_start)
+
+        lines = self.stripped_lines if stripped else self.lines
+        for ins_start, ins_end in self.inserted:
+            positions += [i for i in range(ins_start, ins_end) if lines[i] == key]
+
+        if self.inserted:
+            positions.sort()
+        return positions
+
+    def find_windows(self, keys, stripped=False):
+        """
+        Yield, in file order, the start of each window of len(keys) lines
+        that might match keys, anchored on the key that occurs least often.
+        """
+        num_keys = len(keys)
+        if not num_keys:
+            yield from range(len(self.lines) + 1)
+            return
+
+        counts = self.stripped if stripped else self.exact
+        anchor = min(range(num_keys), key=lambda j: len(counts.get(keys[j], ())))
+        last_start = len(self.lines) - num_keys
+        for pos in self.positions(keys[anchor], stripped):
+            start = pos - anchor
+            if 0 <= start <= last_start:
+                yield start
+
+    def get_token_lines(self):
+        """word -> the lines it occurs in, for fuzzy matching."""
+        if self.token_lines is None:
+            token_lines = defaultdict(list)
+            for i, line in enumerate(self.lines):
+                for token in set(TOKEN_RE.findall(line)):
+                    token_lines[token].append(i)
+            self.token_lines = token_lines
+        return self.token_lines
+
+    def find_fuzzy_windows(self, part_lines, max_windows):
+        """
+        The likeliest starts of windows which resemble part_lines, ranked by how
+        many of the words on each line they share, at the same offset.
+        """
+        token_lines = self.get_token_lines()
+
+        votes = Counter()
+        for j, line in enumerate(part_lines):
+            for token in set(TOKEN_RE.findall(line)):
+                lines = token_lines.get(token, ())
+                # Words found all over the file don't say where the block is
+                if len(lines) > FUZZY_COMMON_TOKEN_LINES:
+                    continue
+                for i in lines:
+                    votes[max(i - j, 0)] += 1
+
+        return [start for start, _count in votes.most_common(max_windows)]
+
+    def find(self, part_lines):
+        """Yield the start of each window which exactly matches part_lines."""
+        num = len(part_lines)
+        for i in self.find_windows(part_lines):
+            if self.lines[i : i + num] == part_lines:
+                yield i
+
+    def find_stripped(self, part_lines):
+        """Yield the start of each window which matches part_lines but for leading whitespace."""
+        stripped = [line.lstrip() for line in part_lines]
+        num = len(stripped)
+        for i in self.find_windows(stripped, stripped=True):
+            if self.stripped_lines[i : i + num] == stripped:
+                yield i
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Fuzzy matching only checks the windows which share the most words with the
+# SEARCH block, ignoring words in more than this many lines, for a limited time
+FUZZY_CANDIDATES = 10
+FUZZY_COMMON_TOKEN_LINES = 200
+FUZZY_TIME_BUDGET = 0.5
+
+# content -> LineIndex, for the most recently edited versions of files
+line_indexes = OrderedDict()
+MAX_LINE_INDEXES = 8
+
+
+def get_line_index(whole):
+    """
+    Index the lines of a file's content.
+
+    Every edit block, and every retry of one against another file, looks up
+    the same content. An edit's result is indexed from the content it edited,
+    so a file is only hashed once no matter how many blocks are applied to it.
+    """
+    index = line_indexes.get(whole)
+    if index is None:
+        index = LineIndex(whole.splitlines(keepends=True))
+    remember_line_index(whole, index)
+    return index
+
+
+def remember_line_index(whole, index):
+    line_indexes[whole] = index
+    line_indexes.move_to_end(whole)
+    while len(line_indexes) > MAX_LINE_INDEXES:
+        line_indexes.popitem(last=False)
+
+
+def replace_lines_at(whole_lines, start, num, new_lines, index):
+    """Replace whole_lines[start : start + num] and index the resulting content."""
+    lines = whole_lines[:start] + new_lines + whole_lines[start + num :]
+    res = "".join(lines)
+    remember_line_index(res, index.replace(start, num, new_lines, lines))
+    return res
+
+
+def perfect_or_whitespace(whole_lines, part_lines, replace_lines, index=None):
+    if index is None:
+        index = LineIndex(whole_lines)
+
     # Try for a perfect match
-    res = perfect_replace(whole_lines, part_lines, replace_lines)
+    res = perfect_replace(whole_lines, part_lines, replace_lines, index)
     if res:
         return res
 
     # Try being flexible about leading whitespace
-    res = replace_part_with_missing_leading_whitespace(whole_lines, part_lines, replace_lines)
+    res = replace_part_with_missing_leading_whitespace(
+        whole_lines, part_lines, replace_lines, index
+    )
     if res:
         return res
 
 
-def perfect_replace(whole_lines, part_lines, replace_lines):
-    part_tup = tuple(part_lines)
+def perfect_replace(whole_lines, part_lines, replace_lines, index=None):
+    if index is None:
+        index = LineIndex(whole_lines)
+
     part_len = len(part_lines)
 
-    for i in range(len(whole_lines) - part_len + 1):
-        whole_tup = tuple(whole_lines[i : i + part_len])
-        if part_tup == whole_tup:
-            res = whole_lines[:i] + replace_lines + whole_lines[i + part_len :]
-            return "".join(res)
+    for i in index.find(part_lines):
+        return replace_lines_at(whole_lines, i, part_len, replace_lines, index)
 
 
 def replace_most_similar_chunk(whole, part, replace):
@@ -161,14 +449,17 @@ def replace_most_similar_chunk(whole, part, replace):
     part, part_lines = prep(part)
     replace, replace_lines = prep(replace)
 
-    res = perfect_or_whitespace(whole_lines, part_lines, replace_lines)
+    index = get_line_index(whole)
+    whole_lines = index.lines
+
+    res = perfect_or_whitespace(whole_lines, part_lines, replace_lines, index)
     if res:
         return res
 
     # drop leading empty line, GPT sometimes adds them spuriously (issue #25)
     if len(part_lines) > 2 and not part_lines[0].strip():
         skip_blank_line_part_lines = part_lines[1:]
-        res = perfect_or_whitespace(whole_lines, skip_blank_line_part_lines, replace_lines)
+        res = perfect_or_whitespace(whole_lines, skip_blank_line_part_lines, replace_lines, index)
         if res:
             return res
 
@@ -180,9 +471,8 @@ def replace_most_similar_chunk(whole, part, replace):
     except ValueError:
         pass
 
-    return
     # Try fuzzy matching
-    res = replace_closest_edit_distance(whole_lines, part, part_lines, replace_lines)
+    res = replace_closest_edit_distance(whole_lines, part, part_lines, replace_lines, index)
     if res:
         return res
 
@@ -240,7 +530,9 @@ def try_dotdotdots(whole, part, replace):
     return whole
 
 
-def replace_part_with_missing_leading_whitespace(whole_lines, part_lines, replace_lines):
+def replace_part_with_missing_leading_whitespace(
+    whole_lines, part_lines, replace_lines, index=None
+):
     # GPT often messes up leading whitespace.
     # It usually does it uniformly across the ORIG and UPD blocks.
     # Either omitting all leading whitespace, or including only some of it.
@@ -258,7 +550,10 @@ def replace_part_with_missing_leading_whitespace(whole_lines, part_lines, replac
     # can we find an exact match not including the leading whitespace
     num_part_lines = len(part_lines)
 
-    for i in range(len(whole_lines) - num_part_lines + 1):
+    if index is None:
+        index = LineIndex(whole_lines)
+
+    for i in index.find_stripped(part_lines):
         add_leading = match_but_for_leading_whitespace(
             whole_lines[i : i + num_part_lines], part_lines
         )
@@ -267,8 +562,7 @@ def replace_part_with_missing_leading_whitespace(whole_lines, part_lines, replac
             continue
 
         replace_lines = [add_leading + rline if rline.strip() else rline for rline in replace_lines]
-        whole_lines = whole_lines[:i] + replace_lines + whole_lines[i + num_part_lines :]
-        return "".join(whole_lines)
+        return replace_lines_at(whole_lines, i, num_part_lines, replace_lines, index)
 
     return None
 
@@ -293,7 +587,7 @@ def match_but_for_leading_whitespace(whole_lines, part_lines):
     return add.pop()
 
 
-def replace_closest_edit_distance(whole_lines, part, part_lines, replace_lines):
+def replace_closest_edit_distance(whole_lines, part, part_lines, replace_lines, index=None):
     similarity_thresh = 0.8
 
     max_similarity = 0
@@ -304,29 +598,49 @@ def replace_closest_edit_distance(whole_lines, part, part_lines, replace_lines):
     min_len = math.floor(len(part_lines) * (1 - scale))
     max_len = math.ceil(len(part_lines) * (1 + scale))
 
-    for length in range(min_len, max_len):
-        for i in range(len(whole_lines) - length + 1):
-            chunk = whole_lines[i : i + length]
-            chunk = "".join(chunk)
-
-            similarity = SequenceMatcher(None, chunk, part).ratio()
-
-            if similarity > max_similarity and similarity:
-                max_similarity = similarity
-                most_similar_chunk_start = i
-                most_similar_chunk_end = i + length
+    if index is None:
+        index = LineIndex(whole_lines)
+
+    # The chunk may start a few lines before or after where its words line up
+    slack = max_len - len(part_lines)
+    deadline = time.monotonic() + FUZZY_TIME_BUDGET
+
+    checked = set()
+    for start in index.find_fuzzy_windows(part_lines, FUZZY_CANDIDATES):
+        for i in range(max(start - slack, 0), start + slack + 1):
+            for length in range(min_len, max_len):
+                if (i, length) in checked or i + length > len(whole_lines):
+                    continue
+                checked.add((i, length))
+
+                chunk = whole_lines[i : i + length]
+                chunk = "".join(chunk)
+
+                matcher = SequenceMatcher(None, chunk, part)
+                if matcher.real_quick_ratio() <= max_similarity:
+                    continue
+                if matcher.quick_ratio() <= max_similarity:
+                    continue
+                similarity = matcher.ratio()
+
+                if similarity > max_similarity and similarity:
+                    max_similarity = similarity
+                    most_similar_chunk_start = i
+                    most_similar_chunk_end = i + length
+
+        if time.monotonic() > deadline:
+            break
 
     if max_similarity < similarity_thresh:
         return
 
-    modified_whole = (
-        whole_lines[:most_similar_chunk_start]
-        + replace_lines
-        + whole_lines[most_similar_chunk_end:]
+    return replace_lines_at(
+        whole_lines,
+        most_similar_chunk_start,
+        most_similar_chunk_end - most_similar_chunk_start,
+        replace_lines,
+        index,
     )
-    modified_whole = "".join(modified_whole)
-
-    return modified_whole
 
 
 DEFAULT_FENCE = ("`" * 3, "`" * 3)
@@ -387,6 +701,9 @@ HEAD = r"^<{5,9} SEARCH>?\s*$"
 DIVIDER = r"^={5,9}\s*$"
 UPDATED = r"^>{5,9} REPLACE\s*$"
 
+# The end of a complete SEARCH/REPLACE block in a streaming response
+block_end_re = re.compile(r"^>{5,9} REPLACE[ \t]*\n", re.MULTILINE)
+
 HEAD_ERR = "<<<<<<< SEARCH"
 DIVIDER_ERR = "======="
 UPDATED_ERR = ">>>>>>> REPLACE"
@@ -600,19 +917,34 @@ def find_filename(lines, fence, valid_fnames):
 
 
 def find_similar_lines(search_lines, content_lines, threshold=0.6):
+    index = get_line_index(content_lines)
+
     search_lines = search_lines.splitlines()
     content_lines = content_lines.splitlines()
 
     best_ratio = 0
     best_match = None
 
-    for i in range(len(content_lines) - len(search_lines) + 1):
-        chunk = content_lines[i : i + len(search_lines)]
-        ratio = SequenceMatcher(None, search_lines, chunk).ratio()
-        if ratio > best_ratio:
-            best_ratio = ratio
-            best_match = chunk
-            best_match_i = i
+    # Only compare the windows that share the most words with the search lines
+    slack = 2
+    deadline = time.monotonic() + FUZZY_TIME_BUDGET
+
+    checked = set()
+    for start in index.find_fuzzy_windows(search_lines, FUZZY_CANDIDATES):
+        for i in range(max(start - slack, 0), start + slack + 1):
+            if i in checked or i + len(search_lines) > len(content_lines):
+                continue
+            checked.add(i)
+
+            chunk = content_lines[i : i + len(search_lines)]
+            ratio = SequenceMatcher(None, search_lines, chunk).ratio()
+            if ratio > best_ratio:
+                best_ratio = ratio
+                best_match = chunk
+                best_match_i = i
+
+        if time.monotonic() > deadline:
+            break
 
     if best_ratio < threshold:
         return ""
@@ -20,7 +20,7 @@ from opta.help import Help, install_help_extra
 from opta.io import CommandCompletionException
 from opta.llm import litellm
 from opta.repo import ANY_GIT_ERROR
-from opta.run_cmd import run_cmd
+from opta.run_cmd import MAX_CHAT_OUTPUT_TOKENS, OutputCondenser, run_cmd
 from opta.scrape import Scraper, install_playwright
 from opta.utils import is_image_file
 
@@ -346,6 +346,8 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
+        self.coder.finish_background_commits()
+
         if not self.coder.repo.is_dirty():
             self.io.tool_warning("No more changes to commit.")
             return
@@ -562,6 +564,8 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
+        self.coder.finish_background_commits()
+
         last_commit = self.coder.repo.get_head_commit()
         if not last_commit or not last_commit.parents:
             self.io.tool_error("This is the first commit in the repository. Cannot undo.")
@@ -666,6 +670,8 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
+        self.coder.finish_background_commits()
+
         current_head = self.coder.repo.get_head_commit_sha()
         if current_head is None:
             self.io.tool_error("Unable to get current commit. The repository might be empty.")
@@ -956,6 +962,8 @@ class Commands:
 
     def cmd_git(self, args):
         "Run a git command (output excluded from chat)"
+        self.coder.finish_background_commits()
+
         combined_output = None
         try:
             args = "git " + args
@@ -1002,8 +1010,19 @@ class Commands:
 
     def cmd_run(self, args, add_on_nonzero_exit=False):
         "Run a shell command and optionally add the output to the chat (alias: !)"
+        max_tokens = getattr(self.args, "cmd_output_tokens", MAX_CHAT_OUTPUT_TOKENS)
+        output = None
+        if max_tokens:
+            output = OutputCondenser(
+                max_tokens, fnames=self.coder.get_all_relative_files(), root=self.coder.root
+            )
+
         exit_status, combined_output = run_cmd(
-            args, verbose=self.verbose, error_print=self.io.tool_error, cwd=self.coder.root
+            args,
+            verbose=self.verbose,
+            error_print=self.io.tool_error,
+            cwd=self.coder.root,
+            output=output,
         )
 
         if combined_output is None:
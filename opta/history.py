@@ -1,8 +1,16 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from opta import models, prompts
+from opta.async_loop import get_async_loop
 from opta.dump import dump  # noqa: F401
 
+# Marks a message that was too long to summarize in full
+TRUNCATED_MESSAGE = "\n...\n"
+
+# Weak model calls made at once when a long history is summarized in chunks
+MAX_SUMMARY_WORKERS = 8
+
 
 class ChatSummary:
     def __init__(self, models=None, max_tokens=1024):
@@ -12,10 +20,26 @@ class ChatSummary:
         self.max_tokens = max_tokens
         self.token_count = self.models[0].token_count
 
-    def too_big(self, messages):
+    def too_big(self, messages, max_tokens=None):
+        if max_tokens is None:
+            max_tokens = self.max_tokens
         sized = self.tokenize(messages)
         total = sum(tokens for tokens, _msg in sized)
-        return total > self.max_tokens
+        return total > max_tokens
+
+    def recent(self, messages):
+        """The latest messages that fit max_tokens, starting with a user message."""
+        total = 0
+        start = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            total += self.token_count(messages[i])
+            if total > self.max_tokens:
+                break
+            start = i
+
+        while start < len(messages) and messages[start]["role"] != "user":
+            start += 1
+        return messages[start:]
 
     def tokenize(self, messages):
         sized = []
@@ -41,7 +65,7 @@ class ChatSummary:
 
         min_split = 4
         if len(messages) <= min_split or depth > 3:
-            return self.summarize_all(messages)
+            return self.summarize_chunked(sized)
 
         tail_tokens = 0
         split_index = len(messages)
@@ -61,33 +85,16 @@ class ChatSummary:
             split_index -= 1
 
         if split_index <= min_split:
-            return self.summarize_all(messages)
+            return self.summarize_chunked(sized)
 
         # Split head and tail
         tail = messages[split_index:]
 
-        # Only size the head once
-        sized_head = sized[:split_index]
-
-        # Precompute token limit (fallback to 4096 if undefined)
-        model_max_input_tokens = self.models[0].info.get("max_input_tokens") or 4096
-        model_max_input_tokens -= 512  # reserve buffer for safety
-
-        keep = []
-        total = 0
-
-        # Iterate in original order, summing tokens until limit
-        for tokens, msg in sized_head:
-            total += tokens
-            if total > model_max_input_tokens:
-                break
-            keep.append(msg)
-        # No need to reverse lists back and forth
-
-        summary = self.summarize_all(keep)
+        # The head is summarized in pieces that fit the weak model
+        summary = self.summarize_chunked(sized[:split_index])
 
         # If the combined summary and tail still fits, return directly
-        summary_tokens = self.token_count(summary)
+        summary_tokens = sum(tokens for tokens, _msg in self.tokenize(summary))
         tail_tokens = sum(tokens for tokens, _ in sized[split_index:])
         if summary_tokens + tail_tokens < self.max_tokens:
             return summary + tail
@@ -95,6 +102,74 @@ class ChatSummary:
         # Otherwise recurse with increased depth
         return self.summarize_real(summary + tail, depth + 1)
 
+    def max_chunk_tokens(self):
+        # Every chunk has to fit whichever model ends up summarizing it
+        max_input_tokens = min(model.info.get("max_input_tokens") or 4096 for model in self.models)
+        return max_input_tokens - 512  # reserve buffer for the prompt and reply
+
+    def split_chunks(self, sized, max_tokens):
+        chunks = []
+        chunk = []
+        total = 0
+        for tokens, msg in sized:
+            if chunk and total + tokens > max_tokens:
+                chunks.append(chunk)
+                chunk = []
+                total = 0
+            chunk.append(msg)
+            total += tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def summarize_chunked(self, sized):
+        """
+        Summarize messages that may not fit the weak model in one go.
+
+        The messages are split into chunks that fit its window and summarized
+        concurrently, then the partial summaries are summarized together.
+        """
+        max_tokens = self.max_chunk_tokens()
+        chunks = self.split_chunks(self.fit_messages(sized, max_tokens), max_tokens)
+
+        while len(chunks) > 1:
+            workers = min(len(chunks), MAX_SUMMARY_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                partials = list(executor.map(self.summarize_all, chunks))
+
+            summaries = [msg for partial in partials for msg in partial]
+            sized = self.fit_messages(self.tokenize(summaries), max_tokens)
+            reduced = self.split_chunks(sized, max_tokens)
+
+            # Summaries too long to combine are shortened until two fit in a chunk
+            if len(reduced) >= len(chunks):
+                sized = self.fit_messages(sized, max_tokens // 2)
+                reduced = self.split_chunks(sized, max_tokens)
+            chunks = reduced
+
+        return self.summarize_all(chunks[0] if chunks else [])
+
+    def fit_messages(self, sized, max_tokens):
+        """Truncate the messages that are bigger than max_tokens."""
+        return [
+            (tokens, msg) if tokens <= max_tokens else self.truncate_message(msg, max_tokens)
+            for tokens, msg in sized
+        ]
+
+    def truncate_message(self, msg, max_tokens):
+        """Cut the end off a message's content, returning its new size and the message."""
+        content = msg.get("content")
+        tokens = self.token_count(msg)
+        if not isinstance(content, str):
+            return tokens, msg
+
+        while tokens > max_tokens and content:
+            content = content[: len(content) * max_tokens // tokens]
+            msg = dict(msg, content=content + TRUNCATED_MESSAGE)
+            tokens = self.token_count(msg)
+
+        return tokens, msg
+
     def summarize_all(self, messages):
         content = ""
         for msg in messages:
@@ -113,7 +188,7 @@ class ChatSummary:
 
         for model in self.models:
             try:
-                summary = model.simple_send_with_retries(summarize_messages)
+                summary = get_async_loop().run(model.simple_send_with_retries(summarize_messages))
                 if summary is not None:
                     summary = prompts.summary_prefix + summary
                     return [dict(role="user", content=summary)]
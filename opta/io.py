@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import functools
 import os
@@ -5,6 +6,7 @@ import shutil
 import signal
 import subprocess
 import time
+import weakref
 import webbrowser
 from collections import defaultdict
 from dataclasses import dataclass
@@ -37,7 +39,8 @@ from opta.mdstream import MarkdownStream
 
 from .dump import dump  # noqa: F401
 from .editor import pipe_editor
-from .utils import is_image_file
+from .session_log import SessionLog, keep_recent
+from .utils import is_image_file, split_chat_history_markdown
 
 # Constants
 NOTIFICATION_MESSAGE = "Aider is waiting for your input"
@@ -234,6 +237,9 @@ class InputOutput:
     bell_on_next_input = False
     notifications_command = None
 
+    # Seconds of no typing before get_input() calls on_input_pause
+    input_pause_delay = 0.3
+
     def __init__(
         self,
         pretty=True,
@@ -333,6 +339,19 @@ class InputOutput:
         self.dry_run = dry_run
 
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        self.chat_history_fh = None
+        self.session_log = None
+        if self.chat_history_file is not None:
+            self.session_log = SessionLog(
+                self.chat_history_file.with_suffix(".jsonl"), started=current_time
+            )
+            # The history from before this run, to import if the session log is new
+            try:
+                self.chat_history_start = self.chat_history_file.stat().st_size
+            except OSError:
+                self.chat_history_start = 0
+
         self.append_chat_history(f"\n# aider chat started at {current_time}\n\n")
 
         self.prompt_session = None
@@ -528,6 +547,7 @@ class InputOutput:
         commands,
         abs_read_only_fnames=None,
         edit_format=None,
+        on_input_pause=None,
     ):
         self.rule()
 
@@ -633,6 +653,17 @@ class InputOutput:
                 # In normal mode, Alt+Enter adds a newline
                 event.current_buffer.insert_text("\n")
 
+        pause_handle = None
+
+        def input_changed(buffer):
+            "Call on_input_pause with the partial input once typing pauses"
+            nonlocal pause_handle
+            if pause_handle:
+                pause_handle.cancel()
+            loop = asyncio.get_running_loop()
+            text = inp + buffer.text
+            pause_handle = loop.call_later(self.input_pause_delay, on_input_pause, text)
+
         while True:
             if multiline_input:
                 show = self.prompt_prefix
@@ -653,6 +684,9 @@ class InputOutput:
                     def get_continuation(width, line_number, is_soft_wrap):
                         return self.prompt_prefix
 
+                    if on_input_pause:
+                        self.prompt_session.default_buffer.on_text_changed += input_changed
+
                     line = self.prompt_session.prompt(
                         show,
                         default=default,
@@ -690,6 +724,8 @@ class InputOutput:
                     self.file_watcher.stop()
                 if self.clipboard_watcher:
                     self.clipboard_watcher.stop()
+                if on_input_pause and self.prompt_session:
+                    self.prompt_session.default_buffer.on_text_changed -= input_changed
 
             if line.strip("\r\n") and not multiline_input:
                 stripped = line.strip("\r\n")
@@ -1127,14 +1163,77 @@ class InputOutput:
             text += "\n"
         if self.chat_history_file is not None:
             try:
-                self.chat_history_file.parent.mkdir(parents=True, exist_ok=True)
-                with self.chat_history_file.open("a", encoding=self.encoding, errors="ignore") as f:
-                    f.write(text)
+                # Keep the file open instead of reopening it for every line
+                if self.chat_history_fh is None:
+                    self.chat_history_file.parent.mkdir(parents=True, exist_ok=True)
+                    self.chat_history_fh = self.chat_history_file.open(
+                        "a", encoding=self.encoding, errors="ignore"
+                    )
+                    # Closed when this InputOutput goes away, or at exit
+                    weakref.finalize(self, self.chat_history_fh.close)
+                self.chat_history_fh.write(text)
+                self.chat_history_fh.flush()
             except (PermissionError, OSError) as err:
                 print(f"Warning: Unable to write to chat history file {self.chat_history_file}.")
                 print(err)
                 self.chat_history_file = None  # Disable further attempts to write
 
+    def log_chat_messages(self, messages):
+        """Record a completed exchange in the session log, with a single write."""
+        if self.session_log is None:
+            return
+        try:
+            if not self.session_log.exists():
+                self.import_chat_history()
+            self.session_log.append(messages)
+            self.session_log.flush()
+        except (PermissionError, OSError) as err:
+            self.disable_session_log(err)
+
+    def import_chat_history(self):
+        """Start a new session log with the markdown history from earlier runs."""
+        if self.chat_history_file is None or not self.chat_history_start:
+            return
+
+        try:
+            with self.chat_history_file.open("rb") as f:
+                history_md = f.read(self.chat_history_start)
+        except FileNotFoundError:
+            return
+
+        # The earlier history is a session of its own, ahead of this run's
+        history_md = history_md.decode(self.encoding, errors="replace")
+        imported = SessionLog(self.session_log.fname, started="imported")
+        imported.append(split_chat_history_markdown(history_md))
+        imported.flush()
+
+    def disable_session_log(self, err):
+        print(f"Warning: Unable to write to chat session log {self.session_log.fname}.")
+        print(err)
+        self.session_log = None  # Disable further attempts to write
+
+    def read_chat_history(self, max_chars):
+        """
+        Return the latest messages of the chat history, up to about max_chars.
+
+        Until this project has a session log, the markdown history is parsed.
+        The first messages logged bring the earlier markdown history with them.
+        """
+        if self.session_log is not None and self.session_log.exists():
+            try:
+                return self.session_log.load_recent(max_chars)
+            except (PermissionError, OSError) as err:
+                self.disable_session_log(err)
+                return []
+
+        if self.chat_history_file is None:
+            return []
+
+        history_md = self.read_text(self.chat_history_file)
+        if not history_md:
+            return []
+        return keep_recent(split_chat_history_markdown(history_md), max_chars)
+
     def format_files_for_input(self, rel_fnames, rel_read_only_fnames):
         if not self.pretty:
             read_only_files = []
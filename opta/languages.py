@@ -0,0 +1,129 @@
+import threading
+import warnings
+from collections import Counter
+from importlib import resources
+
+from opta.dump import dump  # noqa: F401
+
+# tree_sitter is throwing a FutureWarning
+warnings.simplefilter("ignore", category=FutureWarning)
+import tree_sitter  # noqa: E402
+from grep_ast.tsl import USING_TSL_PACK, get_language, get_parser  # noqa: E402
+
+
+class LanguageRegistry:
+    """
+    Per-process cache of tree-sitter languages, parsers and compiled tags queries.
+
+    Languages and compiled queries are immutable, so they are shared by every
+    thread. Parsers hold parse state, so each thread gets its own.
+    """
+
+    def __init__(self):
+        self.languages = dict()
+        self.queries = dict()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get_language(self, lang):
+        language = self.languages.get(lang)
+        if language is not None:
+            self.hits["language"] += 1
+            return language
+
+        self.misses["language"] += 1
+        language = get_language(lang)
+        self.languages[lang] = language
+        return language
+
+    def get_parser(self, lang):
+        parsers = getattr(self.local, "parsers", None)
+        if parsers is None:
+            parsers = self.local.parsers = dict()
+
+        parser = parsers.get(lang)
+        if parser is not None:
+            self.hits["parser"] += 1
+            return parser
+
+        self.misses["parser"] += 1
+        parser = get_parser(lang)
+        parsers[lang] = parser
+        return parser
+
+    def get_tags_query(self, lang):
+        """Return the compiled tags query for lang, or None if there isn't one."""
+        if lang in self.queries:
+            self.hits["query"] += 1
+            return self.queries[lang]
+
+        with self.lock:
+            if lang in self.queries:
+                self.hits["query"] += 1
+                return self.queries[lang]
+
+            self.misses["query"] += 1
+            query = None
+            query_scm = get_scm_fname(lang)
+            if query_scm and query_scm.exists():
+                query = compile_query(self.get_language(lang), query_scm.read_text())
+            self.queries[lang] = query
+            return query
+
+    def stats(self):
+        kinds = ("language", "parser", "query")
+        return {kind: dict(hits=self.hits[kind], misses=self.misses[kind]) for kind in kinds}
+
+    def clear(self):
+        with self.lock:
+            self.languages = dict()
+            self.queries = dict()
+            self.local = threading.local()
+            self.hits.clear()
+            self.misses.clear()
+
+
+def compile_query(language, query_scm):
+    if hasattr(tree_sitter, "QueryCursor"):
+        return tree_sitter.Query(language, query_scm)
+    return language.query(query_scm)
+
+
+def query_captures(query, node):
+    # tree-sitter 0.25 moved captures() from Query onto QueryCursor
+    QueryCursor = getattr(tree_sitter, "QueryCursor", None)
+    if QueryCursor is None:
+        return query.captures(node)
+    return QueryCursor(query).captures(node)
+
+
+def get_scm_fname(lang):
+    # Load the tags queries
+    if USING_TSL_PACK:
+        subdir = "tree-sitter-language-pack"
+        try:
+            path = resources.files(__package__).joinpath(
+                "queries",
+                subdir,
+                f"{lang}-tags.scm",
+            )
+            if path.exists():
+                return path
+        except KeyError:
+            pass
+
+    # Fall back to tree-sitter-languages
+    subdir = "tree-sitter-languages"
+    try:
+        return resources.files(__package__).joinpath(
+            "queries",
+            subdir,
+            f"{lang}-tags.scm",
+        )
+    except KeyError:
+        return
+
+
+language_registry = LanguageRegistry()
@@ -1,24 +1,40 @@
+import ast
 import os
 import re
 import subprocess
 import sys
 import traceback
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 
 import oslex
 from grep_ast import TreeContext, filename_to_lang
-from grep_ast.tsl import get_parser  # noqa: E402
 
 from opta.dump import dump  # noqa: F401
+from opta.languages import language_registry
 from opta.run_cmd import run_cmd_subprocess  # noqa: F401
 
+try:
+    from flake8.plugins.pyflakes import FLAKE8_PYFLAKES_CODES
+    from flake8.violation import Violation
+    from pyflakes.checker import Checker as PyflakesChecker
+except ImportError:
+    PyflakesChecker = None
+
 # tree_sitter is throwing a FutureWarning
 warnings.simplefilter("ignore", category=FutureWarning)
 
 
+# The flake8 checks that find errors, rather than style problems
+FATAL_FLAKE8_CODES = "E9,F821,F823,F831,F406,F407,F701,F702,F704,F706"
+
+
 class Linter:
+    # Most files to lint at once
+    max_workers = 8
+
     def __init__(self, encoding="utf-8", root=None):
         self.encoding = encoding
         self.root = root
@@ -35,6 +51,12 @@ class Linter:
 
         self.all_lint_cmd = cmd
 
+    def has_lint_cmds(self):
+        """Are any shell commands configured, which might change the files they lint?"""
+        if self.all_lint_cmd:
+            return True
+        return any(not callable(cmd) for cmd in self.languages.values())
+
     def get_rel_fname(self, fname):
         if self.root:
             try:
@@ -54,6 +76,7 @@ class Linter:
                 cmd,
                 cwd=self.root,
                 encoding=self.encoding,
+                echo=False,
             )
         except OSError as err:
             print(f"Unable to execute lint command: {err}")
@@ -115,10 +138,23 @@ class Linter:
 
         return res
 
+    def lint_files(self, fnames, cmd=None):
+        """
+        Lint files concurrently, so the lint commands run side by side.
+        Returns each file's lint() result, in the same order as fnames.
+        """
+        fnames = list(fnames)
+        if len(fnames) < 2:
+            return [self.lint(fname, cmd) for fname in fnames]
+
+        workers = min(len(fnames), self.max_workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda fname: self.lint(fname, cmd), fnames))
+
     def py_lint(self, fname, rel_fname, code):
         basic_res = basic_lint(rel_fname, code)
         compile_res = lint_python_compile(fname, code)
-        flake_res = self.flake8_lint(rel_fname)
+        flake_res = self.flake8_lint(rel_fname, code)
 
         text = ""
         lines = set()
@@ -133,8 +169,11 @@ class Linter:
         if text or lines:
             return LintResult(text, lines)
 
-    def flake8_lint(self, rel_fname):
-        fatal = "E9,F821,F823,F831,F406,F407,F701,F702,F704,F706"
+    def flake8_lint(self, rel_fname, code=None):
+        if PyflakesChecker is not None and code is not None:
+            return self.pyflakes_lint(rel_fname, code)
+
+        fatal = FATAL_FLAKE8_CODES
         flake8_cmd = [
             sys.executable,
             "-m",
@@ -167,6 +206,62 @@ class Linter:
         text += errors
         return self.errors_to_lint_result(rel_fname, text)
 
+    def pyflakes_lint(self, rel_fname, code):
+        """
+        Run flake8's fatal checks in process, rather than paying for a new
+        python and flake8 startup on every lint. The output matches flake8's,
+        and `# noqa` comments are honored the same way.
+        """
+        lines = code.splitlines(keepends=True)
+
+        def show(lineno, col, msg, source=True):
+            res = f"{rel_fname}:{lineno}:{col}: {msg}\n"
+            if source and 0 < lineno <= len(lines):
+                line = lines[lineno - 1]
+                if not line.endswith("\n"):
+                    line += "\n"
+                indent = "".join(c if c.isspace() else " " for c in line[: col - 1])
+                res += f"{line}{indent}^\n"
+            return res
+
+        try:
+            tree = ast.parse(code, filename=rel_fname)
+        except SyntaxError as err:
+            # Like flake8, which shows no source for these
+            lineno = err.lineno or 1
+            col = (err.offset or 0) + 1
+            errors = show(lineno, col, f"E999 {type(err).__name__}: {err.msg}", source=False)
+            return self.errors_to_lint_result(rel_fname, errors)
+        except ValueError:
+            # Source with null bytes can't be checked
+            return
+
+        fatal_codes = set(FATAL_FLAKE8_CODES.split(","))
+        messages = PyflakesChecker(tree, filename=rel_fname).messages
+        messages.sort(key=lambda message: (message.lineno, message.col))
+
+        errors = ""
+        for message in messages:
+            flake8_code = FLAKE8_PYFLAKES_CODES.get(type(message).__name__)
+            if flake8_code not in fatal_codes:
+                continue
+            msg = message.message % message.message_args
+
+            lineno = message.lineno
+            physical_line = lines[lineno - 1] if 0 < lineno <= len(lines) else ""
+            violation = Violation(
+                flake8_code, rel_fname, lineno, message.col + 1, msg, physical_line
+            )
+            if violation.is_inline_ignored(disable_noqa=False):
+                continue
+
+            errors += show(lineno, message.col + 1, f"{flake8_code} {msg}")
+
+        if not errors:
+            return
+
+        return self.errors_to_lint_result(rel_fname, errors)
+
 
 @dataclass
 class LintResult:
@@ -212,7 +307,7 @@ def basic_lint(fname, code):
         return
 
     try:
-        parser = get_parser(lang)
+        parser = language_registry.get_parser(lang)
     except Exception as err:
         print(f"Unable to load parser: {err}")
         return
@@ -1041,6 +1041,7 @@ def main(argv=None, input=None, output=None, force_git_root=None, return_coder=F
             show_diffs=args.show_diffs,
             auto_commits=args.auto_commits,
             dirty_commits=args.dirty_commits,
+            background_commits=args.background_commits,
             dry_run=args.dry_run,
             map_tokens=map_tokens,
             verbose=args.verbose,
@@ -1049,6 +1050,7 @@ def main(argv=None, input=None, output=None, force_git_root=None, return_coder=F
             restore_chat_history=args.restore_chat_history,
             auto_lint=args.auto_lint,
             auto_test=args.auto_test,
+            stop_on_failed_edit=args.stop_on_failed_edit,
             lint_cmds=lint_cmds,
             test_cmd=args.test_cmd,
             commands=commands,
@@ -1057,6 +1059,7 @@ def main(argv=None, input=None, output=None, force_git_root=None, return_coder=F
             map_refresh=args.map_refresh,
             cache_prompts=args.cache_prompts,
             map_mul_no_files=args.map_multiplier_no_files,
+            map_workers=args.map_workers,
             num_cache_warming_pings=args.cache_keepalive_pings,
             suggest_shell_commands=args.suggest_shell_commands,
             chat_language=args.chat_language,
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import io
+import re
 import time
 
 from rich import box
@@ -89,6 +90,106 @@ class NoInsetMarkdown(Markdown):
     }
 
 
+# An opening or closing code fence, indented by at most 3 spaces
+FENCE_RE = re.compile(r" {0,3}(`{3,}|~{3,})")
+
+# A thematic break, which rich renders without a blank line after it
+RULE_RE = re.compile(r" {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*")
+
+# Lines which continue the block before a blank line, rather than starting a new one
+CONTINUATION_RE = re.compile(r"[ \t]|[-+*]\s|\d+[.)]\s|>")
+
+# HTML blocks which run until a closing marker, rather than to the next blank line
+HTML_BLOCK_RE = re.compile(
+    r" {0,3}<(?:(script|pre|style|textarea)(?=[\s>]|$)|(!--|\?|!\[CDATA\[|![A-Za-z]))", re.I
+)
+HTML_BLOCK_ENDS = {"!--": "-->", "?": "?>", "![CDATA[": "]]>"}
+
+# Reference style links, and the definitions they resolve against
+REF_LINK_RE = re.compile(r"\]\[|^ {0,3}\[[^\]]+\]:")
+
+# Inline code, where brackets are just code
+CODE_SPAN_RE = re.compile(r"`+[^`]*`+")
+
+
+def find_stable_boundary(text, start=0):
+    """
+    Find the end of the last markdown block in text[start:] that's complete,
+    so more text can't change how it renders. start must be outside any block.
+
+    Blocks end at a blank line outside a code fence, once the whole next line
+    has arrived and shows that a new top level block begins there. A list
+    item, indented line or quote after the blank line may continue the block
+    before it, so it isn't a boundary.
+
+    Blank lines inside an HTML block like a comment or <style> don't end it
+    either, it runs until its closing marker.
+
+    A block with reference style links never becomes stable, since their
+    definitions may come later in the text. Nor does a block with definitions,
+    which later links resolve against.
+    """
+    boundary = start
+    fence = None
+    html_end = None
+    blank_end = None
+    in_block = False
+
+    offset = start
+    for line in text[start:].splitlines(keepends=True):
+        complete = line.endswith("\n")
+
+        if fence:
+            stripped = line.strip()
+            if complete and stripped.startswith(fence) and stripped == stripped[0] * len(stripped):
+                fence = None
+        elif html_end:
+            if html_end in line.lower():
+                html_end = None
+        elif not line.strip():
+            if complete and in_block and blank_end is None:
+                blank_end = offset
+        else:
+            # Wait for the whole line, a partial one like "2" might become a list item
+            if blank_end is not None and complete and not CONTINUATION_RE.match(line):
+                boundary = offset
+            blank_end = None
+            in_block = True
+
+            match = FENCE_RE.match(line)
+            html_match = HTML_BLOCK_RE.match(line)
+            if match:
+                fence = match.group(1)
+            elif html_match:
+                html_end = html_block_end(html_match)
+                # It may close on the line it opens on
+                if html_end in line[html_match.end() :].lower():
+                    html_end = None
+            elif REF_LINK_RE.search(CODE_SPAN_RE.sub("", line)):
+                break
+
+        offset += len(line)
+
+    return boundary
+
+
+def html_block_end(match):
+    """The marker which closes the HTML block that HTML_BLOCK_RE matched, in lower case."""
+    tag, opening = match.groups()
+    if tag:
+        return f"</{tag.lower()}>"
+    return HTML_BLOCK_ENDS.get(opening.upper(), ">")
+
+
+def ends_with_rule(text):
+    """Does the last block of markdown text consist of a thematic break?"""
+    lines = text.rstrip().rsplit("\n", 2)
+    if not RULE_RE.fullmatch(lines[-1]):
+        return False
+    # A rule right under paragraph text is a setext heading underline
+    return len(lines) < 2 or not lines[-2].strip()
+
+
 class MarkdownStream:
     """Streaming markdown renderer that progressively displays content with a live updating window.
 
@@ -110,6 +211,10 @@ class MarkdownStream:
         """
         self.printed = []  # Stores lines that have already been printed
 
+        # The completed blocks at the start of the text, which are rendered once
+        self.stable_text = ""
+        self.stable_lines = []
+
         if mdargs:
             self.mdargs = mdargs
         else:
@@ -119,15 +224,22 @@ class MarkdownStream:
         self.live = None
         self._live_started = False
 
-    def _render_markdown_to_lines(self, text):
+    def _render_markdown_to_lines(self, text, after=""):
         """Render markdown text to a list of lines.
 
         Args:
             text (str): Markdown text to render
+            after (str): Earlier blocks that text follows, so the output
+                starts with the blank line that would separate them
 
         Returns:
             list: List of rendered lines with line endings preserved
         """
+        # Render after a one line stand-in for the earlier blocks, to get the
+        # separating blank line exactly as if they were rendered together
+        if after:
+            text = ("---" if ends_with_rule(after) else "x") + "\n\n" + text
+
         # Render the markdown to a string buffer
         string_io = io.StringIO()
         console = Console(file=string_io, force_terminal=True)
@@ -136,7 +248,35 @@ class MarkdownStream:
         output = string_io.getvalue()
 
         # Split rendered output into lines
-        return output.splitlines(keepends=True)
+        lines = output.splitlines(keepends=True)
+        if after:
+            lines = lines[1:]
+        return lines
+
+    def _render_incremental(self, text):
+        """Render text to lines, rendering each completed block only once.
+
+        Only the trailing block, which may still change as more text streams
+        in, is rendered on every call.
+        """
+        if not text.startswith(self.stable_text):
+            # Earlier text was rewritten, start over
+            self.stable_text = ""
+            self.stable_lines = []
+
+        stable_len = len(self.stable_text)
+        boundary = find_stable_boundary(text, stable_len)
+        if boundary > stable_len:
+            self.stable_lines += self._render_markdown_to_lines(
+                text[stable_len:boundary], after=self.stable_text
+            )
+            self.stable_text = text[:boundary]
+
+        tail = text[boundary:]
+        if not tail.strip():
+            return list(self.stable_lines)
+
+        return self.stable_lines + self._render_markdown_to_lines(tail, after=self.stable_text)
 
     def __del__(self):
         """Destructor to ensure Live display is properly cleaned up."""
@@ -177,7 +317,7 @@ class MarkdownStream:
 
         # Measure render time and adjust min_delay to maintain smooth rendering
         start = time.time()
-        lines = self._render_markdown_to_lines(text)
+        lines = self._render_incremental(text)
         render_time = time.time() - start
 
         # Set min_delay to render time plus a small buffer
@@ -222,6 +362,20 @@ class MarkdownStream:
         rest = Text.from_ansi(rest)
         self.live.update(rest)
 
+    def pause(self):
+        """Clear and stop the Live window, so other output can be printed.
+
+        The next update() starts it again below that output.
+        """
+        if not self.live:
+            return
+
+        self.live.update(Text(""))
+        self.live.stop()
+        self.live = None
+        self._live_started = False
+        self.when = 0
+
     def find_minimal_suffix(self, text, match_lines=50):
         """
         Splits text into chunks on blank lines "\n\n".
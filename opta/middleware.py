@@ -8,6 +8,7 @@ Provides reliability patterns for LLM API calls:
 - Metrics: Token/cost tracking and observability
 """
 
+import asyncio
 import random
 import threading
 import time
@@ -327,6 +328,66 @@ class ProductionMiddleware:
         if not self.config.enabled:
             return func(*args, **kwargs)
 
+        self._check_can_execute(estimated_tokens)
+
+        # Execute with retry
+        last_exception = None
+        for attempt in range(self.config.retry.max_retries + 1):
+            try:
+                start_time = time.time()
+                result = func(*args, **kwargs)
+                self._record_success(result, start_time)
+                return result
+
+            except Exception as e:
+                last_exception = e
+                delay = self._get_retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+        self._record_exhausted()
+        if last_exception:
+            raise last_exception
+
+    async def execute_async(
+        self,
+        func: Callable,
+        *args,
+        estimated_tokens: int = 0,
+        **kwargs,
+    ) -> Any:
+        """
+        Await a coroutine function (e.g., litellm.acompletion) with the same
+        protections as execute(), backing off with asyncio.sleep() so other
+        requests on the event loop keep running.
+        """
+        if not self.config.enabled:
+            return await func(*args, **kwargs)
+
+        self._check_can_execute(estimated_tokens)
+
+        last_exception = None
+        for attempt in range(self.config.retry.max_retries + 1):
+            try:
+                start_time = time.time()
+                result = await func(*args, **kwargs)
+                self._record_success(result, start_time)
+                return result
+
+            except Exception as e:
+                last_exception = e
+                delay = self._get_retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+        self._record_exhausted()
+        if last_exception:
+            raise last_exception
+
+    def _check_can_execute(self, estimated_tokens: int):
+        """Count the request and raise if the circuit breaker or rate limiter reject it."""
         with self._lock:
             self.metrics.total_requests += 1
 
@@ -347,63 +408,56 @@ class ProductionMiddleware:
                 self.metrics.rate_limit_rejections += 1
             raise RateLimitExceededError(wait_time)
 
-        # Execute with retry
-        last_exception = None
-        for attempt in range(self.config.retry.max_retries + 1):
-            try:
-                start_time = time.time()
-                result = func(*args, **kwargs)
-                latency_ms = (time.time() - start_time) * 1000
-
-                # Record success
-                self.circuit_breaker.record_success()
-                with self._lock:
-                    self.metrics.successful_requests += 1
-                    self.metrics.record_latency(latency_ms)
-                    self.metrics.last_request_time = time.time()
+    def _record_success(self, result: Any, start_time: float):
+        latency_ms = (time.time() - start_time) * 1000
 
-                # Record rate limit usage
-                tokens_used = self._extract_tokens(result)
-                self.rate_limiter.record_request(tokens_used)
-
-                # Update token metrics
-                if tokens_used > 0:
-                    with self._lock:
-                        self.metrics.total_tokens_received += tokens_used
-
-                return result
+        # Record success
+        self.circuit_breaker.record_success()
+        with self._lock:
+            self.metrics.successful_requests += 1
+            self.metrics.record_latency(latency_ms)
+            self.metrics.last_request_time = time.time()
 
-            except Exception as e:
-                last_exception = e
+        # Record rate limit usage
+        tokens_used = self._extract_tokens(result)
+        self.rate_limiter.record_request(tokens_used)
 
-                if self.config.verbose:
-                    print(f"[Middleware] Attempt {attempt + 1} failed: {type(e).__name__}: {e}")
+        # Update token metrics
+        if tokens_used > 0:
+            with self._lock:
+                self.metrics.total_tokens_received += tokens_used
+
+    def _get_retry_delay(self, attempt: int, exception: Exception) -> Optional[float]:
+        """Return how long to wait before retrying, or None if the request has failed."""
+        if self.config.verbose:
+            print(
+                f"[Middleware] Attempt {attempt + 1} failed: {type(exception).__name__}:"
+                f" {exception}"
+            )
 
-                # Check if we should retry
-                if not self.retry_handler.should_retry(attempt, e):
-                    self.circuit_breaker.record_failure()
-                    with self._lock:
-                        self.metrics.failed_requests += 1
-                    raise
+        # Check if we should retry
+        if not self.retry_handler.should_retry(attempt, exception):
+            self.circuit_breaker.record_failure()
+            with self._lock:
+                self.metrics.failed_requests += 1
+            return None
 
-                # Record retry
-                with self._lock:
-                    self.metrics.retried_requests += 1
+        # Record retry
+        with self._lock:
+            self.metrics.retried_requests += 1
 
-                # Calculate and apply delay
-                delay = self.retry_handler.calculate_delay(attempt)
-                if self.config.verbose:
-                    print(f"[Middleware] Retrying in {delay:.1f}s...")
-                time.sleep(delay)
+        # Calculate delay
+        delay = self.retry_handler.calculate_delay(attempt)
+        if self.config.verbose:
+            print(f"[Middleware] Retrying in {delay:.1f}s...")
+        return delay
 
+    def _record_exhausted(self):
         # All retries exhausted
         self.circuit_breaker.record_failure()
         with self._lock:
             self.metrics.failed_requests += 1
 
-        if last_exception:
-            raise last_exception
-
     def _extract_tokens(self, result: Any) -> int:
         """Extract token count from API response."""
         try:
@@ -1,3 +1,4 @@
+import asyncio
 import difflib
 import hashlib
 import importlib.resources
@@ -6,7 +7,9 @@ import math
 import os
 import platform
 import sys
+import threading
 import time
+from collections import OrderedDict
 from dataclasses import dataclass, fields
 from datetime import datetime
 from pathlib import Path
@@ -310,6 +313,53 @@ class ModelInfoManager:
 model_info_manager = ModelInfoManager()
 
 
+class TokenCountCache:
+    """
+    Bounded LRU of token counts, keyed by the model's tokenizer and a hash of
+    the content, so unchanged messages and files aren't re-tokenized each turn.
+    """
+
+    MAX_ENTRIES = 16384
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or self.MAX_ENTRIES
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, model_name, kind, text):
+        digest = hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest()
+        return model_name, kind, digest
+
+    def get(self, key, count_fn):
+        with self.lock:
+            count = self.counts.get(key)
+            if count is not None:
+                self.counts.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+
+        count = count_fn()
+
+        with self.lock:
+            self.counts[key] = count
+            self.counts.move_to_end(key)
+            while len(self.counts) > self.max_entries:
+                self.counts.popitem(last=False)
+        return count
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+token_count_cache = TokenCountCache()
+
+
 class Model(ModelSettings):
     def __init__(
         self, model, weak_model=None, editor_model=None, editor_edit_format=None, verbose=False
@@ -616,7 +666,7 @@ class Model(ModelSettings):
     def token_count(self, messages):
         if type(messages) is list:
             try:
-                return litellm.token_counter(model=self.name, messages=messages)
+                return self.token_count_messages(messages)
             except Exception as err:
                 print(f"Unable to count tokens: {err}")
                 return 0
@@ -630,11 +680,30 @@ class Model(ModelSettings):
             msgs = json.dumps(messages)
 
         try:
-            return len(self.tokenizer(msgs))
+            key = token_count_cache.get_key(self.name, "text", msgs)
+            return token_count_cache.get(key, lambda: len(self.tokenizer(msgs)))
         except Exception as err:
             print(f"Unable to count tokens: {err}")
             return 0
 
+    def token_count_messages(self, messages):
+        """
+        litellm counts a message list as a fixed reply priming cost plus each
+        message's own tokens, so count and memoize the messages one by one.
+        """
+        key = token_count_cache.get_key(self.name, "messages", "")
+        base = token_count_cache.get(
+            key, lambda: litellm.token_counter(model=self.name, messages=[])
+        )
+
+        total = base
+        for msg in messages:
+            key = token_count_cache.get_key(self.name, "message", json.dumps(msg, sort_keys=True))
+            total += token_count_cache.get(
+                key, lambda: litellm.token_counter(model=self.name, messages=[msg]) - base
+            )
+        return total
+
     def token_count_for_image(self, fname):
         """
         Calculate the token cost for an image assuming high detail.
@@ -948,7 +1017,7 @@ class Model(ModelSettings):
 
             os.environ[openai_api_key] = token
 
-    def send_completion(self, messages, functions, stream, temperature=None):
+    def get_completion_kwargs(self, messages, functions, stream, temperature=None):
         if os.environ.get("AIDER_SANITY_CHECK_TURNS"):
             sanity_check_messages(messages)
 
@@ -999,6 +1068,12 @@ class Model(ModelSettings):
 
             self.github_copilot_token_to_open_ai_key(kwargs["extra_headers"])
 
+        return hash_object, kwargs
+
+    def send_completion(self, messages, functions, stream, temperature=None):
+        hash_object, kwargs = self.get_completion_kwargs(messages, functions, stream, temperature)
+        messages = kwargs["messages"]
+
         # Use production middleware for reliability
         middleware = get_middleware()
         estimated_tokens = self.token_count(messages) if messages else 0
@@ -1018,8 +1093,29 @@ class Model(ModelSettings):
 
         return hash_object, res
 
-    def simple_send_with_retries(self, messages):
+    async def send_completion_async(self, messages, functions, stream, temperature=None):
+        """
+        Like send_completion(), but awaits litellm.acompletion. With stream=True
+        the completion is an async iterator of chunks.
+        """
+        hash_object, kwargs = self.get_completion_kwargs(messages, functions, stream, temperature)
+        messages = kwargs["messages"]
+
+        middleware = get_middleware()
+        estimated_tokens = self.token_count(messages) if messages else 0
+        res = await middleware.execute_async(
+            litellm.acompletion,
+            estimated_tokens=estimated_tokens,
+            **kwargs,
+        )
+        middleware.record_tokens_sent(estimated_tokens)
+
+        return hash_object, res
+
+    async def simple_send_with_retries(self, messages):
+        """Send messages to the model, backing off without blocking the event loop."""
         from opta.exceptions import LiteLLMExceptions
+        from opta.reasoning_tags import remove_reasoning_content
 
         litellm_ex = LiteLLMExceptions()
         if "deepseek-reasoner" in self.name:
@@ -1031,18 +1127,10 @@ class Model(ModelSettings):
 
         while True:
             try:
-                kwargs = {
-                    "messages": messages,
-                    "functions": None,
-                    "stream": False,
-                }
-
-                _hash, response = self.send_completion(**kwargs)
+                _hash, response = await self.send_completion_async(messages, None, False)
                 if not response or not hasattr(response, "choices") or not response.choices:
                     return None
                 res = response.choices[0].message.content
-                from opta.reasoning_tags import remove_reasoning_content
-
                 return remove_reasoning_content(res, self.reasoning_tag)
 
             except litellm_ex.exceptions_tuple() as err:
@@ -1058,8 +1146,7 @@ class Model(ModelSettings):
                 if not should_retry:
                     return None
                 print(f"Retrying in {retry_delay:.1f} seconds...")
-                time.sleep(retry_delay)
-                continue
+                await asyncio.sleep(retry_delay)
             except AttributeError:
                 return None
 
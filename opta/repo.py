@@ -1,6 +1,10 @@
 import contextlib
 import os
+import re
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PurePosixPath
 
 try:
@@ -19,6 +23,7 @@ except ImportError:
 import pathspec
 
 from opta import prompts, utils
+from opta.async_loop import get_async_loop
 
 from .dump import dump  # noqa: F401
 from .waiting import WaitingSpinner
@@ -35,6 +40,10 @@ ANY_GIT_ERROR += [
 ]
 ANY_GIT_ERROR = tuple(ANY_GIT_ERROR)
 
+# Most of the diffs to send when asking for a commit message, about 4 chars per token
+MAX_COMMIT_DIFF_TOKENS = 16 * 1024
+COMMIT_DIFF_CHARS_PER_TOKEN = 4
+
 
 @contextlib.contextmanager
 def set_git_env(var_name, value, original_value):
@@ -49,8 +58,125 @@ def set_git_env(var_name, value, original_value):
             del os.environ[var_name]
 
 
+def truncate_diffs(diffs, max_chars):
+    """
+    Cut diffs down to about max_chars, keeping whole file diffs in order
+    while they fit. The file that doesn't fit is cut short, and the files
+    after it are only listed by their diff headers.
+    """
+    if len(diffs) <= max_chars:
+        return diffs
+
+    res = ""
+    full = False
+    left_out = []
+    for section in re.split(r"(?m)^(?=diff --git )", diffs):
+        if not full and len(res) + len(section) <= max_chars:
+            res += section
+            continue
+
+        if not full:
+            full = True
+            room = max_chars - len(res)
+            if room > 0:
+                res += section[:room].rsplit("\n", 1)[0] + "\n... diff truncated ...\n"
+                continue
+
+        lines = section.splitlines()[:3]
+        header = [line for line in lines if re.match(r"diff --git |(new|deleted) file mode ", line)]
+        left_out += header or lines[:1]
+
+    if left_out:
+        res += "\n# Diffs of these files were left out to save space:\n"
+        res += "\n".join(left_out) + "\n"
+
+    return res
+
+
+class TrackedFiles:
+    """
+    The files tracked in a repo for one HEAD commit and state of the index,
+    split into the ones .optaignore or --subtree-only hide and the rest.
+    """
+
+    def __init__(self, key, files):
+        self.key = key
+        self.all_files = frozenset(files)
+
+        # The GitRepo.ignore_file_cache the split was made with
+        self.ignore_file_cache = None
+        self.files = frozenset()
+        self.ignored = frozenset()
+
+    def split(self, ignored_file, ignore_file_cache):
+        ignored = set(fname for fname in self.all_files if ignored_file(fname))
+        self.ignored = frozenset(ignored)
+        self.files = self.all_files - self.ignored
+        self.ignore_file_cache = ignore_file_cache
+
+    def __contains__(self, fname):
+        return fname in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+
+class CommitQueue:
+    """
+    Makes a repo's commits one at a time on a background thread, so the user
+    can carry on while the commit message is being generated.
+
+    Each commit's outcome is queued as soon as it's made. finished() reports
+    them from the main thread, like before the next prompt, rather than
+    printing over the prompt. The commits' git commands are serialized with
+    the other threads' by GitRepo.git_lock.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opta-commit")
+        self.pending = deque()
+        self.errors = deque()
+        self.results = deque()
+
+    def submit(self, **kwargs):
+        future = self.executor.submit(self.run_commit, kwargs)
+        self.pending.append(future)
+        return future
+
+    def run_commit(self, kwargs):
+        try:
+            res = self.repo.commit(quiet=True, **kwargs)
+        except Exception as err:
+            self.errors.append(f"Unable to commit: {err}")
+            return
+        self.results.append(res)
+
+    def finished(self, wait=True):
+        """
+        Yield the commit() results of the queued commits that are done, in
+        order. With wait, first waits for the ones still pending.
+        """
+        while self.pending:
+            future = self.pending[0]
+            if not wait and not future.done():
+                break
+
+            # Wait before taking it off the queue, in case of ^C
+            future.exception()
+            self.pending.popleft()
+
+        while self.errors:
+            self.repo.io.tool_error(self.errors.popleft())
+
+        while self.results:
+            yield self.results.popleft()
+
+
 class GitRepo:
     repo = None
+    tracked_files = None
+    commit_queue = None
     opta_ignore_file = None
     opta_ignore_spec = None
     opta_ignore_ts = 0
@@ -91,6 +217,10 @@ class GitRepo:
         self.git_commit_verify = git_commit_verify
         self.ignore_file_cache = {}
 
+        # Serializes the git commands and GitPython object reads of the main thread,
+        # the background commits and the repo map worker
+        self.git_lock = threading.RLock()
+
         if git_dname:
             check_fnames = [git_dname]
         elif fnames:
@@ -128,7 +258,9 @@ class GitRepo:
         if opta_ignore_file:
             self.opta_ignore_file = Path(opta_ignore_file)
 
-    def commit(self, fnames=None, context=None, message=None, opta_edits=False, coder=None):
+    def commit(
+        self, fnames=None, context=None, message=None, opta_edits=False, coder=None, quiet=False
+    ):
         """
         Commit the specified files or all dirty files if none are specified.
 
@@ -141,6 +273,8 @@ class GitRepo:
                                           This affects attribution logic.
             coder (Coder, optional): The Coder instance, used for config and model info.
                                      Defaults to None.
+            quiet (bool, optional): Don't show a spinner or the new commit, for commits
+                                    made in the background. Defaults to False.
 
         Returns:
             tuple(str, str) or None: The commit hash and commit message if successful,
@@ -198,10 +332,10 @@ class GitRepo:
         - User commit with explicit no-committer: opta_edits=False,
           --no-attribute-committer -> Author=You, Committer=You
         """
-        if not fnames and not self.repo.is_dirty():
-            return
-
-        diffs = self.get_diffs(fnames)
+        with self.git_lock:
+            if not fnames and not self.repo.is_dirty():
+                return
+            diffs = self.get_diffs(fnames)
         if not diffs:
             return
 
@@ -213,7 +347,7 @@ class GitRepo:
                 user_language = coder.commit_language
                 if not user_language:
                     user_language = coder.get_user_language()
-            commit_message = self.get_commit_message(diffs, context, user_language)
+            commit_message = self.get_commit_message(diffs, context, user_language, quiet=quiet)
 
         # Retrieve attribute settings, prioritizing coder.args if available
         if coder and hasattr(coder, "args"):
@@ -277,45 +411,59 @@ class GitRepo:
         cmd = ["-m", full_commit_message]
         if not self.git_commit_verify:
             cmd.append("--no-verify")
-        if fnames:
-            fnames = [str(self.abs_root_path(fn)) for fn in fnames]
-            for fname in fnames:
+        # Other threads' git commands mustn't run into the index.lock of add and commit
+        with self.git_lock:
+            if fnames:
+                fnames = [str(self.abs_root_path(fn)) for fn in fnames]
                 try:
-                    self.repo.git.add(fname)
-                except ANY_GIT_ERROR as err:
-                    self.io.tool_error(f"Unable to add {fname}: {err}")
-            cmd += ["--"] + fnames
-        else:
-            cmd += ["-a"]
+                    self.repo.git.add(*fnames)
+                except ANY_GIT_ERROR:
+                    # Add them one at a time, to find the ones that can't be added
+                    for fname in fnames:
+                        try:
+                            self.repo.git.add(fname)
+                        except ANY_GIT_ERROR as err:
+                            self.commit_error(f"Unable to add {fname}: {err}", quiet)
+                cmd += ["--"] + fnames
+            else:
+                cmd += ["-a"]
 
-        original_user_name = self.repo.git.config("--get", "user.name")
-        original_committer_name_env = os.environ.get("GIT_COMMITTER_NAME")
-        original_author_name_env = os.environ.get("GIT_AUTHOR_NAME")
-        committer_name = f"{original_user_name} (opta)"
+            original_user_name = self.repo.git.config("--get", "user.name")
+            original_committer_name_env = os.environ.get("GIT_COMMITTER_NAME")
+            original_author_name_env = os.environ.get("GIT_AUTHOR_NAME")
+            committer_name = f"{original_user_name} (opta)"
 
-        try:
-            # Use context managers to handle environment variables
-            with contextlib.ExitStack() as stack:
-                if use_attribute_committer:
-                    stack.enter_context(
-                        set_git_env(
-                            "GIT_COMMITTER_NAME", committer_name, original_committer_name_env
+            try:
+                # Use context managers to handle environment variables
+                with contextlib.ExitStack() as stack:
+                    if use_attribute_committer:
+                        stack.enter_context(
+                            set_git_env(
+                                "GIT_COMMITTER_NAME", committer_name, original_committer_name_env
+                            )
+                        )
+                    if use_attribute_author:
+                        stack.enter_context(
+                            set_git_env("GIT_AUTHOR_NAME", committer_name, original_author_name_env)
                         )
-                    )
-                if use_attribute_author:
-                    stack.enter_context(
-                        set_git_env("GIT_AUTHOR_NAME", committer_name, original_author_name_env)
-                    )
-
-                # Perform the commit
-                self.repo.git.commit(cmd)
-                commit_hash = self.get_head_commit_sha(short=True)
-                self.io.tool_output(f"Commit {commit_hash} {commit_message}", bold=True)
-                return commit_hash, commit_message
 
-        except ANY_GIT_ERROR as err:
-            self.io.tool_error(f"Unable to commit: {err}")
-            # No return here, implicitly returns None
+                    # Perform the commit
+                    self.repo.git.commit(cmd)
+                    commit_hash = self.get_head_commit_sha(short=True)
+                    if not quiet:
+                        self.io.tool_output(f"Commit {commit_hash} {commit_message}", bold=True)
+                    return commit_hash, commit_message
+
+            except ANY_GIT_ERROR as err:
+                self.commit_error(f"Unable to commit: {err}", quiet)
+                # No return here, implicitly returns None
+
+    def commit_error(self, message, quiet=False):
+        # Quiet commits are made by the CommitQueue, which reports them from the main thread
+        if quiet and self.commit_queue:
+            self.commit_queue.errors.append(message)
+        else:
+            self.io.tool_error(message)
 
     def get_rel_repo_dir(self):
         try:
@@ -323,14 +471,12 @@ class GitRepo:
         except (ValueError, OSError):
             return self.repo.git_dir
 
-    def get_commit_message(self, diffs, context, user_language=None):
-        diffs = "# Diffs:\n" + diffs
-
-        content = ""
-        if context:
-            content += context + "\n"
-        content += diffs
+    def get_commit_queue(self):
+        if not self.commit_queue:
+            self.commit_queue = CommitQueue(self)
+        return self.commit_queue
 
+    def get_commit_message(self, diffs, context, user_language=None, quiet=False):
         system_content = self.commit_prompt or prompts.commit_system
 
         language_instruction = ""
@@ -341,29 +487,41 @@ class GitRepo:
         commit_message = None
         for model in self.models:
             spinner_text = f"Generating commit message with {model.name}"
-            with WaitingSpinner(spinner_text):
+            spinner = contextlib.nullcontext() if quiet else WaitingSpinner(spinner_text)
+            with spinner:
                 if model.system_prompt_prefix:
                     current_system_content = model.system_prompt_prefix + "\n" + system_content
                 else:
                     current_system_content = system_content
 
+                # Leave at least half the model's context window for the rest of the prompt
+                max_tokens = model.info.get("max_input_tokens") or 0
+                diff_tokens = MAX_COMMIT_DIFF_TOKENS
+                if max_tokens:
+                    diff_tokens = min(diff_tokens, max_tokens // 2)
+
+                content = ""
+                if context:
+                    content += context + "\n"
+                content += "# Diffs:\n"
+                content += truncate_diffs(diffs, diff_tokens * COMMIT_DIFF_CHARS_PER_TOKEN)
+
                 messages = [
                     dict(role="system", content=current_system_content),
                     dict(role="user", content=content),
                 ]
 
                 num_tokens = model.token_count(messages)
-                max_tokens = model.info.get("max_input_tokens") or 0
 
                 if max_tokens and num_tokens > max_tokens:
                     continue
 
-                commit_message = model.simple_send_with_retries(messages)
+                commit_message = get_async_loop().run(model.simple_send_with_retries(messages))
                 if commit_message:
                     break  # Found a model that could generate the message
 
         if not commit_message:
-            self.io.tool_error("Failed to generate commit message!")
+            self.commit_error("Failed to generate commit message!", quiet)
             return
 
         commit_message = commit_message.strip()
@@ -374,47 +532,39 @@ class GitRepo:
 
     def get_diffs(self, fnames=None):
         # We always want diffs of index and working dir
+        with self.git_lock:
+            # Resolving HEAD is enough to know there are commits, without walking the history
+            current_branch_has_commits = self.get_head_commit() is not None
 
-        current_branch_has_commits = False
-        try:
-            active_branch = self.repo.active_branch
-            try:
-                commits = self.repo.iter_commits(active_branch)
-                current_branch_has_commits = any(commits)
-            except ANY_GIT_ERROR:
-                pass
-        except (TypeError,) + ANY_GIT_ERROR:
-            pass
+            if not fnames:
+                fnames = []
 
-        if not fnames:
-            fnames = []
+            diffs = ""
+            for fname in fnames:
+                if not self.path_in_repo(fname):
+                    diffs += f"Added {fname}\n"
 
-        diffs = ""
-        for fname in fnames:
-            if not self.path_in_repo(fname):
-                diffs += f"Added {fname}\n"
+            try:
+                if current_branch_has_commits:
+                    args = ["HEAD", "--"] + list(fnames)
+                    diffs += self.repo.git.diff(*args, stdout_as_string=False).decode(
+                        self.io.encoding, "replace"
+                    )
+                    return diffs
 
-        try:
-            if current_branch_has_commits:
-                args = ["HEAD", "--"] + list(fnames)
-                diffs += self.repo.git.diff(*args, stdout_as_string=False).decode(
+                wd_args = ["--"] + list(fnames)
+                index_args = ["--cached"] + wd_args
+
+                diffs += self.repo.git.diff(*index_args, stdout_as_string=False).decode(
+                    self.io.encoding, "replace"
+                )
+                diffs += self.repo.git.diff(*wd_args, stdout_as_string=False).decode(
                     self.io.encoding, "replace"
                 )
-                return diffs
-
-            wd_args = ["--"] + list(fnames)
-            index_args = ["--cached"] + wd_args
-
-            diffs += self.repo.git.diff(*index_args, stdout_as_string=False).decode(
-                self.io.encoding, "replace"
-            )
-            diffs += self.repo.git.diff(*wd_args, stdout_as_string=False).decode(
-                self.io.encoding, "replace"
-            )
 
-            return diffs
-        except ANY_GIT_ERROR as err:
-            self.io.tool_error(f"Unable to diff: {err}")
+                return diffs
+            except ANY_GIT_ERROR as err:
+                self.io.tool_error(f"Unable to diff: {err}")
 
     def diff_commits(self, pretty, from_commit, to_commit):
         args = []
@@ -431,61 +581,134 @@ class GitRepo:
         return diffs
 
     def get_tracked_files(self):
-        if not self.repo:
+        tracked_files = self.get_tracked_files_index()
+        if tracked_files is None:
             return []
+        return list(tracked_files.files)
 
-        try:
-            commit = self.repo.head.commit
-        except ValueError:
-            commit = None
-        except ANY_GIT_ERROR as err:
-            self.git_repo_error = err
-            self.io.tool_error(f"Unable to list files in git repo: {err}")
-            self.io.tool_output("Is your git repo corrupted?")
-            return []
+    def get_tracked_files_index(self):
+        """
+        Get the TrackedFiles of the repo, which is only rebuilt when HEAD or
+        the index change, and only split again when the ignore rules change.
+        Returns None if the files can't be listed.
+        """
+        if not self.repo:
+            return
 
+        with self.git_lock:
+            try:
+                commit = self.repo.head.commit
+            except ValueError:
+                commit = None
+            except ANY_GIT_ERROR as err:
+                self.git_repo_error = err
+                self.io.tool_error(f"Unable to list files in git repo: {err}")
+                self.io.tool_output("Is your git repo corrupted?")
+                return
+
+            # git replaces the index file whenever it changes it
+            try:
+                stat = os.stat(os.path.join(self.repo.git_dir, "index"))
+                index_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            except OSError:
+                index_key = None
+
+            key = (commit.hexsha if commit else None, index_key)
+            tracked_files = self.tracked_files
+            if tracked_files is None or tracked_files.key != key:
+                files = self.list_tracked_files(commit)
+                if files is None:
+                    return
+                tracked_files = TrackedFiles(key, files)
+                self.tracked_files = tracked_files
+
+            self.refresh_opta_ignore()
+            if tracked_files.ignore_file_cache is not self.ignore_file_cache:
+                tracked_files.split(self.ignored_file, self.ignore_file_cache)
+
+            return tracked_files
+
+    def list_tracked_files(self, commit):
+        """
+        List the files in the commit's tree and in the index, with one git
+        command each. After HEAD moves, the new tree's files are derived from
+        the last tree listed, by diffing the two trees.
+        """
         files = set()
         if commit:
-            if commit in self.tree_files:
-                files = self.tree_files[commit]
-            else:
-                try:
-                    iterator = commit.tree.traverse()
-                    blob = None  # Initialize blob
-                    while True:
-                        try:
-                            blob = next(iterator)
-                            if blob.type == "blob":  # blob is a file
-                                files.add(blob.path)
-                        except IndexError:
-                            # Handle potential index error during tree traversal
-                            # without relying on potentially unassigned 'blob'
-                            self.io.tool_warning(
-                                "GitRepo: Index error encountered while reading git tree object."
-                                " Skipping."
-                            )
-                            continue
-                        except StopIteration:
-                            break
-                except ANY_GIT_ERROR as err:
-                    self.git_repo_error = err
-                    self.io.tool_error(f"Unable to list files in git repo: {err}")
-                    self.io.tool_output("Is your git repo corrupted?")
-                    return []
-                files = set(self.normalize_path(path) for path in files)
-                self.tree_files[commit] = set(files)
+            files = self.list_tree_files(commit.hexsha)
+            if files is None:
+                return
+            files = set(files)
 
         # Add staged files
-        index = self.repo.index
         try:
-            staged_files = [path for path, _ in index.entries.keys()]
-            files.update(self.normalize_path(path) for path in staged_files)
+            staged_files = self.repo.git.ls_files("-z").split("\0")
+            files.update(self.normalize_git_paths(path for path in staged_files if path))
         except ANY_GIT_ERROR as err:
             self.io.tool_error(f"Unable to read staged files: {err}")
 
-        res = [fname for fname in files if not self.ignored_file(fname)]
+        return files
+
+    def list_tree_files(self, sha):
+        if sha in self.tree_files:
+            return self.tree_files[sha]
+
+        try:
+            if self.tree_files:
+                prev_sha, files = next(iter(self.tree_files.items()))
+                files = self.diff_tree_files(prev_sha, sha, files)
+            else:
+                files = self.ls_tree_files(sha)
+        except ANY_GIT_ERROR as err:
+            self.git_repo_error = err
+            self.io.tool_error(f"Unable to list files in git repo: {err}")
+            self.io.tool_output("Is your git repo corrupted?")
+            return
+
+        # Only the latest tree is kept, to diff the next one against
+        self.tree_files = {sha: files}
+        return files
+
+    def ls_tree_files(self, sha):
+        output = self.repo.git.ls_tree("-r", "-z", "--full-tree", sha)
+
+        paths = []
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            info, path = entry.split("\t", 1)
+            # Skip submodules, which are listed as commits
+            if info.split(" ")[1] == "blob":
+                paths.append(path)
+
+        return frozenset(self.normalize_git_paths(paths))
+
+    def diff_tree_files(self, prev_sha, sha, prev_files):
+        output = self.repo.git.diff_tree("-r", "-z", "--no-renames", prev_sha, sha)
+
+        added = []
+        removed = []
+        fields = output.split("\0")
+        for info, path in zip(fields[0::2], fields[1::2]):
+            if not info.startswith(":"):
+                continue
+            new_mode, status = info.split(" ")[1], info[-1]
+            if status == "D" or new_mode == "160000":
+                removed.append(path)
+            else:
+                added.append(path)
+
+        files = set(prev_files)
+        files.difference_update(self.normalize_git_paths(removed))
+        files.update(self.normalize_git_paths(added))
+        return frozenset(files)
 
-        return res
+    def normalize_git_paths(self, paths):
+        # git lists paths relative to the root with "/" separators, already normalized
+        if os.sep == "/":
+            return set(paths)
+        return set(path.replace("/", os.sep) for path in paths)
 
     def normalize_path(self, path):
         orig_path = path
@@ -570,7 +793,9 @@ class GitRepo:
         if not path:
             return
 
-        tracked_files = set(self.get_tracked_files())
+        tracked_files = self.get_tracked_files_index()
+        if tracked_files is None:
+            return False
         return self.normalize_path(path) in tracked_files
 
     def abs_root_path(self, path):
@@ -582,29 +807,32 @@ class GitRepo:
         Returns a list of all files which are dirty (not committed), either staged or in the working
         directory.
         """
-        dirty_files = set()
+        with self.git_lock:
+            dirty_files = set()
 
-        # Get staged files
-        staged_files = self.repo.git.diff("--name-only", "--cached").splitlines()
-        dirty_files.update(staged_files)
+            # Get staged files
+            staged_files = self.repo.git.diff("--name-only", "--cached").splitlines()
+            dirty_files.update(staged_files)
 
-        # Get unstaged files
-        unstaged_files = self.repo.git.diff("--name-only").splitlines()
-        dirty_files.update(unstaged_files)
+            # Get unstaged files
+            unstaged_files = self.repo.git.diff("--name-only").splitlines()
+            dirty_files.update(unstaged_files)
 
-        return list(dirty_files)
+            return list(dirty_files)
 
     def is_dirty(self, path=None):
         if path and not self.path_in_repo(path):
             return True
 
-        return self.repo.is_dirty(path=path)
+        with self.git_lock:
+            return self.repo.is_dirty(path=path)
 
     def get_head_commit(self):
-        try:
-            return self.repo.head.commit
-        except (ValueError,) + ANY_GIT_ERROR:
-            return None
+        with self.git_lock:
+            try:
+                return self.repo.head.commit
+            except (ValueError,) + ANY_GIT_ERROR:
+                return None
 
     def get_head_commit_sha(self, short=False):
         commit = self.get_head_commit()
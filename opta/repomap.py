@@ -1,14 +1,18 @@
 import colorsys
+import hashlib
 import math
+import multiprocessing
 import os
 import random
 import shutil
 import sqlite3
 import sys
+import threading
 import time
 import warnings
 from collections import Counter, defaultdict, namedtuple
-from importlib import resources
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 from diskcache import Cache
@@ -19,11 +23,18 @@ from tqdm import tqdm
 
 from opta.dump import dump
 from opta.special import filter_important_files
+from opta.tags_store import TagsStore
 from opta.waiting import Spinner
 
 # tree_sitter is throwing a FutureWarning
 warnings.simplefilter("ignore", category=FutureWarning)
-from grep_ast.tsl import USING_TSL_PACK, get_language, get_parser  # noqa: E402
+from grep_ast.tsl import USING_TSL_PACK  # noqa: E402
+
+from opta.languages import (  # noqa: E402
+    get_scm_fname,
+    language_registry,
+    query_captures,
+)
 
 Tag = namedtuple("Tag", "rel_fname fname line name kind".split())
 
@@ -31,15 +42,360 @@ Tag = namedtuple("Tag", "rel_fname fname line name kind".split())
 SQLITE_ERRORS = (sqlite3.OperationalError, sqlite3.DatabaseError, OSError)
 
 
-CACHE_VERSION = 3
+# Bumped when the tags cache moved from diskcache to TagsStore
+CACHE_VERSION = 5
 if USING_TSL_PACK:
-    CACHE_VERSION = 4
+    CACHE_VERSION = 6
 
 UPDATING_REPO_MAP_MESSAGE = "Updating repo map"
 
+# Only fan the initial scan out to worker processes when there are enough
+# uncached files to pay for starting the pool.
+PARALLEL_SCAN_MIN_FILES = 100
+TAGS_CACHE_BATCH_SIZE = 256
+
+MAP_CACHE_SIZE_LIMIT = 128 * 1024 * 1024
+
+
+def get_rank_backend():
+    """Use the numpy/scipy PageRank if they're installed, else fall back to networkx."""
+    try:
+        import numpy  # noqa: F401
+        import scipy.sparse  # noqa: F401
+    except ImportError:
+        return "networkx"
+    return "sparse"
+
+
+class SymbolGraph:
+    """
+    The file -> file reference graph used to rank the repo map.
+
+    It persists across map refreshes. Each file's tags are folded in once per
+    mtime, and only the edges for identifiers touched by a change are rebuilt.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_rank_backend()
+
+        # The networkx backend keeps a live MultiDiGraph, the sparse backend
+        # builds integer edge arrays from ident_edges when they change
+        self.G = None
+        if self.backend == "networkx":
+            import networkx as nx
+
+            self.G = nx.MultiDiGraph()
+        self.edge_arrays = None
+
+        self.file_mtimes = dict()
+        self.file_defines = dict()
+        self.file_references = dict()
+
+        self.defines = defaultdict(set)
+        self.references = defaultdict(Counter)
+        self.definitions = defaultdict(set)
+
+        self.ident_edges = dict()
+        self.dirty_idents = set()
+        self.had_references = False
+
+        self.chat_rel_fnames = set()
+        self.mentioned_idents = set()
+
+        self.ranked = None
+
+    def has_file(self, rel_fname, mtime):
+        return self.file_mtimes.get(rel_fname) == mtime
+
+    def update_file(self, rel_fname, mtime, tags):
+        self.remove_file(rel_fname)
+
+        file_defines = set()
+        file_references = Counter()
+        for tag in tags:
+            if tag.kind == "def":
+                file_defines.add(tag.name)
+                self.defines[tag.name].add(rel_fname)
+                self.definitions[(rel_fname, tag.name)].add(tag)
+            elif tag.kind == "ref":
+                file_references[tag.name] += 1
+
+        for ident, num_refs in file_references.items():
+            self.references[ident][rel_fname] += num_refs
+
+        self.file_mtimes[rel_fname] = mtime
+        self.file_defines[rel_fname] = file_defines
+        self.file_references[rel_fname] = file_references
+        self.dirty_idents.update(file_defines, file_references)
+
+    def remove_file(self, rel_fname):
+        if rel_fname not in self.file_mtimes:
+            return
+
+        file_defines = self.file_defines.pop(rel_fname)
+        file_references = self.file_references.pop(rel_fname)
+        del self.file_mtimes[rel_fname]
+
+        for ident in file_defines:
+            self.defines[ident].discard(rel_fname)
+            if not self.defines[ident]:
+                del self.defines[ident]
+            self.definitions.pop((rel_fname, ident), None)
+
+        for ident in file_references:
+            del self.references[ident][rel_fname]
+            if not self.references[ident]:
+                del self.references[ident]
+
+        self.dirty_idents.update(file_defines, file_references)
+
+    def remove_files_except(self, rel_fnames):
+        for rel_fname in set(self.file_mtimes) - set(rel_fnames):
+            self.remove_file(rel_fname)
+
+    def set_context(self, chat_rel_fnames, mentioned_idents):
+        """Mark the idents whose edge weights depend on the chat files or mentions."""
+        chat_rel_fnames = set(chat_rel_fnames)
+        mentioned_idents = set(mentioned_idents)
+
+        self.dirty_idents.update(mentioned_idents ^ self.mentioned_idents)
+        for rel_fname in chat_rel_fnames ^ self.chat_rel_fnames:
+            self.dirty_idents.update(self.file_references.get(rel_fname, ()))
+            if not self.references:
+                self.dirty_idents.update(self.file_defines.get(rel_fname, ()))
+
+        self.chat_rel_fnames = chat_rel_fnames
+        self.mentioned_idents = mentioned_idents
+
+    def get_ident_references(self, ident):
+        if self.references:
+            return self.references.get(ident)
+
+        # No refs anywhere in the repo, so treat every def as a ref
+        definers = self.defines.get(ident)
+        if definers:
+            return Counter(definers)
+
+    def get_ident_edges(self, ident):
+        definers = self.defines.get(ident)
+        if not definers:
+            return []
+
+        references = self.get_ident_references(ident)
+
+        # Add a small self-edge for every definition that has no references
+        # Helps with tree-sitter 0.23.2 with ruby, where "def greet(name)"
+        # isn't counted as a def AND a ref. tree-sitter 0.24.0 does.
+        if not references:
+            return [(definer, definer, 0.1) for definer in definers]
+
+        mul = 1.0
+
+        is_snake = ("_" in ident) and any(c.isalpha() for c in ident)
+        is_kebab = ("-" in ident) and any(c.isalpha() for c in ident)
+        is_camel = any(c.isupper() for c in ident) and any(c.islower() for c in ident)
+        if ident in self.mentioned_idents:
+            mul *= 10
+        if (is_snake or is_kebab or is_camel) and len(ident) >= 8:
+            mul *= 10
+        if ident.startswith("_"):
+            mul *= 0.1
+        if len(definers) > 5:
+            mul *= 0.1
+
+        edges = []
+        for referencer, num_refs in references.items():
+            for definer in definers:
+                use_mul = mul
+                if referencer in self.chat_rel_fnames:
+                    use_mul *= 50
+
+                # scale down so high freq (low value) mentions don't dominate
+                num_refs = math.sqrt(num_refs)
+
+                edges.append((referencer, definer, use_mul * num_refs))
+
+        return edges
+
+    def refresh_edges(self, progress=None):
+        has_references = bool(self.references)
+        if has_references != self.had_references:
+            # Switching in or out of "defs are refs" mode changes every ident
+            self.dirty_idents.update(self.defines)
+            self.dirty_idents.update(self.ident_edges)
+            self.had_references = has_references
+
+        if not self.dirty_idents:
+            return
+
+        touched = set()
+        for ident in self.dirty_idents:
+            if progress:
+                progress(f"{UPDATING_REPO_MAP_MESSAGE}: {ident}")
+
+            old_edges = self.ident_edges.pop(ident, ())
+            edges = self.get_ident_edges(ident)
+            if edges:
+                self.ident_edges[ident] = edges
+
+            if self.G is None:
+                continue
+
+            for src, dst, _weight in old_edges:
+                self.G.remove_edge(src, dst, key=ident)
+                touched.update((src, dst))
+            for src, dst, weight in edges:
+                self.G.add_edge(src, dst, key=ident, weight=weight, ident=ident)
+
+        self.dirty_idents = set()
+        self.edge_arrays = None
+
+        if self.G is not None:
+            isolated = [node for node in touched if node in self.G and not self.G.degree(node)]
+            self.G.remove_nodes_from(isolated)
+
+    def rank(self, personalization=None, progress=None):
+        """
+        Run PageRank over the files, then distribute each file's rank across
+        its out edges. Returns (ranked, ranked_definitions) where ranked maps
+        file -> rank and ranked_definitions maps (file, ident) -> rank.
+        """
+        if self.backend == "sparse":
+            return self.rank_sparse(personalization)
+        return self.rank_networkx(personalization, progress)
+
+    def rank_networkx(self, personalization=None, progress=None):
+        import networkx as nx
+
+        G = self.G
+
+        if personalization:
+            pers_args = dict(personalization=personalization, dangling=personalization)
+        else:
+            pers_args = dict()
+
+        # Warm start from the previous ranking, it is usually very close
+        nstart = None
+        if self.ranked:
+            nstart = {node: self.ranked.get(node, 0) for node in G}
+            if not any(nstart.values()):
+                nstart = None
+
+        try:
+            ranked = nx.pagerank(G, weight="weight", nstart=nstart, **pers_args)
+        except ZeroDivisionError:
+            # Issue #1536
+            try:
+                ranked = nx.pagerank(G, weight="weight")
+            except ZeroDivisionError:
+                return None, None
+
+        self.ranked = ranked
+
+        # distribute the rank from each source node, across all of its out edges
+        ranked_definitions = defaultdict(float)
+        for src in G.nodes:
+            if progress:
+                progress(f"{UPDATING_REPO_MAP_MESSAGE}: {src}")
+
+            src_rank = ranked[src]
+            total_weight = sum(data["weight"] for _src, _dst, data in G.out_edges(src, data=True))
+            # dump(src, src_rank, total_weight)
+            for _src, dst, data in G.out_edges(src, data=True):
+                data["rank"] = src_rank * data["weight"] / total_weight
+                ident = data["ident"]
+                ranked_definitions[(dst, ident)] += data["rank"]
+
+        return ranked, ranked_definitions
+
+    def get_edge_arrays(self):
+        import numpy as np
+
+        if self.edge_arrays is not None:
+            return self.edge_arrays
+
+        # Intern the files and idents as integer ids
+        nodes = dict()
+        idents = list(self.ident_edges)
+        srcs = []
+        dsts = []
+        weights = []
+        ident_ids = []
+        for ident_id, ident in enumerate(idents):
+            for src, dst, weight in self.ident_edges[ident]:
+                srcs.append(nodes.setdefault(src, len(nodes)))
+                dsts.append(nodes.setdefault(dst, len(nodes)))
+                weights.append(weight)
+                ident_ids.append(ident_id)
+
+        self.edge_arrays = (
+            list(nodes),
+            idents,
+            np.array(srcs, dtype=np.int64),
+            np.array(dsts, dtype=np.int64),
+            np.array(weights, dtype=np.float64),
+            np.array(ident_ids, dtype=np.int64),
+        )
+        return self.edge_arrays
+
+    def rank_sparse(self, personalization=None, alpha=0.85, max_iter=100, tol=1.0e-6):
+        import numpy as np
+        from scipy import sparse
+
+        nodes, idents, srcs, dsts, weights, ident_ids = self.get_edge_arrays()
+        N = len(nodes)
+        if N == 0:
+            self.ranked = dict()
+            return dict(), dict()
+
+        # Row-normalized adjacency, parallel edges are summed
+        M = sparse.csr_array((weights, (srcs, dsts)), shape=(N, N))
+        out_weight = np.asarray(M.sum(axis=1)).ravel()
+        inv_out_weight = np.zeros(N)
+        inv_out_weight[out_weight != 0] = 1.0 / out_weight[out_weight != 0]
+        A = M.copy()
+        A.data *= np.repeat(inv_out_weight, np.diff(A.indptr))
+        is_dangling = out_weight == 0
+
+        p = np.ones(N) / N
+        if personalization:
+            pers = np.array([personalization.get(node, 0) for node in nodes], dtype=np.float64)
+            if pers.sum() > 0:
+                p = pers / pers.sum()
+
+        # Warm start from the previous ranking, it is usually very close
+        x = p.copy()
+        if self.ranked:
+            x0 = np.array([self.ranked.get(node, 0) for node in nodes], dtype=np.float64)
+            if x0.sum() > 0:
+                x = x0 / x0.sum()
+
+        for _ in range(max_iter):
+            xlast = x
+            x = alpha * (x @ A + x[is_dangling].sum() * p) + (1 - alpha) * p
+            if np.abs(x - xlast).sum() < N * tol:
+                break
+
+        ranked = dict(zip(nodes, x.tolist()))
+        self.ranked = ranked
+
+        # Each edge carries src_rank * weight / total_out_weight(src), summed
+        # per (definer, ident)
+        edge_rank = x[srcs] * weights * inv_out_weight[srcs]
+        R = sparse.coo_array(
+            sparse.csr_array((edge_rank, (dsts, ident_ids)), shape=(N, len(idents)))
+        )
+        ranked_definitions = {
+            (nodes[row], idents[col]): rank
+            for row, col, rank in zip(R.row.tolist(), R.col.tolist(), R.data.tolist())
+        }
+
+        return ranked, ranked_definitions
+
 
 class RepoMap:
     TAGS_CACHE_DIR = f".opta.tags.cache.v{CACHE_VERSION}"
+    MAP_CACHE_DIR = f".opta.map.cache.v{CACHE_VERSION}"
 
     warned_files = set()
 
@@ -54,16 +410,19 @@ class RepoMap:
         max_context_window=None,
         map_mul_no_files=8,
         refresh="auto",
+        map_workers=None,
     ):
         self.io = io
         self.verbose = verbose
         self.refresh = refresh
+        self.map_workers = map_workers
 
         if not root:
             root = os.getcwd()
         self.root = root
 
         self.load_tags_cache()
+        self.load_map_cache()
         self.cache_threshold = 0.95
 
         self.max_map_tokens = map_tokens
@@ -75,10 +434,16 @@ class RepoMap:
         self.main_model = main_model
 
         self.tree_cache = {}
+        self.tree_tokens_cache = {}
         self.tree_context_cache = {}
         self.map_cache = {}
         self.map_processing_time = 0
         self.last_map = None
+        self.last_ranked_tags = None
+        self.symbol_graph = None
+
+        # Coder precomputes maps in a background thread, one build at a time
+        self.lock = threading.RLock()
 
         if self.verbose:
             self.io.tool_output(
@@ -106,11 +471,26 @@ class RepoMap:
         mentioned_fnames=None,
         mentioned_idents=None,
         force_refresh=False,
+        quiet=False,
     ):
         if self.max_map_tokens <= 0:
             return
         if not other_files:
             return
+
+        with self.lock:
+            return self.get_repo_map_locked(
+                chat_files,
+                other_files,
+                mentioned_fnames,
+                mentioned_idents,
+                force_refresh,
+                quiet,
+            )
+
+    def get_repo_map_locked(
+        self, chat_files, other_files, mentioned_fnames, mentioned_idents, force_refresh, quiet
+    ):
         if not mentioned_fnames:
             mentioned_fnames = set()
         if not mentioned_idents:
@@ -138,6 +518,7 @@ class RepoMap:
                 mentioned_fnames,
                 mentioned_idents,
                 force_refresh,
+                quiet,
             )
         except RecursionError:
             self.io.tool_error("Disabling repo map, git repo too large?")
@@ -191,13 +572,15 @@ class RepoMap:
                 shutil.rmtree(path)
 
             # Try to create new cache
-            new_cache = Cache(path)
+            new_cache = TagsStore(path, Tag)
 
             # Test that it works
             test_key = "test"
-            new_cache[test_key] = "test"
+            new_cache[test_key] = {"mtime": 0, "data": []}
+            new_cache.flush()
             _ = new_cache[test_key]
             del new_cache[test_key]
+            new_cache.flush()
 
             # If we got here, the new cache works
             self.TAGS_CACHE = new_cache
@@ -216,12 +599,80 @@ class RepoMap:
     def load_tags_cache(self):
         path = Path(self.root) / self.TAGS_CACHE_DIR
         try:
-            self.TAGS_CACHE = Cache(path)
+            self.TAGS_CACHE = TagsStore(path, Tag)
         except SQLITE_ERRORS as e:
             self.tags_cache_error(e)
 
     def save_tags_cache(self):
-        pass
+        if not hasattr(self.TAGS_CACHE, "flush"):
+            return
+        try:
+            self.TAGS_CACHE.flush()
+        except SQLITE_ERRORS as e:
+            self.tags_cache_error(e)
+
+    def load_map_cache(self):
+        """
+        Snapshots of ranked tags and rendered maps, shared by every session in
+        this checkout. Least recently used snapshots are evicted past the size cap.
+        """
+        path = Path(self.root) / self.MAP_CACHE_DIR
+        try:
+            self.MAP_CACHE = Cache(
+                path,
+                size_limit=MAP_CACHE_SIZE_LIMIT,
+                eviction_policy="least-recently-used",
+            )
+        except SQLITE_ERRORS as e:
+            self.map_cache_error(e)
+
+    def map_cache_error(self, original_error=None):
+        # The snapshots are just an optimization, so stop using them
+        if self.verbose and original_error:
+            self.io.tool_warning(f"Repo map snapshot cache error: {str(original_error)}")
+        self.MAP_CACHE = None
+
+    def get_map_snapshot_key(self, chat_fnames, other_fnames, mentioned_fnames, mentioned_idents):
+        """
+        Key the ranking on everything it depends on: the files and their
+        mtimes, which files are in the chat and what was mentioned.
+        """
+        key = hashlib.sha1()
+
+        model_name = getattr(self.main_model, "name", None)
+        key.update(f"{CACHE_VERSION}\0{model_name}\0".encode())
+
+        chat_fnames = set(chat_fnames)
+        for fname in sorted(chat_fnames.union(other_fnames)):
+            try:
+                mtime = os.path.getmtime(fname)
+            except OSError:
+                mtime = None
+            in_chat = fname in chat_fnames
+            key.update(f"{fname}\0{mtime}\0{in_chat}\n".encode("utf-8", "surrogateescape"))
+
+        for names in (mentioned_fnames, mentioned_idents):
+            key.update(b"\1")
+            for name in sorted(names or ()):
+                key.update(f"{name}\n".encode("utf-8", "surrogateescape"))
+
+        return key.hexdigest()
+
+    def load_map_snapshot(self, snapshot_key):
+        if self.MAP_CACHE is None:
+            return
+        try:
+            return self.MAP_CACHE.get(snapshot_key)
+        except SQLITE_ERRORS as e:
+            self.map_cache_error(e)
+
+    def save_map_snapshot(self, snapshot_key, snapshot):
+        if self.MAP_CACHE is None:
+            return
+        try:
+            self.MAP_CACHE[snapshot_key] = snapshot
+        except SQLITE_ERRORS as e:
+            self.map_cache_error(e)
 
     def get_mtime(self, fname):
         try:
@@ -243,19 +694,14 @@ class RepoMap:
             val = self.TAGS_CACHE.get(cache_key)
 
         if val is not None and val.get("mtime") == file_mtime:
-            try:
-                return self.TAGS_CACHE[cache_key]["data"]
-            except SQLITE_ERRORS as e:
-                self.tags_cache_error(e)
-                return self.TAGS_CACHE[cache_key]["data"]
+            return val["data"]
 
         # miss!
         data = list(self.get_tags_raw(fname, rel_fname))
 
-        # Update the cache
+        # Update the cache, the store writes it out in batches
         try:
             self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
-            self.save_tags_cache()
         except SQLITE_ERRORS as e:
             self.tags_cache_error(e)
             self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
@@ -267,95 +713,107 @@ class RepoMap:
         if not lang:
             return
 
-        try:
-            language = get_language(lang)
-            parser = get_parser(lang)
-        except Exception as err:
-            print(f"Skipping file {fname}: {err}")
-            return
-
-        query_scm = get_scm_fname(lang)
-        if not query_scm.exists():
-            return
-        query_scm = query_scm.read_text()
-
         code = self.io.read_text(fname)
         if not code:
             return
-        tree = parser.parse(bytes(code, "utf-8"))
-
-        # Run the tags queries
-        query = language.query(query_scm)
-        captures = query.captures(tree.root_node)
 
-        saw = set()
-        if USING_TSL_PACK:
-            all_nodes = []
-            for tag, nodes in captures.items():
-                all_nodes += [(node, tag) for node in nodes]
-        else:
-            all_nodes = list(captures)
+        yield from get_tags_from_code(fname, rel_fname, code)
 
-        for node, tag in all_nodes:
-            if tag.startswith("name.definition."):
-                kind = "def"
-            elif tag.startswith("name.reference."):
-                kind = "ref"
-            else:
+    def get_uncached_fnames(self, fnames):
+        uncached = []
+        for fname in fnames:
+            try:
+                file_mtime = os.path.getmtime(fname)
+            except OSError:
                 continue
 
-            saw.add(kind)
+            if file_mtime != self.get_cached_mtime(fname):
+                uncached.append((fname, file_mtime))
 
-            result = Tag(
-                rel_fname=rel_fname,
-                fname=fname,
-                name=node.text.decode("utf-8"),
-                kind=kind,
-                line=node.start_point[0],
-            )
+        return uncached
 
-            yield result
+    def get_cached_mtime(self, fname):
+        # The store can answer without decoding the file's tags
+        if isinstance(self.TAGS_CACHE, TagsStore):
+            return self.TAGS_CACHE.get_mtime(fname)
 
-        if "ref" in saw:
-            return
-        if "def" not in saw:
-            return
-
-        # We saw defs, without any refs
-        # Some tags files only provide defs (cpp, for example)
-        # Use pygments to backfill refs
+        val = self.TAGS_CACHE.get(fname)
+        if val is not None:
+            return val.get("mtime")
 
+    def store_tags_batch(self, batch):
         try:
-            lexer = guess_lexer_for_filename(fname, code)
-        except Exception:  # On Windows, bad ref to time.clock which is deprecated?
-            # self.io.tool_error(f"Error lexing {fname}")
-            return
+            self.TAGS_CACHE.update(batch)
+        except SQLITE_ERRORS as e:
+            self.tags_cache_error(e)
+            self.TAGS_CACHE.update(batch)
+        self.save_tags_cache()
+
+    def scan_tags_parallel(self, fnames, quiet=False):
+        """
+        Extract tags for all the uncached files in a pool of worker processes,
+        storing the results in the tags cache in batches.
+
+        Files which can't be scanned in a worker are left uncached, so the
+        serial path in get_tags() will retry them and report any errors.
+        Returns True if the parallel scan ran.
+        """
+        workers = self.map_workers or os.cpu_count() or 1
+        if workers <= 1:
+            return False
+
+        uncached = self.get_uncached_fnames(fnames)
+        if len(uncached) < PARALLEL_SCAN_MIN_FILES:
+            return False
+
+        workers = min(workers, len(uncached))
+        jobs = [
+            (fname, self.get_rel_fname(fname), file_mtime, self.io.encoding)
+            for fname, file_mtime in uncached
+        ]
+        chunksize = max(1, min(32, len(jobs) // (workers * 4)))
 
-        tokens = list(lexer.get_tokens(code))
-        tokens = [token[1] for token in tokens if token[0] in Token.Name]
+        batch = []
+        try:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_pool_context())
+            with pool as executor:
+                results = executor.map(scan_file_tags, jobs, chunksize=chunksize)
+                results = tqdm(results, total=len(jobs), desc="Scanning repo", disable=quiet)
+                for fname, file_mtime, data in results:
+                    if data is None:
+                        continue
+                    batch.append((fname, {"mtime": file_mtime, "data": data}))
+                    if len(batch) >= TAGS_CACHE_BATCH_SIZE:
+                        self.store_tags_batch(batch)
+                        batch = []
+        except (OSError, BrokenProcessPool) as err:
+            if self.verbose:
+                self.io.tool_warning(f"Parallel repo scan failed, scanning serially: {err}")
+            return False
+        finally:
+            if batch:
+                self.store_tags_batch(batch)
 
-        for token in tokens:
-            yield Tag(
-                rel_fname=rel_fname,
-                fname=fname,
-                name=token,
-                kind="ref",
-                line=-1,
-            )
+        return True
 
     def get_ranked_tags(
-        self, chat_fnames, other_fnames, mentioned_fnames, mentioned_idents, progress=None
+        self,
+        chat_fnames,
+        other_fnames,
+        mentioned_fnames,
+        mentioned_idents,
+        progress=None,
+        quiet=False,
     ):
-        import networkx as nx
-
-        defines = defaultdict(set)
-        references = defaultdict(list)
-        definitions = defaultdict(set)
+        if self.symbol_graph is None:
+            self.symbol_graph = SymbolGraph()
+        graph = self.symbol_graph
 
         personalization = dict()
 
         fnames = set(chat_fnames).union(set(other_fnames))
         chat_rel_fnames = set()
+        rel_fnames = set()
 
         fnames = sorted(fnames)
 
@@ -363,20 +821,17 @@ class RepoMap:
         # https://networkx.org/documentation/stable/_modules/networkx/algorithms/link_analysis/pagerank_alg.html#pagerank
         personalize = 100 / len(fnames)
 
-        try:
-            cache_size = len(self.TAGS_CACHE)
-        except SQLITE_ERRORS as e:
-            self.tags_cache_error(e)
-            cache_size = len(self.TAGS_CACHE)
+        cache_size = len(self.TAGS_CACHE)
 
+        showing_bar = False
         if len(fnames) - cache_size > 100:
-            self.io.tool_output(
-                "Initial repo scan can be slow in larger repos, but only happens once."
-            )
-            fnames = tqdm(fnames, desc="Scanning repo")
-            showing_bar = True
-        else:
-            showing_bar = False
+            if not quiet:
+                self.io.tool_output(
+                    "Initial repo scan can be slow in larger repos, but only happens once."
+                )
+            if not self.scan_tags_parallel(fnames, quiet) and not quiet:
+                fnames = tqdm(fnames, desc="Scanning repo")
+                showing_bar = True
 
         for fname in fnames:
             if self.verbose:
@@ -390,7 +845,7 @@ class RepoMap:
                 file_ok = False
 
             if not file_ok:
-                if fname not in self.warned_files:
+                if fname not in self.warned_files and not quiet:
                     self.io.tool_warning(f"Repo-map can't include {fname}")
                     self.io.tool_output(
                         "Has it been deleted from the file system but not from git?"
@@ -425,105 +880,26 @@ class RepoMap:
             if current_pers > 0:
                 personalization[rel_fname] = current_pers  # Assign the final calculated value
 
-            tags = list(self.get_tags(fname, rel_fname))
-            if tags is None:
+            # Only re-read the tags of files which changed since the last ranking
+            file_mtime = self.get_mtime(fname)
+            if file_mtime is None:
                 continue
-
-            for tag in tags:
-                if tag.kind == "def":
-                    defines[tag.name].add(rel_fname)
-                    key = (rel_fname, tag.name)
-                    definitions[key].add(tag)
-
-                elif tag.kind == "ref":
-                    references[tag.name].append(rel_fname)
-
-        ##
-        # dump(defines)
-        # dump(references)
-        # dump(personalization)
-
-        if not references:
-            references = dict((k, list(v)) for k, v in defines.items())
-
-        idents = set(defines.keys()).intersection(set(references.keys()))
-
-        G = nx.MultiDiGraph()
-
-        # Add a small self-edge for every definition that has no references
-        # Helps with tree-sitter 0.23.2 with ruby, where "def greet(name)"
-        # isn't counted as a def AND a ref. tree-sitter 0.24.0 does.
-        for ident in defines.keys():
-            if ident in references:
+            rel_fnames.add(rel_fname)
+            if graph.has_file(rel_fname, file_mtime):
                 continue
-            for definer in defines[ident]:
-                G.add_edge(definer, definer, weight=0.1, ident=ident)
-
-        for ident in idents:
-            if progress:
-                progress(f"{UPDATING_REPO_MAP_MESSAGE}: {ident}")
-
-            definers = defines[ident]
-
-            mul = 1.0
-
-            is_snake = ("_" in ident) and any(c.isalpha() for c in ident)
-            is_kebab = ("-" in ident) and any(c.isalpha() for c in ident)
-            is_camel = any(c.isupper() for c in ident) and any(c.islower() for c in ident)
-            if ident in mentioned_idents:
-                mul *= 10
-            if (is_snake or is_kebab or is_camel) and len(ident) >= 8:
-                mul *= 10
-            if ident.startswith("_"):
-                mul *= 0.1
-            if len(defines[ident]) > 5:
-                mul *= 0.1
-
-            for referencer, num_refs in Counter(references[ident]).items():
-                for definer in definers:
-                    # dump(referencer, definer, num_refs, mul)
-                    # if referencer == definer:
-                    #    continue
 
-                    use_mul = mul
-                    if referencer in chat_rel_fnames:
-                        use_mul *= 50
-
-                    # scale down so high freq (low value) mentions don't dominate
-                    num_refs = math.sqrt(num_refs)
-
-                    G.add_edge(referencer, definer, weight=use_mul * num_refs, ident=ident)
-
-        if not references:
-            pass
-
-        if personalization:
-            pers_args = dict(personalization=personalization, dangling=personalization)
-        else:
-            pers_args = dict()
+            tags = list(self.get_tags(fname, rel_fname))
+            graph.update_file(rel_fname, file_mtime, tags)
 
-        try:
-            ranked = nx.pagerank(G, weight="weight", **pers_args)
-        except ZeroDivisionError:
-            # Issue #1536
-            try:
-                ranked = nx.pagerank(G, weight="weight")
-            except ZeroDivisionError:
-                return []
+        self.save_tags_cache()
 
-        # distribute the rank from each source node, across all of its out edges
-        ranked_definitions = defaultdict(float)
-        for src in G.nodes:
-            if progress:
-                progress(f"{UPDATING_REPO_MAP_MESSAGE}: {src}")
+        graph.remove_files_except(rel_fnames)
+        graph.set_context(chat_rel_fnames, mentioned_idents)
+        graph.refresh_edges(progress)
 
-            src_rank = ranked[src]
-            total_weight = sum(data["weight"] for _src, _dst, data in G.out_edges(src, data=True))
-            # dump(src, src_rank, total_weight)
-            for _src, dst, data in G.out_edges(src, data=True):
-                data["rank"] = src_rank * data["weight"] / total_weight
-                ident = data["ident"]
-                ranked_definitions[(dst, ident)] += data["rank"]
+        ranked, ranked_definitions = graph.rank(personalization, progress)
+        if ranked is None:
+            return []
 
         ranked_tags = []
         ranked_definitions = sorted(
@@ -536,7 +912,7 @@ class RepoMap:
             # print(f"{rank:.03f} {fname} {ident}")
             if fname in chat_rel_fnames:
                 continue
-            ranked_tags += list(definitions.get((fname, ident), []))
+            ranked_tags += list(graph.definitions.get((fname, ident), []))
 
         rel_other_fnames_without_tags = set(self.get_rel_fname(fname) for fname in other_fnames)
 
@@ -562,6 +938,7 @@ class RepoMap:
         mentioned_fnames=None,
         mentioned_idents=None,
         force_refresh=False,
+        quiet=False,
     ):
         # Create a cache key
         cache_key = [
@@ -593,11 +970,36 @@ class RepoMap:
             if use_cache and cache_key in self.map_cache:
                 return self.map_cache[cache_key]
 
-        # If not in cache or force_refresh is True, generate the map
+        # If not in cache or force_refresh is True, generate the map, starting
+        # from an on-disk snapshot of an identical earlier ranking if there is one
         start_time = time.time()
-        result = self.get_ranked_tags_map_uncached(
-            chat_fnames, other_fnames, max_map_tokens, mentioned_fnames, mentioned_idents
+        if not max_map_tokens:
+            max_map_tokens = self.max_map_tokens
+
+        snapshot_key = self.get_map_snapshot_key(
+            chat_fnames, other_fnames or [], mentioned_fnames, mentioned_idents
         )
+        snapshot = None
+        if not force_refresh:
+            snapshot = self.load_map_snapshot(snapshot_key)
+
+        if snapshot and max_map_tokens in snapshot["maps"]:
+            result = snapshot["maps"][max_map_tokens]
+        else:
+            ranked_tags = snapshot["ranked_tags"] if snapshot else None
+            result = self.get_ranked_tags_map_uncached(
+                chat_fnames,
+                other_fnames,
+                max_map_tokens,
+                mentioned_fnames,
+                mentioned_idents,
+                ranked_tags=ranked_tags,
+                quiet=quiet,
+            )
+            if not snapshot:
+                snapshot = dict(ranked_tags=self.last_ranked_tags, maps=dict())
+            snapshot["maps"][max_map_tokens] = result
+            self.save_map_snapshot(snapshot_key, snapshot)
         end_time = time.time()
         self.map_processing_time = end_time - start_time
 
@@ -614,6 +1016,8 @@ class RepoMap:
         max_map_tokens=None,
         mentioned_fnames=None,
         mentioned_idents=None,
+        ranked_tags=None,
+        quiet=False,
     ):
         if not other_fnames:
             other_fnames = list()
@@ -625,67 +1029,133 @@ class RepoMap:
             mentioned_idents = set()
 
         spin = Spinner(UPDATING_REPO_MAP_MESSAGE)
+        if quiet:
+            # Don't draw over the input prompt when building in the background
+            spin.is_tty = False
+
+        if ranked_tags is None:
+            ranked_tags = self.get_ranked_tags(
+                chat_fnames,
+                other_fnames,
+                mentioned_fnames,
+                mentioned_idents,
+                progress=spin.step,
+                quiet=quiet,
+            )
 
-        ranked_tags = self.get_ranked_tags(
-            chat_fnames,
-            other_fnames,
-            mentioned_fnames,
-            mentioned_idents,
-            progress=spin.step,
-        )
+            if self.verbose:
+                self.io.tool_output(f"Tree-sitter registry: {language_registry.stats()}")
 
-        other_rel_fnames = sorted(set(self.get_rel_fname(fname) for fname in other_fnames))
-        special_fnames = filter_important_files(other_rel_fnames)
-        ranked_tags_fnames = set(tag[0] for tag in ranked_tags)
-        special_fnames = [fn for fn in special_fnames if fn not in ranked_tags_fnames]
-        special_fnames = [(fn,) for fn in special_fnames]
+            other_rel_fnames = sorted(set(self.get_rel_fname(fname) for fname in other_fnames))
+            special_fnames = filter_important_files(other_rel_fnames)
+            ranked_tags_fnames = set(tag[0] for tag in ranked_tags)
+            special_fnames = [fn for fn in special_fnames if fn not in ranked_tags_fnames]
+            special_fnames = [(fn,) for fn in special_fnames]
 
-        ranked_tags = special_fnames + ranked_tags
+            ranked_tags = special_fnames + ranked_tags
 
-        spin.step()
+        self.last_ranked_tags = ranked_tags
 
-        num_tags = len(ranked_tags)
-        lower_bound = 0
-        upper_bound = num_tags
-        best_tree = None
-        best_tree_tokens = 0
+        spin.step()
 
         chat_rel_fnames = set(self.get_rel_fname(fname) for fname in chat_fnames)
 
+        # Start each map with empty render caches, so they don't grow without
+        # bound over a session
         self.tree_cache = dict()
+        self.tree_tokens_cache = dict()
+
+        # Search for the longest prefix of ranked_tags that fits. Each file's
+        # block is rendered and tokenized once per set of lines of interest,
+        # so each probe just sums cached per-file costs and only the winning
+        # prefix is assembled into the final map. Gallop up from the initial
+        # guess, so probes never render much more of the repo than the
+        # final map contains.
+        num_tags = len(ranked_tags)
+        best_middle = 0  # longest prefix known to fit
+        too_big = num_tags + 1  # shortest prefix known not to fit
 
-        middle = min(int(max_map_tokens // 25), num_tags)
-        while lower_bound <= upper_bound:
-            # dump(lower_bound, middle, upper_bound)
-
+        middle = min(max(int(max_map_tokens // 25), 1), num_tags)
+        while middle > best_middle:
             if middle > 1500:
                 show_tokens = f"{middle / 1000.0:.1f}K"
             else:
                 show_tokens = str(middle)
             spin.step(f"{UPDATING_REPO_MAP_MESSAGE}: {show_tokens} tokens")
 
-            tree = self.to_tree(ranked_tags[:middle], chat_rel_fnames)
-            num_tokens = self.token_count(tree)
-
-            pct_err = abs(num_tokens - max_map_tokens) / max_map_tokens
-            ok_err = 0.15
-            if (num_tokens <= max_map_tokens and num_tokens > best_tree_tokens) or pct_err < ok_err:
-                best_tree = tree
-                best_tree_tokens = num_tokens
+            num_tokens = self.tree_token_count(ranked_tags[:middle], chat_rel_fnames)
 
-                if pct_err < ok_err:
-                    break
+            if num_tokens <= max_map_tokens:
+                best_middle = middle
+            else:
+                too_big = middle
 
-            if num_tokens < max_map_tokens:
-                lower_bound = middle + 1
+            if too_big > num_tags:
+                middle = min(middle * 2, num_tags)
             else:
-                upper_bound = middle - 1
+                middle = (best_middle + too_big) // 2
 
-            middle = int((lower_bound + upper_bound) // 2)
+        # The summed block costs are an upper bound, as the tokenizer can merge
+        # the newlines where blocks meet. Count the final map once to be sure.
+        best_tree = None
+        while best_middle:
+            best_tree = self.to_tree(ranked_tags[:best_middle], chat_rel_fnames)
+            if self.main_model.token_count(best_tree) <= max_map_tokens:
+                break
+            best_middle -= 1
+            best_tree = None
 
         spin.end()
         return best_tree
 
+    def tree_token_count(self, tags, chat_rel_fnames):
+        """
+        Estimate the tokens to_tree() would produce for these tags, as the sum
+        of each file's separately tokenized block. Tokenizing the blocks apart
+        splits the newlines where they meet, so this is an upper bound that
+        overcounts by about one token per file.
+        """
+        lois = defaultdict(list)
+        abs_fnames = dict()
+        plain_fnames = set()
+        for tag in tags:
+            rel_fname = tag[0]
+            if rel_fname in chat_rel_fnames:
+                continue
+            if type(tag) is Tag:
+                lois[rel_fname].append(tag.line)
+                abs_fnames[rel_fname] = tag.fname
+            else:
+                plain_fnames.add(rel_fname)
+
+        num_tokens = 0
+        for rel_fname, file_lois in lois.items():
+            num_tokens += self.block_token_count(abs_fnames[rel_fname], rel_fname, file_lois)
+        for rel_fname in plain_fnames - set(lois):
+            num_tokens += self.block_token_count(None, rel_fname, None)
+        return num_tokens
+
+    def block_token_count(self, abs_fname, rel_fname, lois):
+        if lois is None:
+            key = (rel_fname,)
+        else:
+            key = (rel_fname, tuple(sorted(lois)), self.get_mtime(abs_fname))
+
+        if key in self.tree_tokens_cache:
+            return self.tree_tokens_cache[key]
+
+        if lois is None:
+            block = "\n" + rel_fname + "\n"
+        else:
+            block = "\n" + rel_fname + ":\n" + self.render_tree(abs_fname, rel_fname, lois)
+
+        # Match the long line truncation in to_tree()
+        block = "\n".join(line[:100] for line in block.splitlines()) + "\n"
+
+        num_tokens = self.main_model.token_count(block)
+        self.tree_tokens_cache[key] = num_tokens
+        return num_tokens
+
     tree_cache = dict()
 
     def render_tree(self, abs_fname, rel_fname, lois):
@@ -765,6 +1235,111 @@ class RepoMap:
         return output
 
 
+def get_tags_from_code(fname, rel_fname, code):
+    lang = filename_to_lang(fname)
+    if not lang:
+        return
+
+    try:
+        parser = language_registry.get_parser(lang)
+        query = language_registry.get_tags_query(lang)
+    except Exception as err:
+        print(f"Skipping file {fname}: {err}")
+        return
+
+    if query is None:
+        return
+
+    tree = parser.parse(bytes(code, "utf-8"))
+
+    # Run the tags queries
+    captures = query_captures(query, tree.root_node)
+
+    saw = set()
+    if USING_TSL_PACK:
+        all_nodes = []
+        for tag, nodes in captures.items():
+            all_nodes += [(node, tag) for node in nodes]
+    else:
+        all_nodes = list(captures)
+
+    for node, tag in all_nodes:
+        if tag.startswith("name.definition."):
+            kind = "def"
+        elif tag.startswith("name.reference."):
+            kind = "ref"
+        else:
+            continue
+
+        saw.add(kind)
+
+        result = Tag(
+            rel_fname=rel_fname,
+            fname=fname,
+            name=node.text.decode("utf-8"),
+            kind=kind,
+            line=node.start_point[0],
+        )
+
+        yield result
+
+    if "ref" in saw:
+        return
+    if "def" not in saw:
+        return
+
+    # We saw defs, without any refs
+    # Some tags files only provide defs (cpp, for example)
+    # Use pygments to backfill refs
+
+    try:
+        lexer = guess_lexer_for_filename(fname, code)
+    except Exception:  # On Windows, bad ref to time.clock which is deprecated?
+        return
+
+    tokens = list(lexer.get_tokens(code))
+    tokens = [token[1] for token in tokens if token[0] in Token.Name]
+
+    for token in tokens:
+        yield Tag(
+            rel_fname=rel_fname,
+            fname=fname,
+            name=token,
+            kind="ref",
+            line=-1,
+        )
+
+
+def get_pool_context():
+    # The repo map is also built in a background thread, and forking a process
+    # that is running threads can deadlock the child
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def scan_file_tags(job):
+    """Worker entry point for RepoMap.scan_tags_parallel()."""
+    fname, rel_fname, file_mtime, encoding = job
+
+    if not filename_to_lang(fname):
+        return fname, file_mtime, []
+
+    try:
+        with open(fname, "r", encoding=encoding) as f:
+            code = f.read()
+    except (OSError, UnicodeError):
+        return fname, file_mtime, None
+
+    if not code:
+        return fname, file_mtime, []
+
+    try:
+        return fname, file_mtime, list(get_tags_from_code(fname, rel_fname, code))
+    except Exception:
+        return fname, file_mtime, None
+
+
 def find_src_files(directory):
     if not os.path.isdir(directory):
         return [directory]
@@ -783,33 +1358,6 @@ def get_random_color():
     return res
 
 
-def get_scm_fname(lang):
-    # Load the tags queries
-    if USING_TSL_PACK:
-        subdir = "tree-sitter-language-pack"
-        try:
-            path = resources.files(__package__).joinpath(
-                "queries",
-                subdir,
-                f"{lang}-tags.scm",
-            )
-            if path.exists():
-                return path
-        except KeyError:
-            pass
-
-    # Fall back to tree-sitter-languages
-    subdir = "tree-sitter-languages"
-    try:
-        return resources.files(__package__).joinpath(
-            "queries",
-            subdir,
-            f"{lang}-tags.scm",
-        )
-    except KeyError:
-        return
-
-
 def get_supported_languages_md():
     from grep_ast.parsers import PARSERS
 
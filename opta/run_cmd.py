@@ -1,19 +1,328 @@
+import codecs
+import io
+import locale
 import os
 import platform
+import re
 import subprocess
 import sys
-from io import BytesIO
+from collections import deque
 
 import pexpect
 import psutil
 
+# Read command output in chunks of up to this many bytes
+READ_SIZE = 65536
+
+# Only keep the end of longer command output
+MAX_OUTPUT_CHARS = 1_000_000
+
+# Default budget for command output that's added to the chat
+MAX_CHAT_OUTPUT_TOKENS = 8192
+
+
+class OutputTail:
+    """
+    A ring buffer of the last max_chars characters of a command's output, so
+    huge logs don't fill memory before they're even shown to the LLM.
+    """
+
+    def __init__(self, max_chars=MAX_OUTPUT_CHARS):
+        self.max_chars = max_chars
+        self.chunks = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def write(self, text):
+        if not text:
+            return
+
+        self.chunks.append(text)
+        self.size += len(text)
+
+        while self.max_chars is not None and self.size > self.max_chars:
+            extra = self.size - self.max_chars
+            first = self.chunks[0]
+            if len(first) <= extra:
+                self.chunks.popleft()
+                extra = len(first)
+            else:
+                self.chunks[0] = first[extra:]
+            self.size -= extra
+            self.dropped += extra
+
+    def getvalue(self):
+        text = "".join(self.chunks)
+        if not self.dropped:
+            return text
+
+        # Start at the first whole line that was kept
+        dropped = self.dropped
+        newline = text.find("\n")
+        if newline >= 0:
+            dropped += newline + 1
+            text = text[newline + 1 :]
+
+        return f"... {dropped} characters of earlier output omitted ...\n" + text
+
+
+class OutputCondenser:
+    """
+    Condense a command's output as it streams in, to fit a token budget.
+
+    Output which fits is kept as is. Longer output keeps its first and last
+    lines, and in between only the lines that help fix a failure:
+    tracebacks, error and failure messages, and lines that point at a line
+    of a file in the repo. Runs of a repeated line are collapsed.
+    """
+
+    # Rough size of a token, so the budget can be kept without tokenizing
+    chars_per_token = 4
+
+    # Shares of the budget for the first and last lines, the rest is for failures
+    head_share = 0.2
+    tail_share = 0.4
+
+    traceback_start = "Traceback (most recent call last):"
+    failure_re = re.compile(
+        r"^E\s|\b(error|exception|fail|failed|failure|fatal|panic|assert|assertion)\b",
+        re.IGNORECASE | re.MULTILINE,
+    )
+    file_ref_re = re.compile(r"(?<![\w./\\-])([\w./\\-]+\.\w+)[:(](\d+)")
+
+    # Quicker checks for whole chunks, which may match more than the ones above
+    maybe_pytest_error_re = re.compile(r"^E\s", re.MULTILINE)
+    maybe_failure_re = re.compile(r"error|exception|fail|fatal|panic|assert")
+    maybe_file_ref_re = re.compile(r"\.\w+[:(]\d")
+
+    def __init__(self, max_tokens=MAX_CHAT_OUTPUT_TOKENS, fnames=None, root=None):
+        self.max_chars = max_tokens * self.chars_per_token
+        self.head_chars = self.max_chars * self.head_share
+        self.tail_chars = self.max_chars * self.tail_share
+        self.failure_chars = self.max_chars - self.head_chars - self.tail_chars
+
+        self.fnames = set(fnames or [])
+        self.root = root
+
+        self.partial = ""
+        self.num_lines = 0
+        self.size = 0
+
+        # Every line, until the output outgrows the budget
+        self.lines = []
+
+        # (first_lineno, last_lineno, text) of the lines being kept
+        self.head = []
+        self.head_size = 0
+        self.head_full = False
+        self.failures = []
+        self.failures_size = 0
+        self.tail = deque()
+        self.tail_size = 0
+
+        self.in_traceback = False
+        self.prev_line = None
+        self.prev_failure = False
+        self.repeats = 0
+
+    def write(self, text):
+        if not text:
+            return
+
+        text = self.partial + text
+        lines = text.split("\n")
+        self.partial = lines.pop()
+
+        # Most of a long output has nothing to pick out, so check whole
+        # chunks before checking each of their lines
+        check = self.might_fail(text)
+        if not check:
+            lines = self.skip_to_tail(lines)
+        for line in lines:
+            self.add_line(line + "\n", check)
+
+    def skip_to_tail(self, lines):
+        """
+        Skip the lines at the start of a chunk with no failures in it, which
+        would only pass through the tail before the chunk's last lines push
+        them out of it. Returns the lines that still need to be added.
+        """
+        if not self.head_full or self.lines is not None:
+            return lines
+
+        # Add up the size of the tail entries for the last runs of repeated lines
+        size = 0
+        end = len(lines)
+        while end > 0:
+            start = end - 1
+            while start > 0 and lines[start - 1] == lines[start]:
+                start -= 1
+
+            size += len(lines[start]) + 1
+            repeats = end - start - 1
+            if repeats and end < len(lines):
+                size += len(f"[previous line repeated {repeats} more times]\n")
+
+            if size > self.tail_chars:
+                break
+            end = start
+        else:
+            return lines
+
+        if start == 0:
+            return lines
+
+        self.num_lines += start
+        self.tail.clear()
+        self.tail_size = 0
+        self.prev_line = None
+        self.prev_failure = False
+        self.repeats = 0
+        return lines[start:]
+
+    def add_line(self, line, check=True):
+        self.num_lines += 1
+        lineno = self.num_lines
+
+        if self.lines is not None:
+            self.lines.append(line)
+            self.size += len(line)
+            if self.size > self.max_chars:
+                self.lines = None
+
+        if line == self.prev_line:
+            self.repeats += 1
+            return
+
+        if self.repeats:
+            msg = f"[previous line repeated {self.repeats} more times]\n"
+            self.keep(lineno - self.repeats, lineno - 1, msg, self.prev_failure)
+            self.repeats = 0
+
+        self.prev_line = line
+        self.prev_failure = check and self.is_failure(line)
+        self.keep(lineno, lineno, line, self.prev_failure)
+
+    def might_fail(self, text):
+        if self.in_traceback or self.traceback_start in text:
+            return True
+        if self.maybe_pytest_error_re.search(text):
+            return True
+        if self.maybe_failure_re.search(text.lower()):
+            return True
+        if not self.maybe_file_ref_re.search(text):
+            return False
+        return any(self.is_repo_file(match.group(1)) for match in self.file_ref_re.finditer(text))
+
+    def is_failure(self, line):
+        if line.startswith(self.traceback_start):
+            self.in_traceback = True
+            return True
+
+        if self.in_traceback:
+            # The exception itself is the first line that isn't indented
+            if line.strip() and not line[0].isspace():
+                self.in_traceback = False
+            return True
+
+        if self.failure_re.search(line):
+            return True
+
+        for match in self.file_ref_re.finditer(line):
+            if self.is_repo_file(match.group(1)):
+                return True
+
+        return False
+
+    def is_repo_file(self, fname):
+        if fname in self.fnames:
+            return True
+
+        if os.path.isabs(fname):
+            if not self.root:
+                return False
+            try:
+                fname = os.path.relpath(fname, self.root)
+            except ValueError:
+                return False
+
+        fname = os.path.normpath(fname).replace("\\", "/")
+        return fname in self.fnames
+
+    def keep(self, first, last, text, failure):
+        entry = (first, last, text)
+
+        if not self.head_full:
+            if self.head_size + len(text) <= self.head_chars:
+                self.head.append(entry)
+                self.head_size += len(text)
+                return
+            self.head_full = True
+
+        if failure and self.failures_size + len(text) <= self.failure_chars:
+            self.failures.append(entry)
+            self.failures_size += len(text)
+
+        self.tail.append(entry)
+        self.tail_size += len(text)
+        while len(self.tail) > 1 and self.tail_size > self.tail_chars:
+            self.tail_size -= len(self.tail.popleft()[2])
+
+    def getvalue(self):
+        if self.partial:
+            partial = self.partial
+            self.partial = ""
+            self.add_line(partial)
+
+        if self.lines is not None:
+            return "".join(self.lines)
+
+        entries = list(self.head)
+        tail_start = self.tail[0][0] if self.tail else self.num_lines + 1
+        entries += [entry for entry in self.failures if entry[0] < tail_start]
+        entries += self.tail
+
+        if self.repeats:
+            last = self.num_lines
+            msg = f"[previous line repeated {self.repeats} more times]\n"
+            entries.append((last - self.repeats + 1, last, msg))
+
+        res = []
+        prev_last = 0
+        for first, last, text in entries:
+            if first <= prev_last:
+                continue
+            omitted = first - prev_last - 1
+            if omitted:
+                res.append(f"... {omitted} lines omitted ...\n")
+            res.append(text)
+            prev_last = last
+
+        omitted = self.num_lines - prev_last
+        if omitted > 0:
+            res.append(f"... {omitted} lines omitted ...\n")
+
+        return "".join(res)
+
+
+def run_cmd(
+    command, verbose=False, error_print=None, cwd=None, max_output=MAX_OUTPUT_CHARS, output=None
+):
+    """
+    Run command, echoing its output. Returns (exit_status, output).
+
+    output can be an object with write() and getvalue(), like OutputCondenser,
+    which collects the output as it streams. By default the last max_output
+    characters are returned.
+    """
+    if output is None:
+        output = OutputTail(max_output)
 
-def run_cmd(command, verbose=False, error_print=None, cwd=None):
     try:
         if sys.stdin.isatty() and hasattr(pexpect, "spawn") and platform.system() != "Windows":
-            return run_cmd_pexpect(command, verbose, cwd)
+            return run_cmd_pexpect(command, verbose, cwd, output=output)
 
-        return run_cmd_subprocess(command, verbose, cwd)
+        return run_cmd_subprocess(command, verbose, cwd, output=output)
     except OSError as e:
         error_message = f"Error occurred while running command '{command}': {str(e)}"
         if error_print is None:
@@ -39,7 +348,15 @@ def get_windows_parent_process_name():
         return None
 
 
-def run_cmd_subprocess(command, verbose=False, cwd=None, encoding=sys.stdout.encoding):
+def run_cmd_subprocess(
+    command,
+    verbose=False,
+    cwd=None,
+    encoding=sys.stdout.encoding,
+    echo=True,
+    max_output=MAX_OUTPUT_CHARS,
+    output=None,
+):
     if verbose:
         print("Using run_cmd_subprocess:", command)
 
@@ -63,30 +380,35 @@ def run_cmd_subprocess(command, verbose=False, cwd=None, encoding=sys.stdout.enc
             command,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True,
             shell=True,
-            encoding=encoding,
-            errors="replace",
             bufsize=0,  # Set bufsize to 0 for unbuffered output
-            universal_newlines=True,
             cwd=cwd,
         )
 
-        output = []
+        # Decode as text mode would, but a whole chunk at a time
+        decoder = codecs.getincrementaldecoder(encoding or locale.getpreferredencoding(False))
+        decoder = io.IncrementalNewlineDecoder(decoder(errors="replace"), translate=True)
+
+        if output is None:
+            output = OutputTail(max_output)
         while True:
-            chunk = process.stdout.read(1)
-            if not chunk:
+            # An unbuffered pipe returns whatever output is ready, up to READ_SIZE
+            data = process.stdout.read(READ_SIZE)
+            chunk = decoder.decode(data or b"", final=not data)
+            if chunk:
+                if echo:
+                    print(chunk, end="", flush=True)  # Print the chunk in real-time
+                output.write(chunk)  # Store the chunk for later use
+            if not data:
                 break
-            print(chunk, end="", flush=True)  # Print the chunk in real-time
-            output.append(chunk)  # Store the chunk for later use
 
         process.wait()
-        return process.returncode, "".join(output)
+        return process.returncode, output.getvalue()
     except Exception as e:
         return 1, str(e)
 
 
-def run_cmd_pexpect(command, verbose=False, cwd=None):
+def run_cmd_pexpect(command, verbose=False, cwd=None, max_output=MAX_OUTPUT_CHARS, output=None):
     """
     Run a shell command interactively using pexpect, capturing all output.
 
@@ -97,10 +419,12 @@ def run_cmd_pexpect(command, verbose=False, cwd=None):
     if verbose:
         print("Using run_cmd_pexpect:", command)
 
-    output = BytesIO()
+    if output is None:
+        output = OutputTail(max_output)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
 
     def output_callback(b):
-        output.write(b)
+        output.write(decoder.decode(b))
         return b
 
     try:
@@ -125,7 +449,8 @@ def run_cmd_pexpect(command, verbose=False, cwd=None):
 
         # Wait for the command to finish and get the exit status
         child.close()
-        return child.exitstatus, output.getvalue().decode("utf-8", errors="replace")
+        output.write(decoder.decode(b"", final=True))
+        return child.exitstatus, output.getvalue()
 
     except (pexpect.ExceptionPexpect, TypeError, ValueError) as e:
         error_msg = f"Error running command {command}: {e}"
@@ -0,0 +1,174 @@
+import json
+import os
+
+from opta.dump import dump  # noqa: F401
+
+
+def content_chars(messages):
+    return sum(len(str(msg.get("content", ""))) for msg in messages)
+
+
+def keep_recent(messages, max_chars):
+    """
+    Return the latest messages whose content adds up to about max_chars,
+    starting with a user message.
+    """
+    chars = content_chars(messages)
+
+    # Drop the oldest messages beyond the budget
+    start = 0
+    while start < len(messages) - 1 and chars > max_chars:
+        chars -= content_chars(messages[start : start + 1])
+        start += 1
+
+    while start < len(messages) and messages[start].get("role") != "user":
+        start += 1
+
+    return messages[start:]
+
+
+class SessionLog:
+    """
+    Append-only log of the chat messages, one JSON object per line.
+
+    Every run of opta that logs a message starts a session. The byte offset
+    where each session begins is appended to a small index file next to the
+    log, so a session can be read without scanning the ones before it and the
+    most recent messages are read backwards from the end of the log.
+
+    Messages are buffered by append() and written out together by flush().
+    """
+
+    # Bytes read at a time when reading the log backwards
+    read_block = 64 * 1024
+
+    def __init__(self, fname, started=""):
+        self.fname = os.fspath(fname)
+        self.index_fname = os.path.splitext(self.fname)[0] + ".idx"
+        self.started = started
+
+        self.pending = []
+        self.session_offset = None
+
+    def exists(self):
+        return os.path.exists(self.fname)
+
+    def append(self, messages):
+        for msg in messages:
+            try:
+                line = json.dumps(msg, ensure_ascii=False) + "\n"
+            except (TypeError, ValueError):
+                continue
+            self.pending.append(line.encode("utf-8"))
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.fname)), exist_ok=True)
+        with open(self.fname, "ab") as f:
+            offset = f.tell()
+            if self.session_offset is None:
+                # Don't run into a record left unfinished by an interrupted run
+                if offset and not self.ends_with_newline():
+                    f.write(b"\n")
+                    offset += 1
+                self.add_session(offset)
+            f.write(b"".join(self.pending))
+
+        self.pending = []
+
+    def ends_with_newline(self):
+        with open(self.fname, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def add_session(self, offset):
+        with open(self.index_fname, "a", encoding="utf-8") as f:
+            f.write(f"{offset}\t{self.started}\n")
+        self.session_offset = offset
+
+    def sessions(self):
+        """Return the (offset, started) of each session, oldest first."""
+        try:
+            with open(self.index_fname, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+
+        sessions = []
+        for line in lines:
+            offset, _, started = line.rstrip("\n").partition("\t")
+            try:
+                sessions.append((int(offset), started))
+            except ValueError:
+                continue
+        return sessions
+
+    def load_session(self, num=-1):
+        """Return the messages of one session, by default the latest."""
+        self.flush()
+
+        offsets = [offset for offset, _started in self.sessions()]
+        try:
+            start = offsets[num]
+        except IndexError:
+            return []
+
+        later = [offset for offset in offsets if offset > start]
+        end = min(later) if later else None
+
+        try:
+            with open(self.fname, "rb") as f:
+                f.seek(start)
+                data = f.read() if end is None else f.read(end - start)
+        except FileNotFoundError:
+            return []
+
+        return self.parse(data.splitlines())
+
+    def load_recent(self, max_chars):
+        """
+        Return the latest messages whose content adds up to about max_chars,
+        starting with a user message.
+        """
+        self.flush()
+
+        try:
+            f = open(self.fname, "rb")
+        except FileNotFoundError:
+            return []
+
+        with f:
+            pos = f.seek(0, os.SEEK_END)
+            partial = b""
+            messages = []
+            chars = 0
+
+            while pos > 0 and chars < max_chars:
+                size = min(self.read_block, pos)
+                pos -= size
+                f.seek(pos)
+                lines = (f.read(size) + partial).split(b"\n")
+
+                # The first line may continue in the block before this one
+                partial = lines.pop(0) if pos > 0 else b""
+
+                block = self.parse(lines)
+                chars += content_chars(block)
+                messages = block + messages
+
+        return keep_recent(messages, max_chars)
+
+    def parse(self, lines):
+        messages = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(msg, dict) and "role" in msg:
+                messages.append(msg)
+        return messages
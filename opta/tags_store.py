@@ -0,0 +1,327 @@
+import mmap
+import os
+import pickle
+import struct
+import uuid
+
+from opta.dump import dump  # noqa: F401
+
+# Each tag is one fixed width row: file_id, name_id, kind, line
+ROW = struct.Struct("<IIBi")
+
+STORE_VERSION = 1
+
+# Corrupt or foreign index files are discarded rather than reported
+INDEX_ERRORS = (EOFError, ValueError, TypeError, KeyError, pickle.UnpicklingError, struct.error)
+
+
+class TagsStore:
+    """
+    Columnar on-disk store of the repo map's tags.
+
+    Identifier names are interned into a string table and every tag is a
+    fixed width row in a rows file, which is memory-mapped when the store is
+    loaded. Each file's rows are contiguous, so its tags are a single slice
+    of the map. Upserts are buffered and appended to the rows file in bulk;
+    superseded rows are dropped when the rows file is compacted.
+
+    It offers the subset of the dict interface that the repo map used with
+    diskcache: get(), [], update(), len() and `in`. Values are
+    {"mtime": mtime, "data": [Tag, ...]}.
+    """
+
+    INDEX_FNAME = "tags.index"
+
+    # Write buffered upserts once this many files are pending
+    flush_every = 256
+
+    # Compact once superseded rows outnumber the live ones
+    min_compact_rows = 4096
+
+    def __init__(self, path, tag_class):
+        self.path = os.fspath(path)
+        self.tag_class = tag_class
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self.pending = dict()
+        self.deleted = False
+        self.stale_rows_fnames = []
+        self.load()
+
+    def load(self):
+        """Read the index and map the rows file, discarding them if they're unusable."""
+        self.close()
+        self.reset()
+
+        index_path = os.path.join(self.path, self.INDEX_FNAME)
+        try:
+            with open(index_path, "rb") as f:
+                index = pickle.load(f)
+            if index["version"] != STORE_VERSION:
+                return
+
+            rows_fname = index["rows_fname"]
+            num_rows = index["num_rows"]
+            self.map_rows(rows_fname, num_rows)
+
+            self.rows_fname = rows_fname
+            self.num_rows = num_rows
+            self.names = index["names"]
+            self.kinds = index["kinds"]
+            self.entries = index["entries"]
+            self.next_file_id = index["next_file_id"]
+        except FileNotFoundError:
+            return
+        except INDEX_ERRORS:
+            self.close()
+            self.reset()
+
+    def reset(self):
+        self.rows_fname = None
+        self.num_rows = 0
+        self.names = []
+        self.name_ids = None
+        self.kinds = []
+        # fname -> (file_id, rel_fname, mtime, start_row, num_rows)
+        self.entries = dict()
+        self.next_file_id = 0
+        self.rows = None
+
+    def map_rows(self, rows_fname, num_rows):
+        if not num_rows:
+            return
+
+        with open(os.path.join(self.path, rows_fname), "rb") as f:
+            rows = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(rows) < num_rows * ROW.size:
+            rows.close()
+            raise ValueError(f"Truncated tags rows file {rows_fname}")
+        self.rows = rows
+
+    def close(self):
+        rows = getattr(self, "rows", None)
+        if rows is not None:
+            rows.close()
+        self.rows = None
+
+    def __len__(self):
+        return len(self.entries.keys() | self.pending.keys())
+
+    def __contains__(self, fname):
+        return fname in self.pending or fname in self.entries
+
+    def get(self, fname, default=None):
+        if fname in self.pending:
+            return self.pending[fname]
+
+        entry = self.entries.get(fname)
+        if entry is None:
+            return default
+
+        _file_id, _rel_fname, mtime, _start, _count = entry
+        return {"mtime": mtime, "data": self.read_tags(fname, entry, self.rows)}
+
+    def get_mtime(self, fname):
+        """The mtime stored with fname's tags, without decoding them."""
+        if fname in self.pending:
+            return self.pending[fname]["mtime"]
+
+        entry = self.entries.get(fname)
+        if entry is not None:
+            return entry[2]
+
+    def __getitem__(self, fname):
+        val = self.get(fname)
+        if val is None:
+            raise KeyError(fname)
+        return val
+
+    def __setitem__(self, fname, val):
+        self.pending[fname] = val
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def __delitem__(self, fname):
+        if fname not in self:
+            raise KeyError(fname)
+        self.pending.pop(fname, None)
+        if self.entries.pop(fname, None) is not None:
+            self.deleted = True
+
+    def update(self, items):
+        if hasattr(items, "items"):
+            items = items.items()
+        for fname, val in items:
+            self.pending[fname] = val
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def read_tags(self, fname, entry, rows):
+        _file_id, rel_fname, _mtime, start, count = entry
+        if not count:
+            return []
+
+        names = self.names
+        kinds = self.kinds
+        Tag = self.tag_class
+
+        buf = rows[start * ROW.size : (start + count) * ROW.size]
+        return [
+            Tag(rel_fname, fname, line, names[name_id], kinds[kind])
+            for _file_id, name_id, kind, line in ROW.iter_unpack(buf)
+        ]
+
+    def intern(self, name):
+        if self.name_ids is None:
+            self.name_ids = {name: name_id for name_id, name in enumerate(self.names)}
+
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = name_id
+        return name_id
+
+    def intern_kind(self, kind):
+        try:
+            return self.kinds.index(kind)
+        except ValueError:
+            self.kinds.append(kind)
+            return len(self.kinds) - 1
+
+    def encode_rows(self, file_id, tags):
+        return b"".join(
+            ROW.pack(file_id, self.intern(tag.name), self.intern_kind(tag.kind), tag.line)
+            for tag in tags
+        )
+
+    def live_rows(self):
+        return sum(entry[4] for entry in self.entries.values())
+
+    def flush(self):
+        """Write all the buffered upserts and deletes, then remap the rows file."""
+        if not self.pending and not self.deleted:
+            return
+
+        pending = self.pending
+        self.pending = dict()
+        self.deleted = False
+
+        old_rows = self.rows
+        self.rows = None
+        try:
+            self.write(pending, old_rows)
+        finally:
+            if old_rows is not None:
+                old_rows.close()
+
+        self.map_rows(self.rows_fname, self.num_rows)
+
+    def write(self, upserts, old_rows):
+        live_rows = self.live_rows() - sum(
+            self.entries[fname][4] for fname in upserts if fname in self.entries
+        )
+        dead_rows = self.num_rows - live_rows
+
+        rows_path = self.rows_fname and os.path.join(self.path, self.rows_fname)
+        appendable = rows_path and os.path.exists(rows_path)
+        if appendable:
+            # Another session may have compacted the store out from under us
+            appendable = os.path.getsize(rows_path) == self.num_rows * ROW.size
+        if dead_rows > max(live_rows, self.min_compact_rows):
+            appendable = False
+
+        if appendable:
+            # Windows won't grow a file while it's mapped
+            if old_rows is not None:
+                old_rows.close()
+            self.append(rows_path, upserts)
+        else:
+            self.compact(upserts, old_rows)
+
+        self.write_index()
+
+    def append(self, rows_path, upserts):
+        start = self.num_rows
+        with open(rows_path, "ab") as f:
+            for fname, val in upserts.items():
+                file_id = self.get_file_id(fname)
+                data = val["data"]
+                f.write(self.encode_rows(file_id, data))
+                self.entries[fname] = (
+                    file_id,
+                    self.get_rel_fname(data),
+                    val["mtime"],
+                    start,
+                    len(data),
+                )
+                start += len(data)
+        self.num_rows = start
+
+    def compact(self, upserts, old_rows):
+        """Rewrite every live file's tags into a fresh rows file."""
+        live = dict()
+        for fname, entry in self.entries.items():
+            if fname in upserts:
+                continue
+            # Rows lost to another session's compaction just get rescanned
+            if entry[4] and old_rows is None:
+                continue
+            live[fname] = {"mtime": entry[2], "data": self.read_tags(fname, entry, old_rows)}
+        live.update(upserts)
+
+        if self.rows_fname:
+            self.stale_rows_fnames.append(self.rows_fname)
+
+        self.rows_fname = f"tags.{uuid.uuid4().hex}.rows"
+        self.num_rows = 0
+        self.names = []
+        self.name_ids = None
+        self.kinds = []
+        self.entries = dict()
+        self.next_file_id = 0
+
+        rows_path = os.path.join(self.path, self.rows_fname)
+        with open(rows_path, "wb"):
+            pass
+        self.append(rows_path, live)
+
+    def write_index(self):
+        index = dict(
+            version=STORE_VERSION,
+            rows_fname=self.rows_fname,
+            num_rows=self.num_rows,
+            names=self.names,
+            kinds=self.kinds,
+            entries=self.entries,
+            next_file_id=self.next_file_id,
+        )
+
+        index_path = os.path.join(self.path, self.INDEX_FNAME)
+        tmp_path = f"{index_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+
+        # Only drop replaced rows files once the index no longer points at them
+        for rows_fname in self.stale_rows_fnames:
+            try:
+                os.remove(os.path.join(self.path, rows_fname))
+            except OSError:
+                pass
+        self.stale_rows_fnames = []
+
+    def get_file_id(self, fname):
+        entry = self.entries.get(fname)
+        if entry is not None:
+            return entry[0]
+
+        file_id = self.next_file_id
+        self.next_file_id += 1
+        return file_id
+
+    def get_rel_fname(self, data):
+        if data:
+            return data[0].rel_fname
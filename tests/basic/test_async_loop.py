@@ -0,0 +1,86 @@
+import asyncio
+import concurrent.futures
+import threading
+import unittest
+
+from opta.async_loop import AsyncLoop, get_async_loop
+
+
+class TestAsyncLoop(unittest.TestCase):
+    def test_runs_coroutines_on_one_thread(self):
+        loop = AsyncLoop()
+        try:
+
+            async def thread_name():
+                await asyncio.sleep(0)
+                return threading.current_thread().name
+
+            futures = [loop.submit(thread_name()) for _ in range(5)]
+            names = {future.result(timeout=5) for future in futures}
+            self.assertEqual(names, {"opta-async-loop"})
+            self.assertEqual(loop.run(thread_name(), timeout=5), "opta-async-loop")
+        finally:
+            loop.stop()
+
+    def test_concurrent_requests_overlap(self):
+        loop = AsyncLoop()
+        try:
+            started = []
+
+            async def request(i):
+                started.append(i)
+                await asyncio.sleep(0.05)
+                return len(started)
+
+            futures = [loop.submit(request(i)) for i in range(10)]
+            # Every request started before the first one finished
+            self.assertEqual([future.result(timeout=5) for future in futures], [10] * 10)
+        finally:
+            loop.stop()
+
+    def test_restarts_after_stop(self):
+        loop = AsyncLoop()
+
+        async def answer():
+            return 42
+
+        self.assertEqual(loop.run(answer(), timeout=5), 42)
+        loop.stop()
+        self.assertEqual(loop.run(answer(), timeout=5), 42)
+        loop.stop()
+
+    def test_run_cancels_on_timeout(self):
+        loop = AsyncLoop()
+        try:
+            cancelled = threading.Event()
+
+            async def slow_request():
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                loop.run(slow_request(), timeout=0.05)
+            self.assertTrue(cancelled.wait(5))
+        finally:
+            loop.stop()
+
+    def test_run_from_the_loop_thread_raises(self):
+        loop = AsyncLoop()
+        try:
+
+            async def answer():
+                return 42
+
+            async def nested():
+                return loop.run(answer())
+
+            with self.assertRaises(RuntimeError):
+                loop.run(nested(), timeout=5)
+        finally:
+            loop.stop()
+
+    def test_get_async_loop_returns_singleton(self):
+        self.assertIs(get_async_loop(), get_async_loop())
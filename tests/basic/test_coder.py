@@ -1,5 +1,6 @@
 import os
 import tempfile
+import threading
 import unittest
 from pathlib import Path
 from unittest.mock import MagicMock, patch
@@ -609,6 +610,135 @@ new
             num_commits = len(list(repo.iter_commits(repo.active_branch.name)))
             self.assertEqual(num_commits, 2)
 
+    def test_background_commits(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+
+            fname = Path("file.txt")
+            fname.write_text("one\n")
+            repo.git.add(str(fname))
+            repo.git.commit("-m", "initial")
+
+            io = InputOutput(yes=True)
+            coder = Coder.create(
+                self.GPT35, "diff", io=io, fnames=[str(fname)], background_commits=True
+            )
+
+            message_ready = threading.Event()
+
+            def mock_get_commit_message(*args, **kwargs):
+                message_ready.wait(5)
+                return "commit message"
+
+            coder.repo.get_commit_message = mock_get_commit_message
+            coder.io.get_input = MagicMock(return_value="next")
+
+            fname.write_text("two\n")
+            saved_message = coder.auto_commit({str(fname)})
+            self.assertEqual(saved_message, coder.gpt_prompts.files_content_gpt_edits_no_repo)
+
+            # Nothing is reported until the commit is made
+            coder.get_input()
+            self.assertEqual(coder.opta_commit_hashes, set())
+
+            message_ready.set()
+            coder.repo.commit_queue.pending[0].result(5)
+
+            # A finished commit is reported before the next prompt
+            coder.get_input()
+
+            commit_hash = repo.head.commit.hexsha[:7]
+            self.assertEqual(repo.head.commit.message.strip(), "commit message")
+            self.assertEqual(coder.opta_commit_hashes, {commit_hash})
+            self.assertEqual(coder.last_opta_commit_hash, commit_hash)
+
+            coder.init_before_message()
+            self.assertEqual(coder.commit_before_message[-1], repo.head.commit.hexsha)
+
+    def test_summary_does_not_block(self):
+        with GitTemporaryDirectory():
+            io = InputOutput(yes=True)
+            coder = Coder.create(self.GPT35, None, io=io)
+
+            summary_ready = threading.Event()
+            summary = [
+                dict(role="user", content="summary"),
+                dict(role="assistant", content="Ok."),
+            ]
+
+            def mock_summarize(messages):
+                summary_ready.wait(5)
+                return list(summary)
+
+            coder.summarizer = MagicMock()
+            coder.summarizer.max_tokens = 1024
+            coder.summarizer.too_big.side_effect = lambda messages, max_tokens=None: not max_tokens
+            coder.summarizer.summarize = mock_summarize
+
+            old_messages = [
+                dict(role="user", content="one"),
+                dict(role="assistant", content="two"),
+            ]
+            coder.done_messages = list(old_messages)
+            coder.summarize_start()
+
+            # The next exchange completes while the summary is still running
+            new_messages = [
+                dict(role="user", content="three"),
+                dict(role="assistant", content="four"),
+            ]
+            coder.cur_messages = list(new_messages)
+            coder.move_back_cur_messages(None)
+
+            chunks = coder.format_chat_chunks()
+            self.assertEqual(chunks.done, old_messages + new_messages)
+            self.assertIsNotNone(coder.summarizer_thread)
+
+            summary_ready.set()
+            coder.summarizer_thread.join(5)
+
+            # The summary replaces what it covered, newer messages follow it
+            coder.summarizer.too_big.side_effect = None
+            coder.summarizer.too_big.return_value = False
+            chunks = coder.format_chat_chunks()
+            self.assertEqual(chunks.done, summary + new_messages)
+            self.assertIsNone(coder.summarizer_thread)
+
+    def test_restored_history_is_not_sent_whole(self):
+        with GitTemporaryDirectory():
+            # A restored history larger than the model's whole window
+            words = " ".join(f"word{num}" for num in range(200))
+            with open(".opta.chat.history.md", "w") as f:
+                for num in range(200):
+                    f.write(f"#### question {num} {words}\n\nanswer {num} {words}\n\n")
+
+            summary_ready = threading.Event()
+
+            def mock_summarize(self, messages):
+                summary_ready.wait(5)
+                return [
+                    dict(role="user", content="summary"),
+                    dict(role="assistant", content="Ok."),
+                ]
+
+            io = InputOutput(yes=True, chat_history_file=".opta.chat.history.md")
+            with patch("opta.history.ChatSummary.summarize", mock_summarize):
+                coder = Coder.create(self.GPT35, None, io=io, restore_chat_history=True)
+                self.assertIsNotNone(coder.summarizer_thread)
+
+                # Only the latest messages are sent while the summary is running
+                chunks = coder.format_chat_chunks()
+                done_tokens = self.GPT35.token_count(chunks.done)
+                self.assertLessEqual(done_tokens, self.GPT35.max_chat_history_tokens)
+                self.assertEqual(chunks.done[0]["role"], "user")
+                self.assertIn("answer 199", chunks.done[-1]["content"])
+
+                summary_ready.set()
+                coder.summarizer_thread.join(5)
+
+            chunks = coder.format_chat_chunks()
+            self.assertEqual(chunks.done[0]["content"], "summary")
+
     def test_only_commit_gpt_edited_file(self):
         """
         Only commit file that gpt edits, not other dirty files.
@@ -649,7 +779,7 @@ TWO
                 coder.partial_response_function_call = dict()
                 return []
 
-            def mock_get_commit_message(diffs, context, user_language=None):
+            def mock_get_commit_message(diffs, context, user_language=None, quiet=False):
                 self.assertNotIn("one", diffs)
                 self.assertNotIn("ONE", diffs)
                 return "commit message"
@@ -704,7 +834,7 @@ three
 
             saved_diffs = []
 
-            def mock_get_commit_message(diffs, context, user_language=None):
+            def mock_get_commit_message(diffs, context, user_language=None, quiet=False):
                 saved_diffs.append(diffs)
                 return "commit message"
 
@@ -782,7 +912,7 @@ two
 
             saved_diffs = []
 
-            def mock_get_commit_message(diffs, context, user_language=None):
+            def mock_get_commit_message(diffs, context, user_language=None, quiet=False):
                 saved_diffs.append(diffs)
                 return "commit message"
 
@@ -834,6 +964,58 @@ two
             self.assertNotIn(fname2, str(coder.abs_fnames))
             self.assertNotIn(fname3, str(coder.abs_fnames))
 
+    def test_precomputed_repo_map(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+
+            fname = Path("shapes.py")
+            fname.write_text("def area(shape):\n    return shape.width * shape.height\n")
+            Path("main.py").write_text("from shapes import area\n\nprint(area(None))\n")
+            repo.git.add(".")
+            repo.git.commit("-m", "initial")
+
+            io = InputOutput(yes=True)
+            coder = Coder.create(self.GPT35, None, io, map_tokens=1024)
+
+            message = "Make area handle None"
+
+            # The input loop only queues the text, the worker scans the repo
+            threads = []
+            get_repo_map_request = coder.get_repo_map_request
+
+            def record_thread(text):
+                threads.append(threading.current_thread())
+                return get_repo_map_request(text)
+
+            with patch.object(coder, "get_repo_map_request", side_effect=record_thread):
+                coder.repo_map_precompute_start(message)
+                thread = coder.repo_map_thread
+                if thread:
+                    thread.join()
+            self.assertEqual(len(threads), 1)
+            self.assertIsNot(threads[0], threading.current_thread())
+
+            expected = coder.build_repo_map(coder.get_repo_map_request(message + "\n"))
+
+            # The map built while typing is reused once the message is sent
+            coder.cur_messages = [dict(role="user", content=message)]
+            with patch.object(coder, "build_repo_map") as mock_build:
+                self.assertEqual(coder.get_repo_map(), expected)
+                mock_build.assert_not_called()
+
+            # A different message, or a file edited since, needs a fresh map
+            coder.cur_messages = [dict(role="user", content="Something else")]
+            with patch.object(coder, "build_repo_map") as mock_build:
+                coder.get_repo_map()
+                mock_build.assert_called_once()
+
+            coder.cur_messages = [dict(role="user", content=message)]
+            mtime = fname.stat().st_mtime + 10
+            os.utime(fname, (mtime, mtime))
+            with patch.object(coder, "build_repo_map") as mock_build:
+                coder.get_repo_map()
+                mock_build.assert_called_once()
+
     def test_skip_gitignored_files_on_init(self):
         with GitTemporaryDirectory() as _:
             repo_path = Path(".")
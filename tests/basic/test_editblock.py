@@ -3,6 +3,7 @@
 import tempfile
 import unittest
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
 from opta.coders import Coder
@@ -49,8 +50,7 @@ class TestUtils(unittest.TestCase):
         lines = [r"\windows__init__.py", "```"]
         self.assertEqual(eb.find_filename(lines, fence, valid_fnames), r"\windows\__init__.py")
 
-    # fuzzy logic disabled v0.11.2-dev
-    def __test_replace_most_similar_chunk(self):
+    def test_replace_most_similar_chunk(self):
         whole = "This is a sample text.\nAnother line of text.\nYet another line.\n"
         part = "This is a sample text\n"
         replace = "This is a replaced text.\n"
@@ -59,8 +59,7 @@ class TestUtils(unittest.TestCase):
         result = eb.replace_most_similar_chunk(whole, part, replace)
         self.assertEqual(result, expected_output)
 
-    # fuzzy logic disabled v0.11.2-dev
-    def __test_replace_most_similar_chunk_not_perfect_match(self):
+    def test_replace_most_similar_chunk_not_perfect_match(self):
         whole = "This is a sample text.\nAnother line of text.\nYet another line.\n"
         part = "This was a sample text.\nAnother line of txt\n"
         replace = "This is a replaced text.\nModified line of text.\n"
@@ -69,6 +68,15 @@ class TestUtils(unittest.TestCase):
         result = eb.replace_most_similar_chunk(whole, part, replace)
         self.assertEqual(result, expected_output)
 
+    def test_find_similar_lines(self):
+        content = "".join(f"def func{i}(x):\n    y = x * {i}\n    return y\n\n" for i in range(500))
+        search = "def func250(x):\n    y = x * 250 \n    return y\n"
+
+        result = eb.find_similar_lines(search, content)
+        self.assertEqual(result, "def func250(x):\n    y = x * 250\n    return y")
+
+        self.assertEqual(eb.find_similar_lines("nothing\nlike\nthis\n", content), "")
+
     def test_strip_quoted_wrapping(self):
         input_text = (
             "filename.ext\n```\nWe just want this content\nNot the filename and triple quotes\n```"
@@ -297,6 +305,33 @@ These changes replace the `subprocess.run` patches with `subprocess.check_output
         result = eb.replace_most_similar_chunk(whole, part, replace)
         self.assertEqual(result, expected_output)
 
+    def test_replace_reuses_line_index_across_edits(self):
+        whole = "".join(f"    def func{i}():\n        return {i}\n\n" for i in range(50))
+
+        with patch.object(eb, "LineIndex", wraps=eb.LineIndex) as mock_index:
+            for i in (10, 40, 3):
+                part = f"    def func{i}():\n        return {i}\n"
+                replace = f"    def func{i}():\n        return -{i}\n        # edited\n"
+                if i == 40:
+                    part = "".join(line[4:] for line in part.splitlines(keepends=True))
+                    replace = "".join(line[4:] for line in replace.splitlines(keepends=True))
+                whole = eb.replace_most_similar_chunk(whole, part, replace)
+
+            # Only the original content was hashed, each edit's result was indexed from it
+            self.assertEqual(mock_index.call_count, 1)
+
+        for i in range(50):
+            if i in (10, 40, 3):
+                self.assertIn(f"    def func{i}():\n        return -{i}\n        # edited\n", whole)
+            else:
+                self.assertIn(f"    def func{i}():\n        return {i}\n\n", whole)
+
+        index = eb.get_line_index(whole)
+        part_lines = ["        return 45\n"]
+        self.assertEqual(
+            list(index.find(part_lines)), [whole.splitlines().index("        return 45")]
+        )
+
     def test_replace_part_with_just_some_missing_leading_whitespace(self):
         whole = "    line1\n    line2\n    line3\n"
         part = " line1\n line2\n"
@@ -395,6 +430,145 @@ new
         content = Path(file1).read_text(encoding="utf-8")
         self.assertEqual(content, "one\nnew\nthree\n")
 
+    def test_check_streamed_edits(self):
+        _, file1 = tempfile.mkstemp()
+
+        with open(file1, "w", encoding="utf-8") as f:
+            f.write("one\ntwo\nthree\n")
+
+        coder = Coder.create(self.GPT35, "diff", io=InputOutput(), fnames=[file1])
+        coder.io.tool_warning = MagicMock()
+
+        fname = Path(file1).name
+        good = f"""
+{fname}
+<<<<<<< SEARCH
+two
+=======
+new
+>>>>>>> REPLACE
+
+Then, building on that:
+
+<<<<<<< SEARCH
+new
+=======
+newer
+>>>>>>> REPLACE
+"""
+        bad = """
+<<<<<<< SEARCH
+four
+=======
+five
+>>>>>>> REPLACE
+"""
+
+        # Stream the response in small chunks
+        coder.reset_streamed_edits()
+        coder.partial_response_content = ""
+        coder.mdstream = MagicMock()
+        for response in (good, bad):
+            for i in range(0, len(response), 5):
+                coder.partial_response_content += response[i : i + 5]
+                coder.check_streamed_edits()
+
+            if response is good:
+                self.assertEqual(len(coder.streamed_edits), 2)
+                self.assertEqual(coder.streamed_edit_errors, [])
+
+        self.assertEqual(len(coder.streamed_edits), 3)
+        self.assertEqual(len(coder.streamed_edit_errors), 1)
+        self.assertIn(fname, coder.streamed_edit_errors[0])
+
+        # The warning is shown while the response is still streaming
+        coder.mdstream.pause.assert_called_once()
+        coder.io.tool_warning.assert_called_once()
+
+        # Nothing is written until the response is done
+        self.assertEqual(Path(file1).read_text(encoding="utf-8"), "one\ntwo\nthree\n")
+
+    def test_stop_on_failed_edit(self):
+        _, file1 = tempfile.mkstemp()
+
+        with open(file1, "w", encoding="utf-8") as f:
+            f.write("one\ntwo\nthree\n")
+
+        fname = Path(file1).name
+        response = f"""
+{fname}
+<<<<<<< SEARCH
+two
+=======
+new
+>>>>>>> REPLACE
+
+{fname}
+<<<<<<< SEARCH
+four
+=======
+five
+>>>>>>> REPLACE
+
+{fname}
+<<<<<<< SEARCH
+three
+=======
+3
+>>>>>>> REPLACE
+
+And lots more to come...
+"""
+
+        class FakeStream:
+            def __init__(self, text, size):
+                self.chunks = [text[i : i + size] for i in range(0, len(text), size)]
+                self.sent = 0
+                self.closed = False
+
+            def __iter__(self):
+                for content in self.chunks:
+                    self.sent += 1
+                    delta = SimpleNamespace(content=content)
+                    yield SimpleNamespace(
+                        choices=[SimpleNamespace(delta=delta, finish_reason=None)]
+                    )
+
+            def close(self):
+                self.closed = True
+
+        runs = [(False, 7), (True, 7), (True, len(response))]
+        for stop_on_failed_edit, size in runs:
+            Path(file1).write_text("one\ntwo\nthree\n", encoding="utf-8")
+            coder = Coder.create(
+                self.GPT35,
+                "diff",
+                io=InputOutput(pretty=False, yes=True),
+                fnames=[file1],
+                stop_on_failed_edit=stop_on_failed_edit,
+            )
+            stream = FakeStream(response, size)
+
+            with patch.object(self.GPT35, "send_completion", return_value=(MagicMock(), stream)):
+                list(coder.send([dict(role="user", content="hi")]))
+
+            if not stop_on_failed_edit:
+                self.assertEqual(stream.sent, len(stream.chunks))
+                self.assertEqual(coder.partial_response_content, response)
+                continue
+
+            # The stream was abandoned right after the failed edit, even when
+            # the edits after it arrived in the same chunk
+            if size < len(response):
+                self.assertLess(stream.sent, len(stream.chunks))
+            self.assertTrue(stream.closed)
+            self.assertTrue(coder.partial_response_content.endswith("five\n>>>>>>> REPLACE\n"))
+
+            # The edit before it still applies, and the failure is reflected
+            coder.apply_updates()
+            self.assertEqual(Path(file1).read_text(encoding="utf-8"), "one\nnew\nthree\n")
+            self.assertIn("SearchReplaceNoExactMatch", coder.reflected_message)
+
     def test_full_edit_dry_run(self):
         # Create a few temporary files
         _, file1 = tempfile.mkstemp()
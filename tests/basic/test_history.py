@@ -1,7 +1,8 @@
+import threading
 from unittest import TestCase, mock
 
 from opta.history import ChatSummary
-from opta.models import Model
+from opta.models import Model, TokenCountCache
 
 
 def count(msg):
@@ -16,7 +17,7 @@ class TestChatSummary(TestCase):
         self.mock_model.name = "gpt-3.5-turbo"
         self.mock_model.token_count = count
         self.mock_model.info = {"max_input_tokens": 4096}
-        self.mock_model.simple_send_with_retries = mock.Mock()
+        self.mock_model.simple_send_with_retries = mock.AsyncMock()
         self.chat_summary = ChatSummary(self.mock_model, max_tokens=100)
 
     def test_initialization(self):
@@ -83,13 +84,17 @@ class TestChatSummary(TestCase):
     def test_fallback_to_second_model(self):
         mock_model1 = mock.Mock(spec=Model)
         mock_model1.name = "gpt-4"
-        mock_model1.simple_send_with_retries = mock.Mock(side_effect=Exception("Model 1 failed"))
+        mock_model1.simple_send_with_retries = mock.AsyncMock(
+            side_effect=Exception("Model 1 failed")
+        )
         mock_model1.info = {"max_input_tokens": 4096}
         mock_model1.token_count = lambda msg: len(msg["content"].split())
 
         mock_model2 = mock.Mock(spec=Model)
         mock_model2.name = "gpt-3.5-turbo"
-        mock_model2.simple_send_with_retries = mock.Mock(return_value="Summary from Model 2")
+        mock_model2.simple_send_with_retries = mock.AsyncMock(
+            return_value="Summary from Model 2"
+        )
         mock_model2.info = {"max_input_tokens": 4096}
         mock_model2.token_count = lambda msg: len(msg["content"].split())
 
@@ -118,3 +123,94 @@ class TestChatSummary(TestCase):
                 }
             ],
         )
+
+    def test_token_counts_use_the_model_cache(self):
+        model = Model("gpt-3.5-turbo")
+        chat_summary = ChatSummary(model, max_tokens=100)
+
+        messages = [
+            {"role": "user", "content": "Hello world"},
+            {"role": "assistant", "content": "Hi there"},
+        ]
+        with (
+            mock.patch("opta.models.token_count_cache", TokenCountCache()),
+            mock.patch.object(model, "tokenizer", side_effect=str.split) as tokenizer,
+        ):
+            self.assertFalse(chat_summary.too_big(messages))
+            self.assertEqual(tokenizer.call_count, 2)
+
+            # Only the new message is tokenized
+            messages.append({"role": "user", "content": "One more"})
+            self.assertFalse(chat_summary.too_big(messages))
+            self.assertEqual(tokenizer.call_count, 3)
+
+    def test_summarize_chunked(self):
+        # Room for 35 words per weak model call
+        self.mock_model.info = {"max_input_tokens": 512 + 35}
+
+        chunks_sent = []
+
+        def mock_send(messages):
+            chunks_sent.append(messages[1]["content"])
+            return "brief"
+
+        self.mock_model.simple_send_with_retries.side_effect = mock_send
+
+        messages = [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"message number {i} with six more words here",
+            }
+            for i in range(9)
+        ]
+        summary = self.chat_summary.summarize_chunked(self.chat_summary.tokenize(messages))
+
+        # Three chunks of three messages, then one call to combine their summaries
+        self.assertEqual(len(chunks_sent), 4)
+        for msg in messages:
+            sent_in = [chunk for chunk in chunks_sent[:3] if msg["content"] + "\n" in chunk]
+            self.assertEqual(len(sent_in), 1)
+        self.assertEqual(chunks_sent[-1].count("brief"), 3)
+        self.assertEqual(
+            summary,
+            [
+                {
+                    "role": "user",
+                    "content": "I spoke to you previously about a number of things.\nbrief",
+                }
+            ],
+        )
+
+    def test_summarize_chunked_keeps_long_summaries(self):
+        # Room for 35 words per weak model call
+        self.mock_model.info = {"max_input_tokens": 512 + 35}
+
+        calls = []
+        lock = threading.Lock()
+
+        def mock_send(messages):
+            with lock:
+                calls.append(messages[1]["content"])
+                num = len(calls)
+            # Each summary is too long to fit alongside another one
+            return f"S{num} " + "word " * 29
+
+        self.mock_model.simple_send_with_retries.side_effect = mock_send
+
+        # Including a message too big for any chunk by itself
+        messages = [
+            {"role": "user", "content": "huge " * 100},
+            {"role": "assistant", "content": "first " * 30},
+            {"role": "user", "content": "second " * 30},
+        ]
+        summary = self.chat_summary.summarize_chunked(self.chat_summary.tokenize(messages))
+        self.assertEqual(len(summary), 1)
+
+        # Nothing sent is over the window, besides the "# USER" headers of up to two messages
+        for call in calls:
+            self.assertLessEqual(len(call.split()), 35 + 4)
+
+        # Every partial summary makes it into a later call, none are dropped
+        for num in (1, 2, 3):
+            later = calls[3:]
+            self.assertTrue(any(f"S{num} " in call for call in later), num)
@@ -0,0 +1,51 @@
+import threading
+import unittest
+
+from opta.languages import LanguageRegistry, query_captures
+
+
+class TestLanguageRegistry(unittest.TestCase):
+    def test_query_compiled_once(self):
+        registry = LanguageRegistry()
+
+        query = registry.get_tags_query("python")
+        self.assertIsNotNone(query)
+        self.assertIs(registry.get_tags_query("python"), query)
+
+        stats = registry.stats()
+        self.assertEqual(stats["query"], dict(hits=1, misses=1))
+        self.assertEqual(stats["language"]["misses"], 1)
+
+    def test_missing_query_is_cached(self):
+        registry = LanguageRegistry()
+
+        self.assertIsNone(registry.get_tags_query("json"))
+        self.assertIsNone(registry.get_tags_query("json"))
+        self.assertEqual(registry.stats()["query"], dict(hits=1, misses=1))
+
+    def test_captures(self):
+        registry = LanguageRegistry()
+        parser = registry.get_parser("python")
+        tree = parser.parse(b"def foo():\n    return bar()\n")
+
+        captures = query_captures(registry.get_tags_query("python"), tree.root_node)
+        if isinstance(captures, dict):
+            names = {node.text.decode() for nodes in captures.values() for node in nodes}
+        else:
+            names = {node.text.decode() for node, _tag in captures}
+
+        self.assertIn("foo", names)
+        self.assertIn("bar", names)
+
+    def test_parsers_are_per_thread(self):
+        registry = LanguageRegistry()
+        main_parser = registry.get_parser("python")
+        self.assertIs(registry.get_parser("python"), main_parser)
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(registry.get_parser("python")))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(other[0], main_parser)
+        self.assertEqual(registry.stats()["parser"], dict(hits=1, misses=2))
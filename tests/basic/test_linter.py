@@ -4,6 +4,7 @@ from unittest.mock import MagicMock, patch
 
 from opta.dump import dump  # noqa
 from opta.linter import Linter
+from opta.utils import IgnorantTemporaryDirectory
 
 
 class TestLinter(unittest.TestCase):
@@ -19,6 +20,15 @@ class TestLinter(unittest.TestCase):
         self.linter.set_linter("javascript", "eslint")
         self.assertEqual(self.linter.languages["javascript"], "eslint")
 
+    def test_has_lint_cmds(self):
+        self.assertFalse(self.linter.has_lint_cmds())
+        self.linter.set_linter("javascript", "eslint")
+        self.assertTrue(self.linter.has_lint_cmds())
+
+        linter = Linter()
+        linter.set_linter(None, "my-linter")
+        self.assertTrue(linter.has_lint_cmds())
+
     def test_get_rel_fname(self):
         import os
 
@@ -31,7 +41,7 @@ class TestLinter(unittest.TestCase):
     def test_run_cmd(self, mock_popen):
         mock_process = MagicMock()
         mock_process.returncode = 0
-        mock_process.stdout.read.side_effect = ("", None)
+        mock_process.stdout.read.side_effect = (b"", None)
         mock_popen.return_value = mock_process
 
         result = self.linter.run_cmd("test_cmd", "test_file.py", "code")
@@ -51,7 +61,7 @@ class TestLinter(unittest.TestCase):
     def test_run_cmd_with_errors(self, mock_popen):
         mock_process = MagicMock()
         mock_process.returncode = 1
-        mock_process.stdout.read.side_effect = ("Error message", None)
+        mock_process.stdout.read.side_effect = (b"Error message", b"")
         mock_popen.return_value = mock_process
 
         result = self.linter.run_cmd("test_cmd", "test_file.py", "code")
@@ -62,7 +72,7 @@ class TestLinter(unittest.TestCase):
         with patch("subprocess.Popen") as mock_popen:
             mock_process = MagicMock()
             mock_process.returncode = 1
-            mock_process.stdout.read.side_effect = ("Error message", None)
+            mock_process.stdout.read.side_effect = (b"Error message", b"")
             mock_popen.return_value = mock_process
 
             # Test with a file path containing special characters
@@ -79,6 +89,42 @@ class TestLinter(unittest.TestCase):
             self.assertIsNotNone(result)
             self.assertIn("Error message", result.text)
 
+    def test_pyflakes_lint(self):
+        code = "import os\n\n\ndef f(a):\n    return undefined_name\n"
+        result = self.linter.pyflakes_lint("test_file.py", code)
+
+        self.assertIn("test_file.py:5:12: F821 undefined name 'undefined_name'", result.text)
+        self.assertNotIn("F401", result.text)
+        self.assertEqual(result.lines, [4])
+
+        self.assertIsNone(self.linter.pyflakes_lint("test_file.py", "import os\n"))
+
+        # Like flake8, lines marked noqa for the code, or for everything, are skipped
+        for noqa in ("# noqa", "# noqa: F821", "# NOQA:F821,E501"):
+            code = f"x = undefined_name  {noqa}\n"
+            self.assertIsNone(self.linter.pyflakes_lint("test_file.py", code))
+
+        code = "x = undefined_name  # noqa: E501\n"
+        self.assertIn("F821", self.linter.pyflakes_lint("test_file.py", code).text)
+
+    def test_lint_files(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            linter = Linter(encoding="utf-8", root=temp_dir)
+            fnames = []
+            for i in range(4):
+                fname = os.path.join(temp_dir, f"file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"x = {i}\n" if i % 2 else f"y = undefined_{i}\n")
+                fnames.append(fname)
+
+            results = linter.lint_files(fnames)
+
+            self.assertEqual(len(results), 4)
+            self.assertIn("undefined_0", results[0])
+            self.assertIsNone(results[1])
+            self.assertIn("undefined_2", results[2])
+            self.assertIsNone(results[3])
+
 
 if __name__ == "__main__":
     unittest.main()
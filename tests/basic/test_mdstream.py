@@ -0,0 +1,113 @@
+import re
+import unittest
+from pathlib import Path
+
+from opta.mdstream import MarkdownStream, find_stable_boundary
+
+TEXT = """# Header
+
+Some text with **bold** and `code`.
+
+## Sub header
+
+- one
+- two
+
+  still item two
+
+1. first
+
+2. second
+
+```python
+def foo():
+
+    return 1
+```
+
+> quoted
+
+---
+
+Final paragraph.
+"""
+
+
+class TestMarkdownStream(unittest.TestCase):
+    def test_find_stable_boundary(self):
+        text = "para one\n\npara two\n\n"
+        self.assertEqual(find_stable_boundary(text), len("para one\n\n"))
+
+        # Blank lines inside an open fence aren't boundaries
+        text = "```\ncode\n\nmore\n\n"
+        self.assertEqual(find_stable_boundary(text), 0)
+
+        # The line after the blank might continue a list
+        text = "- a\n\n  more a\n\n- b\n\nafter\n"
+        self.assertEqual(find_stable_boundary(text), text.index("after"))
+
+    def test_incremental_render_matches_full_render(self):
+        stream = MarkdownStream()
+        for end in range(0, len(TEXT) + 1, 7):
+            partial = TEXT[:end]
+            self.assertEqual(
+                stream._render_incremental(partial), stream._render_markdown_to_lines(partial)
+            )
+
+        self.assertTrue(stream.stable_text)
+        self.assertTrue(TEXT.startswith(stream.stable_text))
+
+    def test_reference_links_are_not_frozen(self):
+        text = (
+            "intro with `a[0][1]`\n\n"
+            "see [the docs][1] for more\n\n"
+            "middle\n\n"
+            "[1]: https://example.com\n\n"
+            "end\n"
+        )
+        self.assertEqual(find_stable_boundary(text), text.index("see"))
+
+        def render(lines):
+            # Hyperlinks get a random id each time they're rendered
+            return re.sub(r"id=\d+", "id=", "".join(lines))
+
+        stream = MarkdownStream()
+        for end in range(0, len(text) + 1, 5):
+            partial = text[:end]
+            self.assertEqual(
+                render(stream._render_incremental(partial)),
+                render(stream._render_markdown_to_lines(partial)),
+            )
+
+    def test_html_blocks_are_not_frozen(self):
+        # Blank lines inside an open comment or <style> block aren't boundaries
+        text = "intro\n\n<!-- a comment\n\nstill the comment\n\nmore\n"
+        self.assertEqual(find_stable_boundary(text), text.index("<!--"))
+        text = "intro\n\n<style>\np {}\n\na {}\n</style>\n\nafter\n"
+        self.assertEqual(find_stable_boundary(text), text.index("after"))
+
+        def render(lines):
+            # Hyperlinks get a random id each time they're rendered
+            return re.sub(r"id=\d+", "id=", "".join(lines))
+
+        docs = Path(__file__).parent.parent.parent / "opta" / "website" / "docs"
+        for fname in ("config/model-aliases.md", "usage/watch.md"):
+            text = (docs / fname).read_text(encoding="utf-8")
+            stream = MarkdownStream()
+            for end in list(range(0, len(text), 97)) + [len(text)]:
+                partial = text[:end]
+                self.assertEqual(
+                    render(stream._render_incremental(partial)),
+                    render(stream._render_markdown_to_lines(partial)),
+                    fname,
+                )
+
+    def test_rewritten_text_is_rerendered(self):
+        stream = MarkdownStream()
+        stream._render_incremental("first\n\nsecond\n")
+        text = "other\n\nsecond\n"
+        self.assertEqual(stream._render_incremental(text), stream._render_markdown_to_lines(text))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@
 Tests for production middleware.
 """
 
+import asyncio
 import time
 import pytest
 from unittest.mock import Mock, patch
@@ -220,6 +221,59 @@ class TestProductionMiddleware:
         assert metrics["total_tokens_sent"] == 100
 
 
+class TestAsyncMiddleware:
+    def test_executes_coroutine_successfully(self):
+        middleware = ProductionMiddleware()
+
+        async def call():
+            return "success"
+
+        result = asyncio.run(middleware.execute_async(call))
+
+        assert result == "success"
+        assert middleware.metrics.successful_requests == 1
+
+    def test_retries_without_blocking_the_loop(self):
+        config = MiddlewareConfig(retry=RetryConfig(max_retries=2, base_delay=0.1, jitter=0))
+        middleware = ProductionMiddleware(config)
+        attempts = []
+        ticks = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 2:
+                raise Exception("temporary")
+            return "success"
+
+        async def ticker():
+            for _ in range(3):
+                ticks.append(1)
+                await asyncio.sleep(0.02)
+
+        async def main():
+            return await asyncio.gather(middleware.execute_async(flaky), ticker())
+
+        with patch.object(middleware.retry_handler, "should_retry", return_value=True):
+            result, _ = asyncio.run(main())
+
+        assert result == "success"
+        assert len(attempts) == 2
+        # The other task kept running during the backoff
+        assert len(ticks) == 3
+        assert middleware.metrics.retried_requests == 1
+
+    def test_raises_circuit_open_error(self):
+        config = MiddlewareConfig(circuit_breaker=CircuitBreakerConfig(failure_threshold=1))
+        middleware = ProductionMiddleware(config)
+        middleware.circuit_breaker.record_failure()
+
+        async def call():
+            return "test"
+
+        with pytest.raises(CircuitOpenError):
+            asyncio.run(middleware.execute_async(call))
+
+
 class TestGlobalMiddleware:
     def test_get_middleware_returns_singleton(self):
         reset_middleware()
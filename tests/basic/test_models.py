@@ -1,10 +1,11 @@
 import unittest
-from unittest.mock import ANY, MagicMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 from opta.models import (
     ANTHROPIC_BETA_HEADER,
     Model,
     ModelInfoManager,
+    TokenCountCache,
     register_models,
     sanity_check_model,
     sanity_check_models,
@@ -282,6 +283,51 @@ class TestModels(unittest.TestCase):
         model.info = {"max_input_tokens": 32768}
         self.assertEqual(model.get_repo_map_tokens(), 4096)
 
+    def test_token_count_memoized(self):
+        from opta.llm import litellm
+
+        model = Model("gpt-4")
+        messages = [
+            dict(role="system", content="You are a helpful assistant."),
+            dict(role="user", content="Count the tokens in this message."),
+            dict(role="assistant", content="Ok."),
+        ]
+        expected = litellm.token_counter(model=model.name, messages=messages)
+
+        with patch("opta.models.token_count_cache", TokenCountCache()):
+            self.assertEqual(model.token_count(messages), expected)
+            text_tokens = model.token_count("some text")
+            self.assertEqual(text_tokens, len(model.tokenizer("some text")))
+
+            # Unchanged messages and text are never re-tokenized
+            with (
+                patch.object(litellm, "token_counter") as mock_counter,
+                patch.object(model, "tokenizer") as mock_tokenizer,
+            ):
+                self.assertEqual(model.token_count(messages), expected)
+                self.assertEqual(model.token_count("some text"), text_tokens)
+                mock_counter.assert_not_called()
+                mock_tokenizer.assert_not_called()
+
+                # Only the new message is counted
+                mock_counter.return_value = 10
+                model.token_count(messages + [dict(role="user", content="More")])
+                mock_counter.assert_called_once()
+
+    def test_token_count_cache_is_bounded(self):
+        cache = TokenCountCache(max_entries=2)
+        keys = [cache.get_key("gpt-4", "text", text) for text in ("a", "b", "c")]
+
+        cache.get(keys[0], lambda: 1)
+        cache.get(keys[1], lambda: 2)
+        self.assertEqual(cache.get(keys[0], lambda: 0), 1)
+        cache.get(keys[2], lambda: 3)
+
+        # The least recently used entry was evicted
+        self.assertEqual(cache.get(keys[1], lambda: 0), 0)
+        self.assertEqual(cache.get(keys[0], lambda: 0), 0)
+        self.assertEqual(len(cache.counts), 2)
+
     def test_configure_model_settings(self):
         # Test o3-mini case
         model = Model("something/o3-mini")
@@ -525,6 +571,31 @@ class TestModels(unittest.TestCase):
             timeout=300,  # From extra_params
         )
 
+    def test_send_completion_async(self):
+        import asyncio
+
+        from opta.llm import litellm
+
+        model = Model("gpt-4")
+        messages = [{"role": "user", "content": "Hello"}]
+        response = MagicMock()
+        response.choices[0].message.content = "Hi"
+
+        with patch.object(litellm, "acompletion", new=AsyncMock(return_value=response)) as mock:
+            _hash, completion = asyncio.run(
+                model.send_completion_async(messages, functions=None, stream=False)
+            )
+            self.assertIs(completion, response)
+            mock.assert_awaited_with(
+                model=model.name,
+                messages=messages,
+                stream=False,
+                temperature=0,
+                timeout=600,
+            )
+
+            self.assertEqual(asyncio.run(model.simple_send_with_retries(messages)), "Hi")
+
     @patch("opta.models.litellm.completion")
     def test_use_temperature_in_send_completion(self, mock_completion):
         # Test use_temperature=True sends temperature=0
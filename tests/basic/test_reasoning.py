@@ -1,5 +1,6 @@
+import asyncio
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from opta.coders.base_coder import Coder
 from opta.dump import dump  # noqa
@@ -579,7 +580,7 @@ End"""
             expected_content = "Final answer after reasoning"
             self.assertEqual(coder.partial_response_content.strip(), expected_content)
 
-    @patch("aider.models.litellm.completion")
+    @patch("opta.models.litellm.acompletion", new_callable=AsyncMock)
     def test_simple_send_with_retries_removes_reasoning(self, mock_completion):
         """Test that simple_send_with_retries correctly removes reasoning content."""
         model = Model("deepseek-r1")  # This model has reasoning_tag="think"
@@ -594,7 +595,7 @@ And this text should remain"""))]
         mock_completion.return_value = mock_response
 
         messages = [{"role": "user", "content": "test"}]
-        result = model.simple_send_with_retries(messages)
+        result = asyncio.run(model.simple_send_with_retries(messages))
 
         expected = """Here is some text
 
@@ -602,7 +603,7 @@ And this text should remain"""
         self.assertEqual(result, expected)
 
         # Verify the completion was called
-        mock_completion.assert_called_once()
+        mock_completion.assert_awaited_once()
 
 
 if __name__ == "__main__":
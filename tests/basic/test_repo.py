@@ -128,6 +128,33 @@ class TestRepo(unittest.TestCase):
             diffs = git_repo.diff_commits(False, "HEAD~1", "HEAD")
             self.assertIn("two", diffs)
 
+    @patch("opta.models.Model.simple_send_with_retries")
+    def test_commit_queue_holds_errors(self, mock_send):
+        mock_send.return_value = None
+
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+            fname = Path("file.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            io = InputOutput()
+            io.tool_error = MagicMock()
+            git_repo = GitRepo(io, None, None, models=[self.GPT35])
+
+            fname.write_text("two\n")
+            queue = git_repo.get_commit_queue()
+            queue.submit(fnames=[str(fname)]).result()
+
+            # Nothing is printed from the commit thread
+            io.tool_error.assert_not_called()
+
+            results = list(queue.finished())
+            io.tool_error.assert_called_once_with("Failed to generate commit message!")
+            self.assertEqual(len(results), 1)
+            self.assertEqual(raw_repo.head.commit.message.strip(), "(no commit message provided)")
+
     @patch("opta.models.Model.simple_send_with_retries")
     def test_get_commit_message(self, mock_send):
         mock_send.side_effect = ["", "a good commit message"]
@@ -152,6 +179,29 @@ class TestRepo(unittest.TestCase):
         second_call_messages = mock_send.call_args_list[1][0][0]  # Get messages from second call
         self.assertEqual(first_call_messages, second_call_messages)
 
+    @patch("opta.models.Model.simple_send_with_retries")
+    def test_get_commit_message_truncates_huge_diffs(self, mock_send):
+        mock_send.return_value = "a good commit message"
+
+        diffs = "diff --git a/small.py b/small.py\n+small change\n"
+        diffs += "diff --git a/big.py b/big.py\n" + "+big change\n" * 100_000
+        diffs += "diff --git a/new.py b/new.py\nnew file mode 100644\n+new\n"
+
+        repo = GitRepo(InputOutput(), None, None, models=[self.GPT35])
+        result = repo.get_commit_message(diffs, "dummy context")
+        self.assertEqual(result, "a good commit message")
+
+        content = mock_send.call_args[0][0][1]["content"]
+        self.assertLess(len(content), len(diffs) / 2)
+        self.assertIn("+small change\n", content)
+        self.assertIn("... diff truncated ...\n", content)
+        self.assertTrue(
+            content.endswith(
+                "# Diffs of these files were left out to save space:\n"
+                "diff --git a/new.py b/new.py\nnew file mode 100644\n"
+            )
+        )
+
     @patch("opta.models.Model.simple_send_with_retries")
     def test_get_commit_message_strip_quotes(self, mock_send):
         mock_send.return_value = '"a good commit message"'
@@ -584,6 +634,83 @@ class TestRepo(unittest.TestCase):
             fnames = git_repo.get_tracked_files()
             self.assertIn(str(fname), fnames)
 
+    def test_tracked_files_index_is_reused(self):
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            fname = Path("one.txt")
+            fname.touch()
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "one")
+
+            optaignore = Path(".optaignore")
+            git_repo = GitRepo(InputOutput(), None, None, str(optaignore))
+
+            with patch.object(
+                git_repo, "list_tracked_files", wraps=git_repo.list_tracked_files
+            ) as mock_list:
+                self.assertTrue(git_repo.path_in_repo(str(fname)))
+                self.assertFalse(git_repo.path_in_repo("missing.txt"))
+                self.assertEqual(git_repo.get_tracked_files(), [str(fname)])
+                self.assertEqual(mock_list.call_count, 1)
+
+                # Staging a file changes the index
+                fname2 = Path("two.txt")
+                fname2.touch()
+                raw_repo.git.add(str(fname2))
+                self.assertTrue(git_repo.path_in_repo(str(fname2)))
+                self.assertEqual(mock_list.call_count, 2)
+
+                # Ignoring a file only splits the same files again
+                optaignore.write_text("one.txt\n")
+                git_repo.opta_ignore_last_check = 0
+                self.assertFalse(git_repo.path_in_repo(str(fname)))
+                self.assertEqual(mock_list.call_count, 2)
+
+                tracked_files = git_repo.get_tracked_files_index()
+                self.assertEqual(tracked_files.ignored, {str(fname)})
+                self.assertEqual(tracked_files.files, {str(fname2)})
+
+    def test_tracked_files_follow_new_commits(self):
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            for fname in ["one.txt", "two.txt", "sub/three.txt"]:
+                Path(fname).parent.mkdir(exist_ok=True)
+                Path(fname).write_text(fname)
+            raw_repo.git.add(".")
+            raw_repo.git.commit("-m", "first")
+
+            git_repo = GitRepo(InputOutput(), None, None)
+
+            with patch.object(
+                git_repo, "ls_tree_files", wraps=git_repo.ls_tree_files
+            ) as mock_ls_tree:
+                self.assertEqual(
+                    sorted(git_repo.get_tracked_files()),
+                    sorted(["one.txt", "two.txt", str(Path("sub/three.txt"))]),
+                )
+
+                raw_repo.git.rm("one.txt")
+                Path("two.txt").write_text("changed")
+                Path("four.txt").write_text("four")
+                raw_repo.git.add(".")
+                raw_repo.git.commit("-m", "second")
+
+                self.assertEqual(
+                    sorted(git_repo.get_tracked_files()),
+                    sorted(["four.txt", "two.txt", str(Path("sub/three.txt"))]),
+                )
+
+                raw_repo.git.reset("--hard", "HEAD~1")
+                self.assertEqual(
+                    sorted(git_repo.get_tracked_files()),
+                    sorted(["one.txt", "two.txt", str(Path("sub/three.txt"))]),
+                )
+
+                # Only the first tree was listed in full
+                self.assertEqual(mock_ls_tree.call_count, 1)
+
     def test_subtree_only(self):
         with GitTemporaryDirectory():
             # Create a new repo
@@ -4,6 +4,7 @@ import re
 import time
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
 import git
 
@@ -273,6 +274,198 @@ print(my_function(3, 4))
             # close the open cache files, so Windows won't error
             del repo_map
 
+    def test_scan_tags_parallel(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(4):
+                fname = os.path.join(temp_dir, f"file{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def function{i}():\n    return function{(i + 1) % 4}()\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            serial_map = RepoMap(main_model=self.GPT35, root=temp_dir, io=io, map_workers=1)
+            serial_map.TAGS_CACHE = dict()
+            expected = {
+                fname: sorted(serial_map.get_tags(fname, serial_map.get_rel_fname(fname)))
+                for fname in fnames
+            }
+
+            repo_map = RepoMap(main_model=self.GPT35, root=temp_dir, io=io, map_workers=2)
+            repo_map.TAGS_CACHE = dict()
+            with patch("opta.repomap.PARALLEL_SCAN_MIN_FILES", 1):
+                repo_map.scan_tags_parallel(fnames)
+
+            self.assertEqual(repo_map.get_uncached_fnames(fnames), [])
+            for fname in fnames:
+                self.assertEqual(sorted(repo_map.TAGS_CACHE[fname]["data"]), expected[fname])
+
+            del serial_map
+            del repo_map
+
+    def test_symbol_graph_incremental_update(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            files = {
+                "a.py": "def alpha_function():\n    return beta_function()\n",
+                "b.py": "def beta_function():\n    return gamma_function()\n",
+                "c.py": "def gamma_function():\n    return 1\n",
+            }
+            fnames = []
+            for name, content in files.items():
+                fname = os.path.join(temp_dir, name)
+                with open(fname, "w") as f:
+                    f.write(content)
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(main_model=self.GPT35, root=temp_dir, io=io)
+            repo_map.get_ranked_tags([], fnames, set(), set())
+            graph = repo_map.symbol_graph
+            self.assertEqual(
+                [(src, dst) for src, dst, _weight in graph.ident_edges["beta_function"]],
+                [("a.py", "b.py")],
+            )
+            self.assertIn("beta_function", graph.ident_edges)
+
+            # Only the edited file's tags should be re-read
+            with open(fnames[0], "w") as f:
+                f.write("def alpha_function():\n    return gamma_function()\n")
+            os.utime(fnames[0], (time.time() + 5, time.time() + 5))
+
+            with patch.object(repo_map, "get_tags", wraps=repo_map.get_tags) as mock_get_tags:
+                ranked = repo_map.get_ranked_tags([], fnames, set(), {"gamma_function"})
+            self.assertEqual([call.args[1] for call in mock_get_tags.call_args_list], ["a.py"])
+            self.assertNotIn("beta_function", graph.references)
+            self.assertEqual(graph.ident_edges["beta_function"], [("b.py", "b.py", 0.1)])
+            self.assertIn(
+                ("a.py", "c.py"),
+                [(src, dst) for src, dst, _weight in graph.ident_edges["gamma_function"]],
+            )
+            self.assertIsNotNone(graph.ranked)
+
+            fresh_map = RepoMap(main_model=self.GPT35, root=temp_dir, io=io)
+            fresh_map.TAGS_CACHE = dict()
+            expected = fresh_map.get_ranked_tags([], fnames, set(), {"gamma_function"})
+            self.assertEqual(ranked, expected)
+
+            # Dropping a file removes its edges
+            repo_map.get_ranked_tags([], fnames[1:], set(), set())
+            self.assertNotIn("a.py", graph.ranked)
+
+            del repo_map
+            del fresh_map
+
+    def test_repo_map_fits_token_budget(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(40):
+                fname = os.path.join(temp_dir, f"module_{i}.py")
+                with open(fname, "w") as f:
+                    for j in range(5):
+                        f.write(f"def function_{i}_{j}(value):\n    return helper_{j}(value)\n\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(main_model=self.GPT35, root=temp_dir, io=io)
+
+            with patch.object(repo_map, "to_tree", wraps=repo_map.to_tree) as mock_to_tree:
+                tree = repo_map.get_ranked_tags_map_uncached([], fnames, max_map_tokens=300)
+
+            self.assertEqual(mock_to_tree.call_count, 1)
+            self.assertIn("function_", tree)
+            num_tokens = self.GPT35.token_count(tree)
+            self.assertLessEqual(num_tokens, 300)
+            self.assertGreater(num_tokens, 200)
+
+            del repo_map
+
+    def test_block_token_count_follows_edits(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = os.path.join(temp_dir, "module.py")
+            with open(fname, "w") as f:
+                f.write("def short(x):\n    return x\n")
+
+            io = InputOutput()
+            repo_map = RepoMap(main_model=self.GPT35, root=temp_dir, io=io)
+            before = repo_map.block_token_count(fname, "module.py", [0])
+
+            # Same lines of interest, but the file now says much more on them
+            with open(fname, "w") as f:
+                f.write("def a_much_longer_function_name(first, second, third, fourth):\n")
+                f.write("    return first\n")
+            os.utime(fname, (time.time() + 10, time.time() + 10))
+
+            after = repo_map.block_token_count(fname, "module.py", [0])
+            self.assertGreater(after, before)
+
+            del repo_map
+
+    def test_repo_map_snapshot_reused_across_sessions(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for name in ("one.py", "two.py"):
+                fname = os.path.join(temp_dir, name)
+                with open(fname, "w") as f:
+                    f.write(f"def {name[:-3]}_function():\n    return 1\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(main_model=self.GPT35, root=temp_dir, io=io)
+            first_map = repo_map.get_repo_map([], fnames)
+            self.assertIn("one_function", first_map)
+            del repo_map
+
+            # A new session over the unchanged files skips ranking entirely
+            repo_map = RepoMap(main_model=self.GPT35, root=temp_dir, io=io)
+            with patch.object(repo_map, "get_ranked_tags") as mock_ranked_tags:
+                second_map = repo_map.get_repo_map([], fnames)
+            mock_ranked_tags.assert_not_called()
+            self.assertEqual(first_map, second_map)
+
+            # Editing a file invalidates the snapshot
+            with open(fnames[0], "w") as f:
+                f.write("def renamed_function():\n    return 1\n")
+            os.utime(fnames[0], (time.time() + 5, time.time() + 5))
+
+            third_map = repo_map.get_repo_map([], fnames, force_refresh=False)
+            self.assertIn("renamed_function", third_map)
+            self.assertNotIn("one_function", third_map)
+
+            del repo_map
+
+    def test_symbol_graph_backends_agree(self):
+        from opta.repomap import SymbolGraph, Tag
+
+        def tags(rel_fname, defs, refs):
+            res = [Tag(rel_fname, rel_fname, i, name, "def") for i, name in enumerate(defs)]
+            res += [Tag(rel_fname, rel_fname, -1, name, "ref") for name in refs]
+            return res
+
+        files = {
+            "a.py": tags("a.py", ["main"], ["helper_function", "Widget", "Widget"]),
+            "b.py": tags("b.py", ["helper_function"], ["Widget", "_private"]),
+            "c.py": tags("c.py", ["Widget", "_private"], []),
+            "d.py": tags("d.py", ["Widget", "unused_thing"], ["helper_function"]),
+        }
+        personalization = {"a.py": 25.0}
+
+        results = []
+        for backend in ("networkx", "sparse"):
+            graph = SymbolGraph(backend=backend)
+            for rel_fname, file_tags in files.items():
+                graph.update_file(rel_fname, 1, file_tags)
+            graph.set_context({"a.py"}, {"Widget"})
+            graph.refresh_edges()
+            results.append(graph.rank(personalization))
+
+        (nx_ranked, nx_defs), (sp_ranked, sp_defs) = results
+        self.assertEqual(set(nx_ranked), set(sp_ranked))
+        for node, rank in nx_ranked.items():
+            self.assertAlmostEqual(rank, sp_ranked[node], places=5)
+        self.assertEqual(set(nx_defs), set(sp_defs))
+        for key, rank in nx_defs.items():
+            self.assertAlmostEqual(rank, sp_defs[key], places=5)
+
 
 class TestRepoMapTypescript(unittest.TestCase):
     def setUp(self):
@@ -1,6 +1,6 @@
 import pytest  # noqa: F401
 
-from opta.run_cmd import run_cmd
+from opta.run_cmd import OutputCondenser, OutputTail, run_cmd, run_cmd_subprocess
 
 
 def test_run_cmd_echo():
@@ -9,3 +9,86 @@ def test_run_cmd_echo():
 
     assert exit_code == 0
     assert output.strip() == "Hello, World!"
+
+
+def test_output_tail_keeps_the_end():
+    output = OutputTail(max_chars=10)
+    for i in range(20):
+        output.write(f"line{i}\n")
+
+    text = output.getvalue()
+    assert text.endswith("line19\n")
+    assert "line17" not in text
+    assert text == output.getvalue()
+    assert text.startswith("... 123 characters of earlier output omitted ...\n")
+
+
+def test_run_cmd_subprocess_caps_output():
+    command = "printf 'one\\r\\ntwo\\n'; seq 1 2000"
+    exit_code, output = run_cmd_subprocess(command, echo=False, max_output=100)
+
+    assert exit_code == 0
+    assert "omitted" in output
+    assert output.endswith("1999\n2000\n")
+    assert len(output) < 200
+
+    exit_code, output = run_cmd_subprocess(command, echo=False)
+    assert output.startswith("one\ntwo\n1\n2\n")
+
+
+def test_output_condenser_keeps_short_output():
+    output = OutputCondenser(max_tokens=100)
+    output.write("one\ntw")
+    output.write("o\nthree")
+
+    assert output.getvalue() == "one\ntwo\nthree"
+
+
+def test_output_condenser_keeps_failures_head_and_tail():
+    output = OutputCondenser(max_tokens=100, fnames=["src/app.py"], root="/repo")
+    text = "".join(f"passed {i}\n" for i in range(500))
+    text += "Traceback (most recent call last):\n"
+    text += '  File "/repo/src/app.py", line 3, in main\n'
+    text += "    run()\n"
+    text += "ValueError: bad input\n"
+    text += "".join(f"passed {i}\n" for i in range(500, 1000))
+    text += "src/app.py:12: warning\n"
+    text += "other.py:12: not in the repo\n"
+    text += "same\n" * 1000
+    text += "".join(f"passed {i}\n" for i in range(1000, 1500))
+    text += "done\n"
+    for i in range(0, len(text), 100):
+        output.write(text[i : i + 100])
+
+    condensed = output.getvalue()
+    assert len(condensed) < 500
+    assert condensed.startswith("passed 0\npassed 1\n")
+    assert condensed.endswith("passed 1499\ndone\n")
+    assert (
+        '  File "/repo/src/app.py", line 3, in main\n    run()\nValueError: bad input\n'
+        in condensed
+    )
+    assert "src/app.py:12: warning\n" in condensed
+    assert "other.py" not in condensed
+    assert "passed 750\n" not in condensed
+    assert " lines omitted ...\n" in condensed
+    assert condensed == output.getvalue()
+
+
+def test_output_condenser_collapses_repeated_lines():
+    output = OutputCondenser(max_tokens=40)
+    output.write("start\n" + "error: same\n" * 1000 + "end\n")
+
+    condensed = output.getvalue()
+    assert condensed.count("error: same") == 1
+    assert "[previous line repeated 999 more times]\n" in condensed
+    assert condensed.endswith("end\n")
+
+
+def test_run_cmd_condenses_output():
+    exit_code, output = run_cmd("seq 1 100000", output=OutputCondenser(max_tokens=100))
+
+    assert exit_code == 0
+    assert output.startswith("1\n2\n")
+    assert output.endswith("99999\n100000\n")
+    assert len(output) < 500
@@ -1,5 +1,6 @@
+import asyncio
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from opta.exceptions import LiteLLMExceptions
 from opta.llm import litellm
@@ -19,7 +20,7 @@ class TestSendChat(unittest.TestCase):
         litellm_ex = LiteLLMExceptions()
         litellm_ex._load(strict=True)
 
-    @patch("litellm.completion")
+    @patch("litellm.acompletion", new_callable=AsyncMock)
     @patch("builtins.print")
     def test_simple_send_with_retries_rate_limit_error(self, mock_print, mock_completion):
         mock = MagicMock()
@@ -37,7 +38,7 @@ class TestSendChat(unittest.TestCase):
         ]
 
         # Call the simple_send_with_retries method
-        Model(self.mock_model).simple_send_with_retries(self.mock_messages)
+        asyncio.run(Model(self.mock_model).simple_send_with_retries(self.mock_messages))
         assert mock_print.call_count == 3
 
     @patch("litellm.completion")
@@ -67,17 +68,17 @@ class TestSendChat(unittest.TestCase):
         assert "tools" in called_kwargs
         assert called_kwargs["tools"][0]["function"] == mock_function
 
-    @patch("litellm.completion")
+    @patch("litellm.acompletion", new_callable=AsyncMock)
     def test_simple_send_attribute_error(self, mock_completion):
         # Setup mock to raise AttributeError
         mock_completion.return_value = MagicMock()
         mock_completion.return_value.choices = None
 
         # Should return None on AttributeError
-        result = Model(self.mock_model).simple_send_with_retries(self.mock_messages)
+        result = asyncio.run(Model(self.mock_model).simple_send_with_retries(self.mock_messages))
         assert result is None
 
-    @patch("litellm.completion")
+    @patch("litellm.acompletion", new_callable=AsyncMock)
     @patch("builtins.print")
     def test_simple_send_non_retryable_error(self, mock_print, mock_completion):
         # Test with an error that shouldn't trigger retries
@@ -88,7 +89,7 @@ class TestSendChat(unittest.TestCase):
             message="Invalid request", llm_provider="test_provider", model="test_model"
         )
 
-        result = Model(self.mock_model).simple_send_with_retries(self.mock_messages)
+        result = asyncio.run(Model(self.mock_model).simple_send_with_retries(self.mock_messages))
         assert result is None
         # Should only print the error message
         assert mock_print.call_count == 1
@@ -0,0 +1,119 @@
+import os
+import unittest
+
+from opta.io import InputOutput
+from opta.session_log import SessionLog
+from opta.utils import IgnorantTemporaryDirectory
+
+
+def exchange(num, size=1):
+    return [
+        dict(role="user", content=f"question {num} " + "x" * size),
+        dict(role="assistant", content=f"answer {num} " + "y" * size),
+    ]
+
+
+class TestSessionLog(unittest.TestCase):
+    def test_sessions_are_indexed(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = os.path.join(temp_dir, "history.jsonl")
+
+            first = SessionLog(fname, started="first")
+            first.append(exchange(1))
+            first.append(exchange(2))
+
+            # Nothing is written until the log is flushed
+            self.assertFalse(first.exists())
+            first.flush()
+
+            second = SessionLog(fname, started="second")
+            second.append(exchange(3))
+            second.flush()
+
+            # Sessions that never logged a message don't show up
+            SessionLog(fname, started="empty").flush()
+
+            self.assertEqual(
+                [started for _offset, started in second.sessions()], ["first", "second"]
+            )
+            self.assertEqual(second.load_session(0), exchange(1) + exchange(2))
+            self.assertEqual(second.load_session(), exchange(3))
+            self.assertEqual(second.load_session(5), [])
+            self.assertEqual(second.load_recent(1000), exchange(1) + exchange(2) + exchange(3))
+
+    def test_load_recent_reads_only_the_end(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname = os.path.join(temp_dir, "history.jsonl")
+
+            log = SessionLog(fname)
+            log.read_block = 256
+            for num in range(100):
+                log.append(exchange(num, size=40))
+            log.flush()
+
+            # An unfinished record from an interrupted run is skipped
+            with open(fname, "ab") as f:
+                f.write(b'{"role": "user", "cont')
+
+            log = SessionLog(fname)
+            log.append(exchange(100, size=40))
+            log.flush()
+
+            messages = log.load_recent(320)
+            self.assertEqual(
+                messages, exchange(98, size=40) + exchange(99, size=40) + exchange(100, size=40)
+            )
+
+            self.assertEqual(len(log.load_recent(10**9)), 202)
+
+    def test_read_chat_history(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            chat_history_file = os.path.join(temp_dir, "history.md")
+
+            # Histories written before the session log are parsed from the markdown
+            with open(chat_history_file, "w") as f:
+                f.write("#### hi\n\nhello\n")
+            io = InputOutput(chat_history_file=chat_history_file)
+            messages = io.read_chat_history(1000)
+            self.assertEqual([msg["role"] for msg in messages], ["user", "assistant"])
+            self.assertEqual([msg["content"].strip() for msg in messages], ["hi", "hello"])
+
+            # Only the latest messages that fit are parsed out of a long markdown history
+            with open(chat_history_file, "a") as f:
+                for num in range(100):
+                    f.write(f"#### question {num}\n\nanswer {num}\n\n")
+            recent = io.read_chat_history(75)
+            self.assertEqual(
+                [msg["content"].strip() for msg in recent],
+                [
+                    "question 97",
+                    "answer 97",
+                    "question 98",
+                    "answer 98",
+                    "question 99",
+                    "answer 99",
+                ],
+            )
+            with open(chat_history_file, "w") as f:
+                f.write("#### hi\n\nhello\n")
+
+            # The new session log starts with that earlier history
+            io.user_input("question 1")
+            io.log_chat_messages(exchange(1))
+            messages = io.read_chat_history(1000)
+            self.assertEqual([msg["content"].strip() for msg in messages[:2]], ["hi", "hello"])
+            self.assertEqual(messages[2:], exchange(1))
+
+            io = InputOutput(chat_history_file=chat_history_file)
+            io.log_chat_messages(exchange(2))
+            self.assertEqual(io.read_chat_history(1000)[2:], exchange(1) + exchange(2))
+
+            # The imported history and each run are sessions of their own
+            sessions = io.session_log.sessions()
+            self.assertEqual(sessions[0][1], "imported")
+            self.assertEqual(len(sessions), 3)
+            self.assertEqual(
+                [msg["content"].strip() for msg in io.session_log.load_session(0)], ["hi", "hello"]
+            )
+            self.assertEqual(io.session_log.load_session(1), exchange(1))
+            self.assertEqual(io.session_log.load_session(), exchange(2))
@@ -0,0 +1,110 @@
+import os
+import unittest
+
+from opta.repomap import Tag
+from opta.tags_store import TagsStore
+from opta.utils import IgnorantTemporaryDirectory
+
+
+def make_tags(fname, names, kind="def"):
+    return [Tag(fname, f"/repo/{fname}", line, name, kind) for line, name in enumerate(names)]
+
+
+class TestTagsStore(unittest.TestCase):
+    def test_tags_persist_across_stores(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            store = TagsStore(temp_dir, Tag)
+            foo_tags = make_tags("foo.py", ["foo", "shared"]) + [
+                Tag("foo.py", "/repo/foo.py", -1, "bar", "ref")
+            ]
+            bar_tags = make_tags("bar.py", ["bar", "shared"])
+            store.update([("/repo/foo.py", dict(mtime=1.5, data=foo_tags))])
+            store["/repo/bar.py"] = dict(mtime=2.5, data=bar_tags)
+            store["/repo/empty.py"] = dict(mtime=3.5, data=[])
+
+            # Reads see the buffered upserts before they're flushed
+            self.assertEqual(store["/repo/foo.py"]["data"], foo_tags)
+            store.flush()
+            store.close()
+
+            store = TagsStore(temp_dir, Tag)
+            self.assertEqual(len(store), 3)
+            self.assertIn("/repo/bar.py", store)
+            self.assertEqual(store.get("/repo/foo.py"), dict(mtime=1.5, data=foo_tags))
+            self.assertEqual(store["/repo/bar.py"]["data"], bar_tags)
+            self.assertEqual(store["/repo/empty.py"], dict(mtime=3.5, data=[]))
+            self.assertEqual(store.get_mtime("/repo/bar.py"), 2.5)
+            self.assertIsNone(store.get("/repo/missing.py"))
+
+            # Identifiers are interned once for all files
+            self.assertEqual(sorted(store.names), ["bar", "foo", "shared"])
+
+    def test_upserts_compact_superseded_rows(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            store = TagsStore(temp_dir, Tag)
+            store.min_compact_rows = 0
+
+            store["/repo/foo.py"] = dict(mtime=1, data=make_tags("foo.py", ["a", "b"]))
+            store["/repo/bar.py"] = dict(mtime=1, data=make_tags("bar.py", ["c"]))
+            store.flush()
+            first_rows_fname = store.rows_fname
+
+            # The first upsert is appended, the next one compacts away the dead rows
+            store["/repo/bar.py"] = dict(mtime=2, data=make_tags("bar.py", ["d", "e"]))
+            store.flush()
+            self.assertEqual(store.rows_fname, first_rows_fname)
+            self.assertEqual(store.num_rows, 5)
+
+            new_tags = make_tags("foo.py", ["f"])
+            store["/repo/foo.py"] = dict(mtime=3, data=new_tags)
+            store.flush()
+            self.assertNotEqual(store.rows_fname, first_rows_fname)
+            self.assertEqual(store.num_rows, 3)
+            self.assertEqual(sorted(store.names), ["d", "e", "f"])
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, first_rows_fname)))
+
+            store.close()
+            store = TagsStore(temp_dir, Tag)
+            self.assertEqual(store["/repo/foo.py"], dict(mtime=3, data=new_tags))
+            self.assertEqual(store["/repo/bar.py"]["data"], make_tags("bar.py", ["d", "e"]))
+
+    def test_delete(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            store = TagsStore(temp_dir, Tag)
+            store["/repo/foo.py"] = dict(mtime=1, data=make_tags("foo.py", ["a"]))
+            store.flush()
+
+            del store["/repo/foo.py"]
+            self.assertNotIn("/repo/foo.py", store)
+            with self.assertRaises(KeyError):
+                del store["/repo/foo.py"]
+            store.flush()
+            store.close()
+
+            self.assertEqual(len(TagsStore(temp_dir, Tag)), 0)
+
+    def test_corrupt_index_is_discarded(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, TagsStore.INDEX_FNAME), "wb") as f:
+                f.write(b"not a pickle")
+
+            store = TagsStore(temp_dir, Tag)
+            self.assertEqual(len(store), 0)
+
+            tags = make_tags("foo.py", ["a"])
+            store["/repo/foo.py"] = dict(mtime=1, data=tags)
+            store.flush()
+            store.close()
+            self.assertEqual(TagsStore(temp_dir, Tag)["/repo/foo.py"]["data"], tags)
+
+    def test_truncated_rows_are_discarded(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            store = TagsStore(temp_dir, Tag)
+            store["/repo/foo.py"] = dict(mtime=1, data=make_tags("foo.py", ["a", "b"]))
+            store.flush()
+            store.close()
+
+            with open(os.path.join(temp_dir, store.rows_fname), "r+b") as f:
+                f.truncate(5)
+
+            self.assertEqual(len(TagsStore(temp_dir, Tag)), 0)